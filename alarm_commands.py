@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: MIT
+
+# Command pipeline for the alarm management feed
+# The MQTT callback only puts the command on a small queue, a worker task carries it out
+# so code entry never runs inside the callback and never holds up zone detection
+
+# The worker handles at most one command every data["alarm_command_interval"] seconds
+# After data["alarm_max_attempts"] wrong codes in a row, commands are refused for data["alarm_lockout_seconds"]
+# Commands arriving while the queue is full are dropped
+# Results are reported through the publish queue on the siren feed
+
+import asyncio
+from adafruit_ticks import ticks_ms, ticks_add, ticks_less
+import config_compiler
+import local_logger as logger
+import publish_queue
+import alarm_handler
+import heap_telemetry
+import task_supervisor
+import cadence
+
+try:
+    from data import data
+except ImportError:
+    print("Alarm information stored in data.py, please create file")
+    raise
+
+command_pipeline = None
+
+
+# Create the command pipeline singleton
+def _addCommandPipeline():
+    global command_pipeline
+
+    if command_pipeline is None:
+        command_pipeline = CommandPipeline(data.get("alarm_command_queue_size", 4),
+                                           data.get("alarm_command_interval", 0.5),
+                                           data.get("alarm_max_attempts", 5),
+                                           data.get("alarm_lockout_seconds", 60))
+
+
+# Get the command pipeline singleton
+def getCommandPipeline():
+    _addCommandPipeline()
+    return command_pipeline
+
+
+class CommandPipeline:
+
+    # Should never be called directly, use getCommandPipeline() instead
+    def __init__(self, size, interval, max_attempts, lockout_seconds):
+        self.size = size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.lockout_ms = int(lockout_seconds * 1000)
+        self.queue = []
+        self.dropped = 0
+        self.failures = 0
+        self.locked_until = None
+        self.topic = config_compiler.getConfig()["siren_topic"]
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return True while wrong codes have locked out the alarm management feed
+    def is_locked(self):
+        if self.locked_until is None:
+            return False
+        if ticks_less(ticks_ms(), self.locked_until):
+            return True
+        self.locked_until = None
+        return False
+
+    # Return the number of commands dropped because the queue was full
+    def get_dropped(self):
+        return self.dropped
+
+    # --- Pipeline --- #
+
+    # Called from the MQTT callback, queues the command and returns straight away
+    # Returns False if the queue is full and the command was dropped
+    def submit(self, text):
+        if len(self.queue) >= self.size:
+            self.dropped += 1
+            return False
+        self.queue.append(text)
+        return True
+
+    # Carry out one command and report the result
+    def process(self, text):
+        if self.is_locked() is True:
+            self.report("Too many incorrect codes, commands are locked out", "warning")
+            return
+
+        command = alarm_handler.parse_command(text)
+        if command is None:
+            self.report("Unreadable command, system state unchanged", "warning")
+            return
+
+        alarm = alarm_handler.get_alarm_prime()
+        message, level, accepted = alarm.handle_command(command[0], command[1], command[2], command[3])
+        if accepted is True:
+            self.failures = 0
+        else:
+            self.failures += 1
+            if self.failures >= self.max_attempts:
+                self.failures = 0
+                self.locked_until = ticks_add(ticks_ms(), self.lockout_ms)
+                message += "; locked out for " + str(self.lockout_ms // 1000) + " seconds"
+                level = "critical"
+        self.report(message, level)
+
+    # Log the result and queue it for the siren feed
+    def report(self, message, level):
+        self.my_log.log_message(message, level)
+        publish_queue.enqueue(self.topic, message, level, publish_queue.PRIORITY_HIGH)
+
+    # Worker task, takes commands off the queue one at a time
+    # Waits as long as the cadence says between looks at the queue
+    # Beats as the supervisor's alarm_commands task when it is supervised
+    async def run(self):
+        commands_heap = heap_telemetry.register("alarm_commands")
+        pace = cadence.getCadence()
+        supervisor = task_supervisor.getSupervisor()
+        heartbeat = None
+        if "alarm_commands" in supervisor.names:
+            heartbeat = supervisor.find("alarm_commands")
+        while True:
+            if heartbeat is not None:
+                supervisor.beat(heartbeat)
+            if len(self.queue) > 0:
+                started = heap_telemetry.begin()
+                self.process(self.queue.pop(0))
+                heap_telemetry.end(commands_heap, started)
+                await asyncio.sleep(self.interval)
+            else:
+                await asyncio.sleep(pace.wait)
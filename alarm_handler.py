@@ -4,15 +4,40 @@
 # Will set a variable based on if it matches the code provided to the topic
 # Will disable the siren if we are in an alarm state and the proper code is entered
 # Can handle excluded zones
+# Arming waits data["exit_delay"] seconds and a zone tripped while armed waits data["entry_delay"] seconds before the
+# siren sounds, both run on the timer wheel and are cancelled by disarming
+# Zones that were open when the siren timed out can only trip it again once they have closed
+
+# Zones are grouped into partitions, system_data["partitions"], each armed and disarmed on its own
+# The partitions armed are a bitmask over the partition indexes, the zones they cover and the zones that sound the
+# siren yelping are bitmasks over the zone indexes, rebuilt only when a partition is armed or disarmed
+# A trip check is then the open zone bitmask ANDed with the armed zones, no zone or exclusion is looked at
+# A zone in an armed yelp partition yelps the siren, otherwise it sounds steady
 
-import re
 import os
 import local_logger as logger
+import config_compiler
+import publish_queue
 import siren
 import zone
-
-alarm_set = None
-excludes = []
+import state_store
+import latency
+import log_levels
+import timer_wheel
+import event_history
+
+ACTION_TOGGLE = 0  # arm if disarmed, disarm if armed
+ACTION_ARM = 1
+ACTION_DISARM = 2
+ACTION_EXCLUDE = 3
+action_words = {"arm": ACTION_ARM, "disarm": ACTION_DISARM, "exclude": ACTION_EXCLUDE}
+
+alarm_set = None  # True while any partition is armed
+armed_partitions = 0  # bitmask of the armed partitions
+armed_mask = 0  # bitmask of the zones in the armed partitions
+yelp_mask = 0  # bitmask of the zones in the armed partitions that yelp the siren
+excludes = set()
+excluded_mask = None  # bitmask of the excluded zones, None when it has to be rebuilt from excludes
 alarm_prime = None
 
 try:
@@ -37,47 +62,99 @@ def get_alarm_prime():
     return alarm_prime
 
 
-# --- Setters --- #
+code_length = len(str(data["alarm_code"]))
+
+
+# --- Commands --- #
+
+# Read a command sent to the alarm management feed, returns (action, code, zone ids, partition names) or None
+# The partition names are None when the command is for every partition
+# <code>                        arm if disarmed, disarm if armed
+# <code><zone><zone>...         same, every digit after the code is a zone to exclude
+# <code>*<zone>*<zone>...       same, zones separated by * (or , or space) so zone ids can be more than one digit
+# arm <code> [<zone> ...]       arm, excluding the zones
+# disarm <code>                 disarm
+# exclude <code> <zone> ...     exclude zones without changing the armed state
+# arm <partition>[,<partition>...] <code> [<zone> ...]
+# disarm <partition>[,<partition>...] <code>
+#                               arm or disarm only the partitions named
+def parse_command(text):
+    text = str(text).strip()
+    action = ACTION_TOGGLE
+    partitions = None
+
+    split = text.find(" ")
+    if split > 0 and not text[:split].isdigit():
+        action = action_words.get(text[:split].lower())
+        if action is None:
+            return None
+        text = text[split + 1:].strip()
+        split = text.find(" ")
+        if split > 0 and text[0].isalpha():
+            partitions = [name for name in text[:split].lower().split(",") if len(name) > 0]
+            text = text[split + 1:].strip()
+
+    text = text.replace(",", "*").replace(" ", "*")
+    if "*" in text:
+        parts = text.split("*")
+        code = parts[0]
+        zones = [part for part in parts[1:] if len(part) > 0]
+    else:
+        code = text[:code_length]
+        zones = list(text[code_length:])
 
+    if not code.isdigit():
+        return None
+    for zone_id in zones:
+        if not zone_id.isdigit():
+            return None
+    return action, int(code), zones, partitions
 
-# Done on system start up
-# alarm armed/disarmed state is stored on the system in the alarm_state.txt file
-# We need to read this in on startup to see if the system is armed
-def set_alarm_state():
-    global alarm_set
 
-    a_file = "/sd/" + data["alarm_state_file"]
-    try:
-        with open(a_file, 'r') as alarm:
-            current_state = alarm.read()
-        alarm.close()
-    except OSError:
-        current_state = "False"
-        pass
+# --- Setters --- #
 
-    if current_state is "False":
-        current_state = False
-    else:
-        current_state = True
 
-    alarm_set = current_state
+# Done on system start up
+# each partition's armed/disarmed state is kept in the state store as armed:<partition name>
+# We need to read this in on startup to see which partitions are armed
+# Systems that have not saved partitions yet have one armed state for the whole system, in the state store as armed
+# or in the alarm_state.txt file, it arms or disarms every partition
+def set_alarm_state():
+    store = state_store.getStateStore()
+    partitions = get_partitions()
+    bits = 0
+    saved = False
+    for index in range(len(partitions)):
+        current_state = store.get("armed:" + partitions[index][config_compiler.PARTITION_NAME])
+        if current_state is not None:
+            saved = True
+            if current_state == "True":
+                bits |= 1 << index
+
+    if saved is False:
+        current_state = store.get("armed")
+        if current_state is None:
+            current_state = _read_legacy_alarm_state()
+        if current_state == "True":
+            bits = get_all_partitions()
+
+    _set_armed_partitions(bits)
 
 
 # Done on system start up
 # if the system is armed then we need to ensure we have the excluded zones
-# the excluded zone list is stored on the system in the excludes.txt file
+# the excluded zone list is kept in the state store as comma separated zone names
+# Systems that have not saved to the state store yet still have it in the excludes.txt file, one zone name per line
 def set_zone_exclusions():
     global excludes
 
-    e_file = "/sd/" + data["excluded_zones_file"]
-    try:
-        if os.stat(e_file)[6] > 0:
-            with open(e_file, 'r') as ex:
-                excludes.append(ex.read())
-            ex.close()
-    except OSError:
-        print("No excluded zones")
-        pass
+    saved = state_store.getStateStore().get("excludes")
+    if saved is None:
+        _read_legacy_excludes()
+        return
+
+    for name in saved.split(","):
+        _load_exclusion(name)
 
 
 # --- Getters --- #
@@ -87,83 +164,219 @@ def get_alarm_state():
     return alarm_set
 
 
-# Return excluded zones list
-# Gets this information from the exclusions.txt file
+# Return the compiled partitions, see config_compiler
+def get_partitions():
+    return config_compiler.getConfig()["partitions"]
+
+
+# Return the bitmask of every partition
+def get_all_partitions():
+    return (1 << len(get_partitions())) - 1
+
+
+# Return the bitmask of the partitions called names, or None if a name is not a partition
+def get_partition_bits(names):
+    partitions = get_partitions()
+    bits = 0
+    for name in names:
+        for index in range(len(partitions)):
+            if partitions[index][config_compiler.PARTITION_NAME] == name:
+                bits |= 1 << index
+                break
+        else:
+            return None
+    return bits
+
+
+# Return the bitmask of the zones in the partitions of bits
+def get_partition_zones(bits):
+    partitions = get_partitions()
+    mask = 0
+    for index in range(len(partitions)):
+        if bits & (1 << index):
+            mask |= partitions[index][config_compiler.PARTITION_MASK]
+    return mask
+
+
+# Return the names of the armed partitions
+def get_armed_partitions():
+    return _partition_names(armed_partitions)
+
+
+# Return the set of excluded zone names
 def get_exclusions():
     return excludes
 
 
 # If a code is sent with more numeral that the base code, the additional numeral identify zones to be excluded
 # when determining if the siren should sound
+# The feed to zone name map is built once by zone.buildZones()
 def get_zone_exclusion_state(feed):
-    regex = re.compile("monitoring.")
-    feed_array = regex.split(feed)
-    topic = feed_array[1]
-    if topic in excludes:
-        return True
-    else:
-        return False
+    name = zone.feed_zone_names.get(feed)
+    if name is None:
+        name = zone.get_feed_zone_name(feed)
+    return name in excludes
+
+
+# Return the bitmask of excluded zones
+# Rebuilt from the excludes set only after the exclusions change
+def get_excluded_mask():
+    global excluded_mask
+
+    if excluded_mask is None:
+        mask = 0
+        for name in excludes:
+            mask |= zone.exclusion_bits.get(name, 0)
+        if len(zone.getZones()) == 0:
+            return mask  # zones are not built yet, do not keep a mask that cannot see them
+        excluded_mask = mask
+    return excluded_mask
+
+
+# Return the bitmask of zones that are open and not excluded, any bit set in a partition's zones means the partition
+# cannot be armed
+def get_blocking_mask():
+    return zone.get_open_mask() & ~get_excluded_mask()
+
+
+# Return True if no zone that is open blocks arming the partitions of bits, every partition if bits is not given
+def can_arm(bits=None):
+    if bits is None:
+        bits = get_all_partitions()
+    return get_blocking_mask() & get_partition_zones(bits) == 0
 
 
 # --- General Helpers --- #
 
 # Alternate way to add an exclusion.
 def add_exclusion(name):
-    excludes.append(name)
-    _write_excludes(name)
+    global excluded_mask
+
+    if name not in excludes:
+        excludes.add(name)
+        excluded_mask = None
+        _write_excludes()
 
 
 # --- Private Methods --- #
 
 
 # Private method
-# Will write the updated alarm state value to the alarm_state.txt file
-def _write_alarm_state(value):
+# Will save the armed state of every partition, it is written to the SD card on the next state store flush
+def _write_alarm_state():
+    store = state_store.getStateStore()
+    partitions = get_partitions()
+    for index in range(len(partitions)):
+        armed = armed_partitions & (1 << index) != 0
+        store.set("armed:" + partitions[index][config_compiler.PARTITION_NAME], str(armed))
+
+
+# Private method
+# Sets the armed partitions and rebuilds the zone bitmasks that go with them
+def _set_armed_partitions(bits):
+    global alarm_set, armed_partitions, armed_mask, yelp_mask
+
+    partitions = get_partitions()
+    mask = 0
+    yelp = 0
+    for index in range(len(partitions)):
+        if bits & (1 << index):
+            mask |= partitions[index][config_compiler.PARTITION_MASK]
+            if partitions[index][config_compiler.PARTITION_SIREN] == "yelp":
+                yelp |= partitions[index][config_compiler.PARTITION_MASK]
+    armed_partitions = bits
+    armed_mask = mask
+    yelp_mask = yelp
+    alarm_set = bits != 0
+    event_history.set_armed(alarm_set)
+
+
+# Private method
+# Returns the names of the partitions of bits
+def _partition_names(bits):
+    partitions = get_partitions()
+    return [partitions[index][config_compiler.PARTITION_NAME] for index in range(len(partitions))
+            if bits & (1 << index)]
+
+
+# Private method
+# Returns what to call the partitions of bits in a message, System when it is every partition
+def _partition_label(bits):
+    if bits == get_all_partitions():
+        return "System"
+    return "Partition " + ", ".join(_partition_names(bits))
+
+
+# Private method
+# Reads the armed state from the alarm_state.txt file used before the state store
+def _read_legacy_alarm_state():
+    a_file = data.get("sd_mount", "/sd") + "/" + data.get("alarm_state_file", "")
     try:
-        a_file = "/sd/" + data["alarm_state_file"]
-        file = open(a_file, 'w')
-        file.write(value)
-        file.close()
+        with open(a_file, 'r') as alarm:
+            current_state = alarm.read().strip()
+        alarm.close()
     except OSError:
-        print("unable to create/write to file", data["alarm_state_file"])
+        current_state = "False"
         pass
+    return current_state
 
 
 # Private method
-# Adds excluded zones to the excludes.txt file
-def _write_excludes(name):
-    e_file = "/sd/" + data["excluded_zones_file"]
+# Reads the excluded zones from the excludes.txt file used before the state store
+def _read_legacy_excludes():
+    e_file = data.get("sd_mount", "/sd") + "/" + data.get("excluded_zones_file", "")
     try:
-        file = open(e_file, 'a')
+        if os.stat(e_file)[6] > 0:
+            with open(e_file, 'r') as ex:
+                for line in ex:
+                    _load_exclusion(line.strip())
+            ex.close()
     except OSError:
-        file = open(e_file, 'w')
+        print("No excluded zones")
         pass
 
-    file.write(name)
-    file.close()
+
+# Private method
+# Adds one line of the excludes.txt file to the exclusion set
+# Files written before exclusions were newline delimited hold every name on one line, e.g. zone-3zone-4
+def _load_exclusion(line):
+    global excluded_mask
+
+    if len(line) == 0:
+        return
+    excluded_mask = None
+    if line.count("zone-") > 1:
+        for name in line.split("zone-"):
+            if len(name) > 0:
+                excludes.add("zone-" + name)
+    else:
+        excludes.add(line)
+
+
+# Private method
+# Saves the excluded zones, comma separated
+def _write_excludes():
+    state_store.getStateStore().set("excludes", ",".join(excludes))
 
 
 # Private method
-# Clears the excluded.txt file when the system is disarmed
-# Clears the excludes array
+# Clears the saved excluded zones when the system is disarmed
+# Clears the excludes set
 def _clear_excludes():
-    e_file = "/sd/" + data["excluded_zones_file"]
-    file = open(e_file, 'w')
-    file.close()
-    excludes.clear()
+    global excluded_mask
 
+    excludes.clear()
+    excluded_mask = 0
+    state_store.getStateStore().set("excludes", "")
 
-def _check_for_open_zone():
-    open_zones = []
-    zone_list = zone.getZones()
-    for z in range(len(zone_list)):
-        tmp_zone = zone_list[z]
-        is_excluded = get_zone_exclusion_state(tmp_zone.feed_name)
-        if tmp_zone.state_value == 1 and is_excluded is False:
-            open_zones.append(tmp_zone.name)
 
-    if len(open_zones) != 0:
-        return True, open_zones
+# Private method
+# The zones keep the open zone bitmask up to date, no zone is scanned here
+# The list of open zones is only built when there is an open zone to report
+def _check_for_open_zone(bits):
+    blocking = get_blocking_mask() & get_partition_zones(bits)
+    if blocking != 0:
+        return True, zone.get_zone_names(blocking)
     else:
         return False, ""
 
@@ -172,56 +385,190 @@ def _check_for_open_zone():
 class Alarm:
     def __init__(self):
         self.my_log = logger.getLocalLogger()
+        self.my_siren = siren.getSiren()
+        self.my_siren.on_timeout = self._siren_timed_out
+        self.topic = config_compiler.getConfig()["siren_topic"]
+        self.exit_delay = data.get("exit_delay", 0)
+        self.entry_delay = data.get("entry_delay", 0)
+        self.arming_timer = None  # running while the exit delay counts down
+        self.arming_partitions = 0  # partitions that will be armed when the exit delay is over
+        self.entry_timer = None  # running while the entry delay counts down
+        self.entry_mask = 0  # zones that started the entry delay
+        self.silenced_mask = 0  # zones that were open when the siren timed out
+        if alarm_set is None:
+            set_alarm_state()
 
-    # Called when the proper code is sent to the alarm IO feed
-    # Depending on the alarm_set value will enable or disable the alarm state
-    def manage_alarm(self, num):
-        global alarm_set, excludes
-
-        my_siren = siren.getSiren()
+    # Return True while the exit delay is counting down
+    def is_arming(self):
+        return self.arming_timer is not None
+
+    # Called after the zones have been updated
+    # Sounds the siren, or starts the entry delay, if a zone of an armed partition that is not excluded is open
+    # Returns True if the alarm is tripped
+    def check_zones(self):
+        latency.mark(latency.STAGE_ALARM)
+        if alarm_set is not True:
+            latency.end_edge()
+            return False
+        blocking = zone.get_open_mask() & armed_mask & ~get_excluded_mask()
+        self.silenced_mask &= blocking  # zones that have closed since the time out can trip the siren again
+        blocking &= ~self.silenced_mask
+        if blocking == 0:
+            latency.end_edge()
+            return False
+
+        if self.my_siren.get_siren_state() is True and self.entry_timer is None:
+            if self.entry_delay > 0:
+                self.entry_mask = blocking
+                self.entry_timer = timer_wheel.schedule(self.entry_delay, self._entry_expired)
+                if log_levels.enabled("warning") is True:
+                    self.my_log.log_message("Entry delay started by: " + str(zone.get_zone_names(blocking)), "warning")
+            else:
+                self._trip(blocking)
+        latency.end_edge()
+        return True
 
-        ac = data["alarm_code"]
+    # Called when a command is sent to the alarm IO feed, see parse_command() for what it can hold
+    # Returns the message and log level to report
+    def manage_alarm(self, num):
+        command = parse_command(num)
+        if command is None:
+            return "Unreadable command, system state unchanged", "warning"
+        message, level, accepted = self.handle_command(command[0], command[1], command[2], command[3])
+        return message, level
 
-        if len(num) <= 3:
-            num = int(num)
-        else:
-            orig_num = num
-            code = num[0] + num[1] + num[2] + num[3]
-            num = int(code)
-            for value in range(len(orig_num)):
-                if value > 3:
-                    zone_name = "zone-" + orig_num[value]
-                    excludes.append(zone_name)
-                    _write_excludes(zone_name)
+    # Carry out a parsed command, nothing is changed unless the code is correct
+    # partitions are the names of the partitions to arm or disarm, None for all of them
+    # Returns the message and log level to report, and whether the code was correct
+    def handle_command(self, action, code, zones, partitions=None):
+        if code != data["alarm_code"]:
+            return "Incorrect code, system state unchanged", "warning", False
 
         if alarm_set is None:
             set_alarm_state()
-            current_state = alarm_set
+        if log_levels.enabled("debug") is True:
+            self.my_log.log_message("current state is " + str(get_armed_partitions()), "debug")
+
+        if partitions is None:
+            bits = get_all_partitions()
         else:
-            current_state = alarm_set
+            bits = get_partition_bits(partitions)
+            if bits is None:
+                return "Unknown partition in " + ", ".join(partitions) + ", system state unchanged", "warning", True
+
+        for zone_id in zones:
+            add_exclusion("zone-" + zone_id)
 
-        self.my_log.log_message("current state is " + str(current_state), "debug")
-        if num == ac:
-            if current_state is False:
-                open_zone = _check_for_open_zone()
+        if action == ACTION_TOGGLE:
+            if (armed_partitions | self.arming_partitions) & bits:
+                action = ACTION_DISARM
+            else:
+                action = ACTION_ARM
+
+        level = "info"
+        label = _partition_label(bits)
+        if action == ACTION_ARM:
+            to_arm = bits & ~armed_partitions
+            if to_arm == 0:
+                message = label + " already armed"
+            elif to_arm & ~self.arming_partitions == 0:
+                message = label + " already arming"
+            elif self.arming_timer is not None:
+                message = _partition_label(self.arming_partitions) + " already arming"
+            else:
+                open_zone = _check_for_open_zone(to_arm)
                 if open_zone[0] is True:
-                    message = "Cannot arm system; the following zone(s) are open: " + str(open_zone[1])
-                    level = "info"
+                    message = "Cannot arm " + label.lower() + "; the following zone(s) are open: " + str(open_zone[1])
+                elif self.exit_delay > 0:
+                    self.arming_partitions = to_arm
+                    self.arming_timer = timer_wheel.schedule(self.exit_delay, self._exit_expired)
+                    message = label + " arming in " + str(self.exit_delay) + " seconds"
                 else:
-                    alarm_set = True
-                    _write_alarm_state("True")
-                    message = "System armed"
-                    level = "info"
+                    self._arm(to_arm)
+                    message = label + " armed"
+        elif action == ACTION_DISARM:
+            if (armed_partitions | self.arming_partitions) & bits:
+                self._disarm(bits)
+                message = label + " disarmed"
             else:
-                alarm_set = False
-                if my_siren.get_siren_state() is False:
-                    my_siren.disable()
-                _write_alarm_state("False")
-                _clear_excludes()
-                message = "System disarmed"
-                level = "info"
+                message = label + " already disarmed"
         else:
-            message = "Incorrect code, system state unchanged"
-            level = "warning"
-
-        return message, level
+            message = "Excluded zone(s): " + ", ".join(sorted(excludes))
+
+        # Armed state and exclusions are saved before the result is reported, all in one write
+        state_store.getStateStore().flush()
+
+        return message, level, True
+
+    # --- Private Methods --- #
+
+    # Arm the partitions of bits, the system event is recorded when the first partition is armed
+    def _arm(self, bits):
+        if alarm_set is not True:
+            event_history.record(event_history.ZONE_SYSTEM, 0, 1)
+        _set_armed_partitions(armed_partitions | bits)
+        _write_alarm_state()
+
+    # Disarm the partitions of bits, and stop them arming if the exit delay is counting down
+    # The siren and entry delay are only stopped once no armed zone is holding them
+    # Exclusions are cleared once every partition is disarmed
+    def _disarm(self, bits):
+        if self.arming_partitions & bits:
+            self.arming_partitions &= ~bits
+            if self.arming_partitions == 0:
+                timer_wheel.cancel(self.arming_timer)
+                self.arming_timer = None
+
+        if armed_partitions & bits:
+            _set_armed_partitions(armed_partitions & ~bits)
+            if alarm_set is False:
+                event_history.record(event_history.ZONE_SYSTEM, 1, 0)
+            _write_alarm_state()
+        self.silenced_mask &= armed_mask
+        if self.entry_timer is not None and self.entry_mask & armed_mask == 0:
+            timer_wheel.cancel(self.entry_timer)
+            self.entry_timer = None
+        if self.my_siren.get_siren_state() is False and \
+                zone.get_open_mask() & armed_mask & ~get_excluded_mask() & ~self.silenced_mask == 0:
+            event_history.record(event_history.ZONE_SIREN, 1, 0)
+            self.my_siren.disable()
+        if alarm_set is False:
+            self.silenced_mask = 0
+            _clear_excludes()
+
+    # Sound the siren, mask holds the zones that tripped it
+    # Yelps if any of them is in an armed yelp partition, otherwise sounds steady
+    def _trip(self, mask):
+        # The zone names are only looked up and formatted if the message will be reported
+        if log_levels.enabled("critical") is True:
+            log_message = "Alarm tripped by: " + str(zone.get_zone_names(mask))
+            self.my_log.log_message(log_message, "critical")
+        event_history.record(event_history.ZONE_SIREN, 0, 1)
+        if mask & yelp_mask:
+            self.my_siren.yelp()
+        else:
+            self.my_siren.steady()
+
+    # Called by the timer wheel when the exit delay is over
+    # A zone still open now is handled by check_zones() like any other, it starts the entry delay
+    def _exit_expired(self, argument):
+        bits = self.arming_partitions
+        self.arming_timer = None
+        self.arming_partitions = 0
+        self._arm(bits)
+        state_store.getStateStore().flush()
+        message = _partition_label(bits) + " armed"
+        self.my_log.log_message(message, "info")
+        publish_queue.enqueue(self.topic, message, "info", publish_queue.PRIORITY_HIGH)
+
+    # Called by the timer wheel when the entry delay is over without the zones' partitions being disarmed
+    def _entry_expired(self, argument):
+        self.entry_timer = None
+        mask = self.entry_mask & armed_mask
+        if mask != 0 and self.my_siren.get_siren_state() is True:
+            self._trip(mask)
+
+    # Called by the siren once it has timed out, the zones open now stay quiet until they close
+    def _siren_timed_out(self):
+        self.silenced_mask = zone.get_open_mask() & armed_mask & ~get_excluded_mask()
+        event_history.record(event_history.ZONE_SIREN, 1, 0)
@@ -0,0 +1,399 @@
+# SPDX-License-Identifier: MIT
+
+# End to end latency and throughput benchmarks for the alarm panel
+# Runs the real zone, alarm, siren and publish code on the host against the simulation backend (sim/)
+# python3 bench/bench_alarm.py [--json] [--samples N] [--tick SECONDS] [--stall-seconds SECONDS]
+
+# Measures:
+# edge_to_siren    zone pin opens while armed -> siren output driven
+# edge_to_publish  zone pin changes -> zone change message received by the broker
+# throughput       zone events per second through detection -> report -> alarm check
+# Scenarios:
+# burst            every zone opens at once
+# code_entry       rapid wrong and right codes through the command pipeline and its worker task
+# outage           broker down: siren latency, queued and spooled backlog and how long it takes to drain once back
+# loop_stall       code.py's own asyncio tasks (MQTT listener, publish pump, relay pulse on the timer wheel, zone
+#                  scan, ...) against the simulated broker while PIR triggers and zone changes arrive, reports the
+#                  longest time the event loop went without running a task that was due
+
+import os
+import sys
+import json
+import time
+import runpy
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim  # noqa: E402
+
+sim.install()
+
+import board  # noqa: E402
+import broker  # noqa: E402
+import digitalio  # noqa: E402
+import local_mqtt  # noqa: E402
+import alarm_commands  # noqa: E402
+import alarm_handler  # noqa: E402
+import latency  # noqa: E402
+import publish_queue  # noqa: E402
+import siren  # noqa: E402
+import state_store  # noqa: E402
+import timer_wheel  # noqa: E402
+import zone  # noqa: E402
+import zone_events  # noqa: E402
+import cadence  # noqa: E402
+import connection  # noqa: E402
+import task_supervisor  # noqa: E402
+from data import data  # noqa: E402
+from system_data import system_data  # noqa: E402
+
+tick_sleep = 0.001
+probe_interval = 0.005  # seconds the loop stall probe asks to sleep
+command_gap = 0.2  # seconds between codes in the code entry scenario
+detector = None
+alarm = None
+queue = None
+
+
+# Return p50, p95 and max of a list of nanosecond samples, in milliseconds
+def summarize(samples):
+    if len(samples) == 0:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None, "samples": 0}
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] / 1e6, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] / 1e6, 3),
+        "max_ms": round(ordered[-1] / 1e6, 3),
+        "samples": len(ordered),
+    }
+
+
+# One pass of the panel loop: detect, check the alarm, send queued messages, save state, turn the timers
+def tick():
+    detector.update()
+    alarm.check_zones()
+    queue.flush()
+    state_store.getStateStore().flush()
+    timer_wheel.getWheel().service()
+
+
+# Tick until condition() is true or timeout seconds have gone by
+def run_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while condition() is False:
+        if time.monotonic() > deadline:
+            return False
+        tick()
+        if tick_sleep > 0:
+            time.sleep(tick_sleep)
+    return True
+
+
+def setup():
+    global detector, alarm, queue
+
+    # Made as the connection task leaves it on the board once connected, where nothing publishes before that
+    local_mqtt.getMqtt(use_logger=True).mqtt_client._socket_timeout = data.get("mqtt_poll_timeout", 0.01)
+    detector = zone_events.getDetector(mqtt=True)
+    alarm = alarm_handler.get_alarm_prime()
+    queue = publish_queue.getPublishQueue()
+    for z in zone.getZones():
+        digitalio.set_level(z.pinID, False)
+    alarm_handler.set_alarm_state()
+    run_until(lambda: zone.getZones()[0].on_startup is False)
+    queue.flush(1000)
+
+
+# Bring every zone back to closed, the siren off and the system disarmed
+def settle():
+    for z in zone.getZones():
+        digitalio.set_level(z.pinID, False)
+    run_until(lambda: zone.get_open_mask() == 0)
+    if alarm_handler.get_alarm_state() is True:
+        alarm.manage_alarm(str(data["alarm_code"]))
+    my_siren = siren.getSiren()
+    if my_siren.get_siren_state() is False:
+        my_siren.disable()
+    queue.flush(1000)
+
+
+def siren_on():
+    output = digitalio.get_output(system_data["siren_yelp"])
+    return output is not None and output[0] is False
+
+
+def bench_edge_to_siren(samples):
+    results = []
+    pin = zone.getZones()[0].pinID
+    for _ in range(samples):
+        settle()
+        alarm.manage_alarm(str(data["alarm_code"]))
+        start = time.monotonic_ns()
+        digitalio.set_level(pin, True)
+        if run_until(siren_on):
+            results.append(digitalio.get_output(system_data["siren_yelp"])[1] - start)
+    settle()
+    return summarize(results)
+
+
+def bench_edge_to_publish(samples):
+    results = []
+    first = zone.getZones()[0]
+    seen = []
+
+    def listener(topic, message, timestamp):
+        if first.name + " state has changed" in str(message):
+            seen.append(timestamp)
+
+    broker.listeners.append(listener)
+    for sample in range(samples):
+        settle()
+        seen.clear()
+        start = time.monotonic_ns()
+        digitalio.set_level(first.pinID, True)
+        if run_until(lambda: len(seen) > 0):
+            results.append(seen[0] - start)
+    broker.listeners.remove(listener)
+    settle()
+    return summarize(results)
+
+
+# Debouncing is turned off so every edge is an event
+def bench_throughput(events):
+    settle()
+    windows = list(detector.debouncer.windows)
+    for index in range(len(windows)):
+        detector.debouncer.windows[index] = 0
+
+    pin = zone.getZones()[0].pinID
+    level = False
+    start = time.monotonic_ns()
+    for _ in range(events):
+        level = not level
+        digitalio.set_level(pin, level)
+        detector.update()
+        alarm.check_zones()
+    elapsed = time.monotonic_ns() - start
+
+    for index in range(len(windows)):
+        detector.debouncer.windows[index] = windows[index]
+    settle()
+    return {"events": events, "events_per_s": round(events / (elapsed / 1e9), 1)}
+
+
+def scenario_burst(samples):
+    results = []
+    zones = zone.getZones()
+    for _ in range(samples):
+        settle()
+        start = time.monotonic_ns()
+        for z in zones:
+            digitalio.set_level(z.pinID, True)
+        if run_until(lambda: zone.get_open_mask() == detector.mask):
+            results.append(time.monotonic_ns() - start)
+    settle()
+    result = summarize(results)
+    result["zones"] = len(zones)
+    return result
+
+
+# Codes go in as the MQTT callback puts them in: submitted to the command pipeline every command_gap seconds, which
+# is faster than the pipeline's worker takes them, and carried out by the worker task itself
+# Reports the time from submit to the result being reported, and how many commands the full queue dropped
+def scenario_code_entry(commands):
+    settle()
+    pipeline = alarm_commands.getCommandPipeline()
+    pace = cadence.getCadence()
+    wrong = str((data["alarm_code"] + 1) % 10000)
+    right = str(data["alarm_code"])
+    waiting = []  # time.monotonic_ns() each queued command was submitted, oldest first
+    results = []
+    report = pipeline.report
+
+    def timed_report(message, level):
+        results.append(time.monotonic_ns() - waiting.pop(0))
+        report(message, level)
+
+    async def enter_codes():
+        worker = asyncio.create_task(pipeline.run())
+        for command in range(commands):
+            pace.touch()
+            submitted = time.monotonic_ns()
+            if pipeline.submit(right if command % 3 == 2 else wrong) is True:
+                waiting.append(submitted)
+            await asyncio.sleep(command_gap)
+        deadline = time.monotonic() + (len(waiting) + 1) * pipeline.interval + pace.poll_slow
+        while len(waiting) > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    dropped_before = pipeline.get_dropped()
+    pipeline.report = timed_report
+    try:
+        asyncio.run(enter_codes())
+    finally:
+        pipeline.report = report
+    settle()
+    result = summarize(results)
+    result["submitted"] = commands
+    result["dropped"] = pipeline.get_dropped() - dropped_before
+    return result
+
+
+def scenario_outage(samples):
+    settle()
+    dropped_before = queue.get_counters()[0]
+    broker.online = False
+    siren_results = []
+    pin = zone.getZones()[0].pinID
+    for _ in range(samples):
+        settle()
+        alarm.manage_alarm(str(data["alarm_code"]))
+        start = time.monotonic_ns()
+        digitalio.set_level(pin, True)
+        if run_until(siren_on):
+            siren_results.append(digitalio.get_output(system_data["siren_yelp"])[1] - start)
+    settle()
+    backlog = queue.get_size()
+    spooled = queue.get_spooled()
+    dropped = queue.get_counters()[0] - dropped_before
+
+    broker.online = True
+    start = time.monotonic_ns()
+    run_until(lambda: queue.get_size() == 0 and queue.get_spooled() == 0, timeout=10)
+    drain = time.monotonic_ns() - start
+
+    result = summarize(siren_results)
+    result["backlog"] = backlog
+    result["spooled"] = spooled
+    result["dropped"] = dropped
+    result["drain_ms"] = round(drain / 1e6, 3)
+    return result
+
+
+# Wake every probe_interval and record how late each wake up is, in nanoseconds
+async def stall_probe(stalls):
+    interval_ns = int(probe_interval * 1e9)
+    while True:
+        start = time.monotonic_ns()
+        await asyncio.sleep(probe_interval)
+        stalls.append(max(0, time.monotonic_ns() - start - interval_ns))
+
+
+# Once MQTT is up: a PIR trigger every relay pulse and a bit, and a zone opening or closing every half second
+async def stall_traffic(triggers):
+    link = connection.getConnection()
+    while link.is_up() is False:
+        await asyncio.sleep(0.05)
+    pir_topic = local_mqtt.get_formatted_topic("sensors/pir/bench")
+    pin = zone.getZones()[-1].pinID
+    level = False
+    passes = 0
+    while True:
+        if passes % int((data.get("relay_pulse", 4) + 1) / 0.5) == 0:
+            broker.deliver(pir_topic, "1")
+            triggers.append(time.monotonic_ns())
+        level = not level
+        digitalio.set_level(pin, level)
+        passes += 1
+        await asyncio.sleep(0.5)
+
+
+# Stand-in for asyncio.run while code.py runs: code.py's main() runs for seconds next to the probe and the traffic
+def stall_runner(run, seconds, stalls, triggers):
+    async def run_for(app):
+        asyncio.create_task(stall_probe(stalls))
+        asyncio.create_task(stall_traffic(triggers))
+        try:
+            await asyncio.wait_for(app, seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    return lambda app: run(run_for(app))
+
+
+def scenario_loop_stall(seconds):
+    settle()
+    stalls = []
+    triggers = []
+    relay = []  # (level, time.monotonic_ns()) of every relay change
+
+    def relay_watcher(pin, level, timestamp):
+        if pin is board.A5:
+            relay.append((level, timestamp))
+
+    digitalio.watchers.append(relay_watcher)
+    published_before = len(broker.published)
+    run = asyncio.run
+    asyncio.run = stall_runner(run, seconds, stalls, triggers)
+    try:
+        runpy.run_path(os.path.join(sim.repo_dir, "code.py"), run_name="__main__")
+    finally:
+        asyncio.run = run
+        digitalio.watchers.remove(relay_watcher)
+
+    # How far each relay pulse was from data["relay_pulse"] seconds long, triggers are far enough apart not to overlap
+    pulse_ns = int(data.get("relay_pulse", 4) * 1e9)
+    pulse_errors = []
+    for index in range(1, len(relay)):
+        if relay[index][0] is False and relay[index - 1][0] is True:
+            pulse_errors.append(relay[index][1] - relay[index - 1][1] - pulse_ns)
+    result = summarize(stalls)
+    result["seconds"] = seconds
+    result["pir_triggers"] = len(triggers)
+    result["relay_pulses"] = len(pulse_errors)
+    if len(pulse_errors) > 0:
+        result["relay_pulse_error_ms"] = [round(min(pulse_errors) / 1e6, 3), round(max(pulse_errors) / 1e6, 3)]
+    result["published"] = len(broker.published) - published_before
+    result["task_restarts"] = sum(task_supervisor.getSupervisor().restarts)
+    return result
+
+
+# Percentiles from the on-device latency histograms collected during the run
+def stage_percentiles():
+    stages = {}
+    for stage in range(len(latency.STAGE_NAMES)):
+        count, p50, p95, p99 = latency.get_percentiles(stage)
+        stages[latency.STAGE_NAMES[stage]] = {"n": count, "p50_us<=": p50, "p95_us<=": p95, "p99_us<=": p99}
+    return stages
+
+
+def main():
+    global tick_sleep
+
+    args = sys.argv[1:]
+    samples = 20
+    stall_seconds = 12
+    if "--samples" in args:
+        samples = int(args[args.index("--samples") + 1])
+    if "--tick" in args:
+        tick_sleep = float(args[args.index("--tick") + 1])
+    if "--stall-seconds" in args:
+        stall_seconds = float(args[args.index("--stall-seconds") + 1])
+
+    setup()
+    results = {
+        "detector": type(detector).__name__,
+        "zones": len(zone.getZones()),
+        "debounce_ms": system_data.get("zone_debounce_ms", 50),
+        "tick_s": tick_sleep,
+        "edge_to_siren": bench_edge_to_siren(samples),
+        "edge_to_publish": bench_edge_to_publish(samples),
+        "throughput": bench_throughput(samples * 100),
+        "burst": scenario_burst(samples),
+        "code_entry": scenario_code_entry(samples * 3),
+        "outage": scenario_outage(max(1, samples // 4)),
+        "loop_stall": scenario_loop_stall(stall_seconds),
+        "stages": stage_percentiles(),
+    }
+
+    if "--json" in args:
+        print(json.dumps(results, indent=2))
+    else:
+        for name in results:
+            print(name.ljust(16), results[name])
+
+
+if __name__ == "__main__":
+    main()
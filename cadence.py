@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: MIT
+
+# Adaptive polling cadence and light sleep
+# The zone scan, MQTT listener and command worker ask the cadence how long to wait between passes
+# busy:   a partition is armed or arming, the siren is sounding, or there was activity (a zone change, a command,
+#         a satellite event) in the last data["activity_hold"] seconds
+#         zones are scanned every system_data["zone_scan_interval"], MQTT and commands every data["poll_fast"]
+# quiet:  anything else, zones are scanned every system_data["zone_scan_quiet_interval"], MQTT and commands every
+#         data["poll_slow"], keypad still timestamps each zone change in the background, it is only reported later
+# asleep: quiet for data["idle_sleep_after"] seconds with no timer waiting and nothing queued to publish
+#         the board light sleeps for up to data["idle_sleep_max"] seconds at a time, woken early by any zone pin
+#         changing level
+
+# The zone pins are handed from keypad to the pin alarms for a sleep and back afterwards, the zones are then
+# resynchronized so a change made while asleep is reported like any other
+# Nothing runs while the board sleeps: MQTT messages are read when it wakes, the watchdog is fed before each sleep
+# and the supervisor is told how long it slept so no task counts as hung for it
+# A zone waiting to open wakes the board on its pin going high, that needs a pull up on the zone circuit,
+# the pin alarm can only pull the pin the other way
+# Light sleep needs CircuitPython's alarm module and keypad zone detection, without either the board only slows down
+
+# The time spent busy, quiet and asleep is kept and published with the supervisor figures
+
+import asyncio
+import time
+from adafruit_ticks import ticks_ms, ticks_diff
+import local_logger as logger
+import publish_queue
+import task_supervisor
+import config_compiler
+import timer_wheel
+import connection
+import alarm_handler
+import siren
+import zone_events
+
+try:
+    import alarm as sleep_alarm
+except ImportError:
+    sleep_alarm = None
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+try:
+    from system_data import system_data
+except ImportError:
+    print("System data must be in system_data.py, please create file")
+    raise
+
+STATE_BUSY = 0
+STATE_QUIET = 1
+STATE_ASLEEP = 2
+STATE_NAMES = ("busy", "quiet", "asleep")
+
+cadence = None
+
+
+# Create the cadence singleton
+def _addCadence():
+    global cadence
+
+    if cadence is None:
+        sleep_max = min(data.get("idle_sleep_max", 2), data["watchdog_timeout"] / 2)
+        cadence = Cadence(system_data.get("zone_scan_interval", 0.02), system_data.get("zone_scan_quiet_interval", 0.1),
+                          data.get("poll_fast", 0.1), data.get("poll_slow", 1), data.get("activity_hold", 30),
+                          data.get("idle_sleep_after", 120), sleep_max)
+
+
+# Get the cadence singleton
+def getCadence():
+    _addCadence()
+    return cadence
+
+
+class Cadence:
+
+    # Should never be called directly, use getCadence() instead
+    def __init__(self, scan_fast, scan_quiet, poll_fast, poll_slow, hold, sleep_after, sleep_max):
+        self.scan_fast = scan_fast
+        self.scan_quiet = scan_quiet
+        self.poll_fast = poll_fast
+        self.poll_slow = poll_slow
+        self.hold_ms = int(hold * 1000)
+        self.sleep_after_ms = int(sleep_after * 1000)
+        self.sleep_max = sleep_max
+        self.zone_wait = scan_fast  # seconds the zone scan waits between passes
+        self.wait = poll_fast  # seconds the MQTT listener and command worker wait between passes
+        self.state = STATE_BUSY
+        self.active_at = ticks_ms()  # ticks_ms() of the last activity
+        self.quiet_at = None  # ticks_ms() the cadence last went quiet
+        self.updated_at = self.active_at
+        self.state_ms = [0, 0, 0]  # milliseconds spent in each state
+        self.sleeps = 0
+        self.pin_wakes = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the current state, STATE_BUSY, STATE_QUIET or STATE_ASLEEP
+    def get_state(self):
+        return self.state
+
+    # Return the share of the time spent awake, in percent
+    def get_awake_percent(self):
+        total = self.state_ms[STATE_BUSY] + self.state_ms[STATE_QUIET] + self.state_ms[STATE_ASLEEP]
+        if total == 0:
+            return 100
+        return (total - self.state_ms[STATE_ASLEEP]) * 100 // total
+
+    # Return True if the board can light sleep at all
+    def can_sleep(self):
+        return self.sleep_after_ms > 0 and sleep_alarm is not None and zone_events.can_release_pins() is True
+
+    # --- Cadence --- #
+
+    # Note activity, the fast cadence starts straight away and is held for data["activity_hold"] seconds
+    def touch(self):
+        self.active_at = ticks_ms()
+        if self.state != STATE_BUSY:
+            self.update()
+
+    # Work out the state and set the waits to go with it
+    def update(self):
+        now = ticks_ms()
+        self.state_ms[self.state] += ticks_diff(now, self.updated_at)
+        self.updated_at = now
+        if self._is_busy() is True or ticks_diff(now, self.active_at) < self.hold_ms:
+            if self.state != STATE_BUSY:
+                self.state = STATE_BUSY
+                self.zone_wait = self.scan_fast
+                self.wait = self.poll_fast
+        elif self.state == STATE_BUSY:
+            self.state = STATE_QUIET
+            self.quiet_at = now
+            self.zone_wait = self.scan_quiet
+            self.wait = self.poll_slow
+
+    # Light sleep until a zone pin changes level or data["idle_sleep_max"] seconds have gone by
+    # Blocks, nothing else runs until the board wakes
+    def sleep(self):
+        pins = zone_events.release_pins()
+        if pins is None:
+            return
+        supervisor = task_supervisor.getSupervisor()
+        supervisor.feed()
+
+        alarms = [sleep_alarm.time.TimeAlarm(monotonic_time=time.monotonic() + self.sleep_max)]
+        for pin, level in pins:
+            # Wake on the level the zone does not read now, a zone that changed since its last event wakes at once
+            alarms.append(sleep_alarm.pin.PinAlarm(pin, value=not level, pull=level is True))
+        started = ticks_ms()
+        self.state_ms[self.state] += ticks_diff(started, self.updated_at)
+        self.state = STATE_ASLEEP
+        try:
+            woken_by = sleep_alarm.light_sleep_until_alarms(*alarms)
+        finally:
+            zone_events.claim_pins()
+        now = ticks_ms()
+        slept = ticks_diff(now, started)
+        supervisor.resumed(slept)
+        self.state_ms[STATE_ASLEEP] += slept
+        self.updated_at = now
+        self.state = STATE_QUIET
+        self.sleeps += 1
+        if isinstance(woken_by, sleep_alarm.pin.PinAlarm):
+            self.pin_wakes += 1
+            self.touch()
+
+    # Keep the cadence up to date and sleep once the system has been idle long enough
+    # Beats as the supervisor's cadence task when it is supervised
+    async def run(self):
+        supervisor = task_supervisor.getSupervisor()
+        heartbeat = None
+        if "cadence" in supervisor.names:
+            heartbeat = supervisor.find("cadence")
+        sleeping = self.can_sleep()
+        while True:
+            pass_started = ticks_ms()
+            self.update()
+            wait = self.wait
+            if sleeping is True and self._is_idle() is True:
+                self.sleep()
+                # Every task fell due while the board slept, they get one pass before it sleeps again
+                wait = self.scan_fast
+            if heartbeat is not None:
+                supervisor.beat(heartbeat, pass_started)
+            await asyncio.sleep(wait)
+
+    # Publish the time spent in each state to the diagnostics feed
+    # e.g. cadence busy=120s quiet=3400s asleep=82000s awake=4% sleeps=41000 pin_wakes=12
+    def publish(self):
+        self.update()
+        message = "cadence"
+        for state in (STATE_BUSY, STATE_QUIET, STATE_ASLEEP):
+            message += " " + STATE_NAMES[state] + "=" + str(self.state_ms[state] // 1000) + "s"
+        message += (" awake=" + str(self.get_awake_percent()) + "% sleeps=" + str(self.sleeps) + " pin_wakes=" +
+                    str(self.pin_wakes))
+        topic = config_compiler.getConfig()["diagnostics_topic"]
+        publish_queue.enqueue(topic, message, "info", publish_queue.PRIORITY_LOW)
+
+    # --- Private Methods --- #
+
+    # The alarm needs the fast cadence while anything is armed or arming or the siren is sounding
+    def _is_busy(self):
+        if alarm_handler.get_alarm_state() is True or alarm_handler.get_alarm_prime().is_arming() is True:
+            return True
+        return siren.getSiren().get_siren_state() is False
+
+    # Quiet for long enough, no timer waiting and nothing that could be published waiting in the queue
+    def _is_idle(self):
+        if self.state != STATE_QUIET or ticks_diff(ticks_ms(), self.quiet_at) < self.sleep_after_ms:
+            return False
+        if timer_wheel.getWheel().get_pending() > 0:
+            return False
+        return publish_queue.getPublishQueue().get_size() == 0 or connection.getConnection().is_up() is False
@@ -1,17 +1,32 @@
 # SPDX-License-Identifier: MIT
-import time
 import board
 import asyncio
 import digitalio
 import microcontroller
 import watchdog
 import neopixel
-import wifi
-import adafruit_connection_manager
+import rtc
 from adafruit_pcf8523.pcf8523 import PCF8523
-import time_lord
+from adafruit_ticks import ticks_ms, ticks_diff
 import local_logger as logger
-import local_mqtt
+import publish_queue
+import state_store
+import latency
+import sd_syslog
+import alarm_commands
+import heap_telemetry
+import task_supervisor
+import connection
+import timer_wheel
+import topic_router
+import satellite
+import event_history
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+import alarm_handler
+import siren
+import zone_events
+import config_compiler
+import cadence
 
 # Replacement brains for circa 1987 home security system
 # The system has 8 zones
@@ -21,6 +36,37 @@ import local_mqtt
 # All sensors in a zone closed = False
 # Any sensor in a zone open = True
 
+# Start up is staged so the zones are watched before the network is up
+# core:    RTC, logger, configuration, saved state, zones, siren, exclusions and armed state,
+#          nothing here waits on the network
+# outputs: NeoPixel and relay
+# syslog:  segmented syslog on the SD card
+# network: Wi-Fi, socket pool, TLS and MQTT, brought up by the connection task while the zones are already watched
+# ntp:     once MQTT is first up
+# The connection manager, MQTT client and NTP modules are only imported once they are needed
+# Each stage is timed, see end_stage()
+
+boot_started = ticks_ms()
+stage_started = boot_started
+boot_times = []  # (stage, milliseconds) in the order the stages finished
+
+
+# Record how long the stage that just finished took
+def end_stage(name):
+    global stage_started
+
+    now = ticks_ms()
+    boot_times.append((name, ticks_diff(now, stage_started)))
+    stage_started = now
+
+
+# Return the boot stage timings as one line, e.g. core 142ms; outputs 3ms; ...
+def get_boot_times():
+    line = ""
+    for name, elapsed in boot_times:
+        line += name + " " + str(elapsed) + "ms; "
+    return line + "total " + str(ticks_diff(stage_started, boot_started)) + "ms"
+
 
 # --- import configurable items here --- #
 
@@ -36,24 +82,19 @@ except ImportError:
     print("MQTT configuration stored in mqtt_data.py")
     raise
 
-# --- Set up --- #
-
-host = mqtt_data["server"]
-cert_file = mqtt_data["cert_file"]
-with open(cert_file, 'r') as file:
-    cert_data = file.read()
+try:
+    from system_data import system_data
+except ImportError:
+    print("System data must be in system_data.py, please create file")
+    raise
 
-radio = wifi.radio
-pool = adafruit_connection_manager.get_radio_socketpool(radio)
-ssl_context = adafruit_connection_manager.get_radio_ssl_context(radio)
-ssl_context.load_verify_locations(cadata=cert_data)
+# --- Set up: core --- #
 
 # Set up I2C
+# The system clock runs from the battery backed RTC until NTP has been reached
 i2c = board.I2C()
-rtc = PCF8523(i2c)
-
-# Timey wimey
-my_time = time_lord.configure_time(pool, rtc)
+rtc_chip = PCF8523(i2c)
+rtc.set_time_source(rtc_chip)
 
 # Logging
 my_log = logger.getLocalLogger(use_time=True)
@@ -62,14 +103,36 @@ if my_log is not None:
 else:
     print("Did not create logging singleton!")
 
-# MQTT
-my_mqtt = local_mqtt.getMqtt(pool, ssl_context, use_logger=True)
+# Configuration, checked and compiled once and then loaded from the cache until a configuration file changes
+# A configuration that is not valid stops the boot here with every problem listed
+try:
+    config_compiler.getConfig()
+except ValueError as e:
+    print(e)
+    raise
 
-# Watchdog
-watchdog_timeout = data["watchdog_timeout"]
-# apollo = microcontroller.watchdog
-# apollo.timeout = watchdog_timeout
-# apollo.mode = watchdog.WatchDogMode.RAISE
+# Saved state: armed, excluded zones, last zone states
+state_store.getStateStore()
+
+# Zones, siren, excluded zones and armed state
+# The exclusions are read back before the first scan so an excluded zone can't trip the siren after a power loss
+# Zone changes are queued for MQTT and sent once the network is up
+detector = zone_events.getDetector(mqtt=True)
+siren.getSiren(mqtt=True)
+alarm = alarm_handler.get_alarm_prime()
+alarm_handler.set_zone_exclusions()
+alarm_handler.set_alarm_state()
+
+# First scan, the initial zone states are known and an armed system can trip before the network is up
+detector.update()
+alarm.check_zones()
+
+# Commands from the alarm management feed are queued here and carried out by their own task
+command_pipeline = alarm_commands.getCommandPipeline()
+
+end_stage("core")
+
+# --- Set up: outputs --- #
 
 # Colors for NeoPixel
 RED = 0xF00000
@@ -85,114 +148,346 @@ pixel_pin = neopixel.NeoPixel(board.NEOPIXEL, 1)
 relay_pin = digitalio.DigitalInOut(board.A5)
 relay_pin.direction = digitalio.Direction.OUTPUT
 
+# Watchdog, armed by main() just before the task supervisor starts feeding it
+watchdog_timeout = data["watchdog_timeout"]
+apollo = microcontroller.watchdog
+
+# Every long running task is started and watched by the supervisor, see main()
+supervisor = task_supervisor.getSupervisor()
+
+# How long, in seconds, a supervised task may go without a heartbeat before it is restarted
+task_timeout = data.get("task_timeout", 5)
+
+end_stage("outputs")
+
+# --- Set up: syslog --- #
+
+# Segmented syslog on the SD card, fed by the adafruit_logging logger local_logger writes to
+if "sd_logger_name" in data:
+    sd_syslog.attach(data["sd_logger_name"])
+
+end_stage("syslog")
+
+# --- Set up: network --- #
+# The connection task brings up and keeps up Wi-Fi and MQTT, see connection.py
+
+link = connection.getConnection()
+my_mqtt = None  # Set once MQTT first connects
+
+# How long the MQTT socket is polled on each pass of the listener, in seconds
+# The connection task sets this as the client's socket timeout once it has connected, MiniMQTT does not allow a loop
+# timeout below it
+mqtt_poll_timeout = data.get("mqtt_poll_timeout", 0.01)
+
 
 # --- Helper Methods --- #
 
-# connect to Wi-Fi
-def connect_wifi():
+# Set the RTC from NTP, the clock keeps running from the RTC if NTP can't be reached
+def sync_time(pool):
+    import time_lord
+
     try:
-        # wifi.radio.connect(os.getenv('CIRCUITPY_WIFI_SSID'), os.getenv('CIRCUITPY_WIFI_PASSWORD'))
-        wifi.radio.connect(data["wifi_ssid"], data["wifi_password"])
-        my_log.log_message("Connected to Wi-Fi Network " + str(wifi.radio.ap_info.ssid), "info")
-        my_mqtt.connect()
-    except ConnectionError:
-        my_log.log_message("Unable to connect to network", "critical")
-        raise
+        time_lord.configure_time(pool, rtc_chip)
+    except (OSError, RuntimeError) as e:
+        my_log.log_message("Unable to set the time from NTP, using the RTC: " + str(e), "warning")
+
+
+# Called by the connection task every time MQTT connects
+# The first time: set the time, start the MQTT listener and publish pump and publish the boot timings
+def network_up(first):
+    global my_mqtt
+
+    if first is False:
+        return
+    my_mqtt = link.get_mqtt()
+    end_stage("network")
+    sync_time(link.pool)
+    end_stage("ntp")
+
+    supervisor.add("mqtt_listener", mqtt_listener, timeout=task_timeout + pace.poll_slow)
+    supervisor.add("publish_pump", publish_pump, timeout=task_timeout + data.get("publish_interval", 1))
+
+    log_message = "Boot stages: " + get_boot_times() + " (network: " + link.get_step_times() + ")"
+    my_log.log_message(log_message, "info")
+    publish_queue.enqueue(config_compiler.getConfig()["diagnostics_topic"],
+                          log_message, "info", publish_queue.PRIORITY_LOW)
 
 
 # Signal the alarm system that motion has been detected
-# Wait for 4 second then return the pin to False
+# The relay is held on for data["relay_pulse"] seconds and switched off by the timer wheel, nothing waits for it
+# A trigger while the relay is already on pushes back the time it switches off
 def trip_zone(pin):
-    if pin.value is False:
-        pin.value = True
-        time.sleep(4)
-        pin.value = False
+    global relay_timer
+
+    timer_wheel.cancel(relay_timer)
+    pin.value = True
+    relay_timer = timer_wheel.schedule(relay_pulse, relay_off, pin)
+
+
+# Switch the relay off once its pulse has run out
+def relay_off(pin):
+    global relay_timer
+
+    relay_timer = None
+    pin.value = False
+
+
+relay_pulse = data.get("relay_pulse", 4)
+relay_timer = None
+
+
+# --- MQTT message handlers --- #
+# Called by the topic router as handler(topic, message, argument), see add_routes()
+
+# Return the sensor name of a topic, its last level
+def sensor_name(topic):
+    return topic[topic.rfind("/") + 1:]
+
+
+# A PIR satellite saw motion
+# Messages from satellites go through the node registry first, a duplicate is dropped there
+def pir_tripped(topic, message, argument):
+    if nodes.accept(message) is None:
+        return
+    pace.touch()
+    publish_queue.enqueue(my_mqtt.gen_topic, "Motion detected by " + sensor_name(topic), "info")
+    trip_zone(relay_pin)
+
+
+# A contact satellite changed state, 1 is open as for the wired zones
+def zone_changed(topic, message, argument):
+    message = nodes.accept(message)
+    if message is None:
+        return
+    pace.touch()
+    if str(message).strip() == "1":
+        publish_queue.enqueue(my_mqtt.gen_topic, sensor_name(topic) + " Open", "info")
+        trip_zone(relay_pin)
+    else:
+        publish_queue.enqueue(my_mqtt.gen_topic, sensor_name(topic) + " Closed", "info")
+
+
+# A satellite is still there
+def heartbeat_received(topic, message, argument):
+    nodes.accept(message)
+
+
+# Arm/disarm/exclude commands, only queued here
+def command_received(topic, message, argument):
+    pace.touch()
+    if command_pipeline.submit(message) is False:
+        my_log.log_message("Alarm command queue full, command dropped", "warning")
+
+
+# Dump the end of the syslog, the message may hold how many lines to send
+def syslog_requested(topic, message, argument):
+    try:
+        lines = int(message)
+    except ValueError:
+        lines = data["sd_logfile_lines_to_output"]
+    asyncio.create_task(sd_syslog.dump_to_mqtt(lines))
+
+
+# Stream the event history records in a time range, see event_history.query_to_mqtt()
+def history_requested(topic, message, argument):
+    asyncio.create_task(event_history.query_to_mqtt(message))
+
+
+ROUTE_HANDLERS = {"pir": pir_tripped, "zone": zone_changed, "heartbeat": heartbeat_received,
+                  "command": command_received, "syslog": syslog_requested, "history": history_requested}
+
+
+# Build the routing table from the feed configuration
+# data["sensor_feeds"] are single PIR feeds, data["sensor_routes"] maps feeds or wildcard patterns to a handler type
+def add_routes():
+    for feed in data.get("sensor_feeds", []):
+        router.add(feed, pir_tripped)
+    for feed, kind in data.get("sensor_routes", {}).items():
+        if kind not in ROUTE_HANDLERS:
+            raise ValueError("Unknown route type " + str(kind) + " for " + str(feed))
+        router.add(feed, ROUTE_HANDLERS[kind])
+    router.add(data["sd_logfile_feed_name"], syslog_requested)
+    router.add(data["alarm_management_feed_name"], command_received)
+    if "history_feed_name" in data:
+        router.add(data["history_feed_name"], history_requested)
 
 
 # --- MQTT Subscribe callback methods --- #
 # Behavior when a message is published to a subscribed feed
 def message(client, topic, message):
-    # listen for messages from sensors being monitored
-    if "pir1" in topic:
-        log_message = "Motion detected by PIR sensor 1"
-        my_mqtt.publish(my_mqtt.gen_topic, log_message, "info")
-        trip_zone(relay_pin)
+    router.dispatch(topic, message)
 
 
 # Behavior when connected to the MQTT broker
 # Subscribe to relevant topics
 def connected(client, userdata, flags, rc):
-    my_mqtt.subscribe(topics)  # subscribe to topics
+    link.get_mqtt().subscribe(router.get_subscriptions())  # subscribe to the routed feeds and patterns
     my_log.log_message("Connected to MQTT and subscribed to topics!", "info")
 
 
 # Behavior when disconnected from MQTT broker
-# Log a warning and try to reconnect
+# Only marks the connection down, the connection task reconnects with backoff
 def disconnected(client, userdata, rc):
-    log_message = "Disconnected from MQTT! Will try to reconnect"
-    my_log.log_message(log_message, "warning")
-    my_mqtt.mqtt_client.connect()
+    link.mark_down("Disconnected from MQTT")
 
 
 # Asynchronous Methods --- #
 
-# Class so all coroutines have the same wait time
-class Controls:
-    def __init__(self):
-        self.reverse = False
-        self.wait = 0.25
+# Polling tasks wait as long as the cadence says between passes: short while the alarm is armed or there has been
+# activity, longer while the system is disarmed and quiet, see cadence.py
+
+# Watch the zones and trip the alarm, runs from the end of the core stage whether or not the network is up
+# A zone change is activity, it speeds up the cadence
+# Zone scanning and alarm handling are recorded as separate tasks in the heap telemetry
+async def zone_monitor():
+    zone_scan_heap = heap_telemetry.register("zone_scan")
+    alarm_heap = heap_telemetry.register("alarm")
+    heartbeat = supervisor.find("zone_scan")
+    while True:
+        pass_started = ticks_ms()
+        started = heap_telemetry.begin()
+        if detector.update() != 0:
+            pace.touch()
+        heap_telemetry.end(zone_scan_heap, started)
+        started = heap_telemetry.begin()
+        alarm.check_zones()
+        heap_telemetry.end(alarm_heap, started)
+        supervisor.beat(heartbeat, pass_started)
+        await asyncio.sleep(pace.zone_wait)
 
 
 # Listener for all subscribed MQTT feeds
-async def mqtt_listener(controls):
+# The socket is only polled for mqtt_poll_timeout so a quiet broker never holds up the other tasks
+# Nothing is polled while the connection is down, a failed poll marks it down
+async def mqtt_listener():
+    mqtt_heap = heap_telemetry.register("mqtt_listener")
+    heartbeat = supervisor.find("mqtt_listener")
     while True:
-        my_mqtt.mqtt_client.loop(timeout=5)  # Listen to the subscribed feeds
-        await asyncio.sleep(controls.wait)
+        pass_started = ticks_ms()
+        started = heap_telemetry.begin()
+        if link.is_up() is True:
+            try:
+                my_mqtt.mqtt_client.loop(timeout=mqtt_poll_timeout)  # Listen to the subscribed feeds
+            except (OSError, MMQTTException) as e:
+                link.mark_down(e)
+        heap_telemetry.end(mqtt_heap, started)
+        supervisor.beat(heartbeat, pass_started)
+        await asyncio.sleep(pace.wait)
+
+
+# Send queued messages to the broker, one batch per tick
+# While the connection is down messages wait in the queue and the spool
+async def publish_pump():
+    publish_interval = data.get("publish_interval", 1)
+    publish_heap = heap_telemetry.register("publish_pump")
+    heartbeat = supervisor.find("publish_pump")
+    while True:
+        pass_started = ticks_ms()
+        started = heap_telemetry.begin()
+        if link.is_up() is True:
+            publish_queue.getPublishQueue().flush()
+        heap_telemetry.end(publish_heap, started)
+        supervisor.beat(heartbeat, pass_started)
+        await asyncio.sleep(publish_interval)
+
+
+# Write the state changes made since the last tick to the SD card in one go
+# Event history records are written here as well, once a batch has built up
+async def state_keeper():
+    state_flush_interval = data.get("state_flush_interval", 1)
+    state_heap = heap_telemetry.register("state_keeper")
+    heartbeat = supervisor.find("state_keeper")
+    while True:
+        pass_started = ticks_ms()
+        started = heap_telemetry.begin()
+        state_store.getStateStore().flush()
+        event_history.getHistory().service()
+        heap_telemetry.end(state_heap, started)
+        supervisor.beat(heartbeat, pass_started)
+        await asyncio.sleep(state_flush_interval)
+
+
+# Publish latency percentiles to the diagnostics feed
+async def latency_reporter():
+    latency_report_interval = data.get("latency_report_interval", 300)
+    while True:
+        await asyncio.sleep(latency_report_interval)
+        latency.publish()
 
 
-# Feed the watchdog
-async def maintain_watchdog():
-    watchdog_sleep = watchdog_timeout / 2
+# Collect garbage while nothing else is running, then publish the heap figures to the diagnostics feed
+async def heap_reporter():
+    heap_report_interval = data.get("heap_report_interval", 300)
     while True:
-        apollo.feed()
-        await asyncio.sleep(watchdog_sleep)
+        await asyncio.sleep(heap_report_interval)
+        heap_telemetry.collect()
+        heap_telemetry.publish()
 
 
-# --- On Start Setup Tasks --- #
+# Publish loop lag, task pass length percentiles and the time spent busy, quiet and asleep to the diagnostics feed
+async def supervisor_reporter():
+    supervisor_report_interval = data.get("supervisor_report_interval", 300)
+    while True:
+        await asyncio.sleep(supervisor_report_interval)
+        supervisor.publish()
+        pace.publish()
 
-topics = []
 
-# Set up MQTT for publish/subscribe
-my_mqtt.mqtt_client.on_message = message
-my_mqtt.mqtt_client.on_connect = connected
-my_mqtt.mqtt_client.on_disconnect = disconnected
+# --- On Start Setup Tasks --- #
 
-# Subscribe to sensor feeds in MQTT
+# Route the sensor, syslog and alarm management feeds to their handlers, subscribed to once MQTT is up
 # All feeds should be in the data.py file
-sensor_feeds = data["sensor_feeds"]
-for _ in range(len(sensor_feeds)):
-    feed_name = sensor_feeds[_]
-    topics.append(feed_name)
+router = topic_router.getRouter()
+add_routes()
+
+# How long the polling tasks wait between passes, and light sleep once the system has been idle long enough
+pace = cadence.getCadence()
 
-connect_wifi()
+# Satellites reporting to this board, and this board reporting as a satellite when it has a node name
+nodes = satellite.getRegistry()
 
-my_log.log_message("Ready")
+my_log.log_message("Zones are being watched, starting the network: " + get_boot_times(), "info")
 
 
 # --- Main --- #
+# Hand every long running task to the supervisor, arm the watchdog and let the supervisor run them
+# Critical tasks must stay healthy for the watchdog to be fed
 async def main():
-    controls = Controls()
-    task_array = []
-
-    # Listen for MQTT messages
-    mqtt_listener_task = asyncio.create_task(mqtt_listener(controls))
-    task_array.append(mqtt_listener_task)
-    # Feed the Watchdog
-    # maintain_watchdog_task = asyncio.create_task(maintain_watchdog())
-    # task_array.append(maintain_watchdog_task)
-
-    for _ in range(len(task_array)):
-        await asyncio.gather(task_array[_])
+    # Watch the zones
+    supervisor.add("zone_scan", zone_monitor, critical=True, timeout=task_timeout)
+    # Run the siren time out, relay pulse and entry/exit delay timers
+    supervisor.add("timer_wheel", timer_wheel.getWheel().run, critical=True, timeout=task_timeout)
+    # Bring up and keep up the network, the MQTT listener and publish pump are added once it first connects
+    link.set_handlers(message, connected, disconnected)
+    link.on_up = network_up
+    supervisor.add("connection", link.run)
+    # Carry out alarm commands
+    supervisor.add("alarm_commands", command_pipeline.run, critical=True,
+                   timeout=task_timeout + command_pipeline.interval + pace.poll_slow)
+    # Save state changes
+    supervisor.add("state_keeper", state_keeper, critical=True,
+                   timeout=task_timeout + data.get("state_flush_interval", 1))
+    # Speed up and slow down the polling tasks, light sleep while idle
+    supervisor.add("cadence", pace.run, timeout=task_timeout + pace.poll_slow)
+    # Mark satellites that have stopped sending heartbeats as stale
+    supervisor.add("satellites", nodes.run, timeout=task_timeout + 1)
+    if "satellite_node" in data:
+        supervisor.add("satellite_heartbeat", lambda: satellite.getSatellite().run(link.is_up))
+    # Report hot path latency
+    if latency.enabled is True:
+        supervisor.add("latency_reporter", latency_reporter)
+    # Report heap use
+    if heap_telemetry.enabled is True:
+        supervisor.add("heap_reporter", heap_reporter)
+    # Report loop lag and task pass lengths
+    supervisor.add("supervisor_reporter", supervisor_reporter)
+
+    # Feed the Watchdog, only while the critical tasks are healthy
+    apollo.timeout = watchdog_timeout
+    apollo.mode = watchdog.WatchDogMode.RAISE
+    supervisor.set_watchdog(apollo)
+
+    await supervisor.run()
 
 
 # Kick off all tasks
@@ -201,5 +496,6 @@ try:
     asyncio.run(main())
 except watchdog.WatchDogTimeout as w:
     print("Error:", w)
+    heap_telemetry.save_snapshot("watchdog")
     microcontroller.reset()
 
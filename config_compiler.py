@@ -0,0 +1,309 @@
+# SPDX-License-Identifier: MIT
+
+# Configuration compiler
+# data, mqtt_data and system_data are checked once and turned into the compiled configuration:
+# every zone's index, pin name, feed, topic, exclusion name and debounce window, each partition's zone bitmask and
+# siren, the siren pins and the topics the system publishes to
+# Every problem found is listed in one ValueError raised at boot, before anything is set up with a bad value
+
+# The compiled configuration is cached as JSON in data["config_cache_file"] on the SD card with a fingerprint of the
+# three configuration files (name, size and modification time)
+# While the fingerprint matches, boot loads the cache instead of checking and deriving everything again
+# Editing any of the files, or a new CACHE_VERSION, compiles again
+
+# Pins are kept by their board name, e.g. D9, get_pin() turns a name back into the pin
+
+import os
+import json
+import board
+import microcontroller
+import local_mqtt
+import local_logger as logger
+import data as data_source
+import mqtt_data as mqtt_source
+import system_data as system_source
+
+CACHE_VERSION = 3
+MAX_ZONES = 254  # zone indexes 254 and 255 are the siren and system in the event history
+MAX_PARTITIONS = 16
+PARTITION_SIRENS = ("yelp", "steady")
+
+# A compiled zone is a list: [name, pin name, feed, task, debounce ms, topic, exclusion name]
+ZONE_NAME = 0
+ZONE_PIN = 1
+ZONE_FEED = 2
+ZONE_TASK = 3
+ZONE_DEBOUNCE = 4
+ZONE_TOPIC = 5
+ZONE_EXCLUSION = 6
+
+# A compiled partition is a list: [name, bitmask of its zones, siren]
+# Without system_data["partitions"] there is one partition, house, with every zone and the yelp siren
+PARTITION_NAME = 0
+PARTITION_MASK = 1
+PARTITION_SIREN = 2
+
+# Settings that must be there, and the type they must have
+DATA_REQUIRED = (("alarm_code", int), ("siren_timeout", (int, float)), ("watchdog_timeout", (int, float)),
+                 ("sd_logfile_feed_name", str), ("alarm_management_feed_name", str))
+MQTT_REQUIRED = (("username", str), ("key", str), ("server", str), ("port", int), ("primary_feed", str))
+SYSTEM_REQUIRED = (("zones", (list, tuple)), ("siren_feed_name", str))
+
+# Settings that are optional, but can't be negative when they are there
+DATA_NOT_NEGATIVE = ("exit_delay", "entry_delay", "relay_pulse", "timer_tick", "timer_slots", "task_timeout",
+                     "supervisor_interval", "publish_interval", "publish_batch", "publish_queue_size",
+                     "state_flush_interval", "network_retry", "network_retry_max", "mqtt_poll_timeout",
+                     "history_ram_records", "history_flush_interval", "history_index_every", "history_days",
+                     "satellite_heartbeat_interval", "satellite_missed_beats", "satellite_dedup_window",
+                     "poll_fast", "poll_slow", "activity_hold", "idle_sleep_after", "idle_sleep_max",
+                     "task_restart_window", "wifi_connect_timeout", "mqtt_connect_timeout")
+
+compiled = None
+
+
+# Load the compiled configuration, compiling it if the cache is missing or out of date
+def _addConfig():
+    global compiled
+
+    if compiled is None:
+        fingerprint = get_fingerprint()
+        compiled = _read_cache(fingerprint)
+        if compiled is None:
+            compiled = compile_config()
+            compiled["fingerprint"] = fingerprint
+            _write_cache(compiled)
+
+
+# Get the compiled configuration, raises ValueError if the configuration is not valid
+def getConfig():
+    _addConfig()
+    return compiled
+
+
+# Return the board pin with this name
+def get_pin(name):
+    return getattr(board, name)
+
+
+# Return the name, size and modification time of each configuration file
+# Returns None if a file can't be found, the cache is then never used
+def get_fingerprint():
+    fingerprint = [CACHE_VERSION]
+    for module in (data_source, mqtt_source, system_source):
+        file_name = getattr(module, "__file__", None)
+        if file_name is None:
+            return None
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        fingerprint.append([file_name, stat[6], stat[8]])
+    return fingerprint
+
+
+# Check the configuration and build the compiled form, raises ValueError listing every problem found
+def compile_config():
+    data = data_source.data
+    mqtt_data = mqtt_source.mqtt_data
+    system_data = system_source.system_data
+    errors = []
+
+    _check_required("data", data, DATA_REQUIRED, errors)
+    _check_required("mqtt_data", mqtt_data, MQTT_REQUIRED, errors)
+    _check_required("system_data", system_data, SYSTEM_REQUIRED, errors)
+    for key in DATA_NOT_NEGATIVE:
+        value = data.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or value < 0):
+            errors.append("data['" + key + "'] must be a number of 0 or more, not " + repr(value))
+    if not isinstance(data.get("sensor_feeds", []), (list, tuple)):
+        errors.append("data['sensor_feeds'] must be a list of feed names")
+    if not isinstance(data.get("sensor_routes", {}), dict):
+        errors.append("data['sensor_routes'] must be a dict of feed -> route type")
+    if system_data.get("zone_detection", "keypad") not in ("keypad", "poll"):
+        errors.append("system_data['zone_detection'] must be keypad or poll")
+
+    pin_names = _get_pin_names()
+    default_debounce = system_data.get("zone_debounce_ms", 50)
+    zones = []
+    used = {}  # names, pins and feeds already taken -> what took them
+    zone_list = system_data.get("zones", [])
+    if isinstance(zone_list, (list, tuple)):
+        if len(zone_list) == 0:
+            errors.append("system_data['zones'] has no zones")
+        if len(zone_list) > MAX_ZONES:
+            errors.append("system_data['zones'] has more than " + str(MAX_ZONES) + " zones")
+        for position in range(len(zone_list)):
+            zone = _compile_zone(zone_list[position], position, pin_names, default_debounce, used, errors)
+            if zone is not None:
+                zones.append(zone)
+
+    partitions = _compile_partitions(system_data.get("partitions"), zones, errors)
+
+    siren_pins = []
+    for key in ("siren_yelp", "siren_steady"):
+        pin_name = _pin_name(system_data.get(key), pin_names)
+        if pin_name is None:
+            errors.append("system_data['" + key + "'] is not a board pin")
+        elif ("pin", pin_name) in used:
+            errors.append("system_data['" + key + "'] uses pin " + pin_name + " already used by " +
+                          used[("pin", pin_name)])
+        else:
+            used[("pin", pin_name)] = key
+        siren_pins.append(pin_name)
+
+    if len(errors) > 0:
+        raise ValueError("Configuration is not valid:\n  " + "\n  ".join(errors))
+
+    return {
+        "version": CACHE_VERSION,
+        "zones": zones,
+        "partitions": partitions,
+        "siren_yelp": siren_pins[0],
+        "siren_steady": siren_pins[1],
+        "primary_topic": local_mqtt.get_formatted_topic(mqtt_data["primary_feed"]),
+        "siren_topic": local_mqtt.get_formatted_topic(system_data["siren_feed_name"]),
+        "diagnostics_topic": local_mqtt.get_formatted_topic(mqtt_data.get("diagnostics_feed",
+                                                                           mqtt_data["primary_feed"])),
+    }
+
+
+# --- Private Methods --- #
+
+def _check_required(source, settings, required, errors):
+    for key, kind in required:
+        if key not in settings:
+            errors.append(source + "['" + key + "'] is missing")
+        elif not isinstance(settings[key], kind) or isinstance(settings[key], bool):
+            errors.append(source + "['" + key + "'] has the wrong type: " + repr(settings[key]))
+
+
+# Check one system_data["zones"] entry: [name, pin, feed, task] with an optional debounce window in ms
+# Returns the compiled zone, or None if the entry has problems
+def _compile_zone(entry, index, pin_names, default_debounce, used, errors):
+    where = "system_data['zones'][" + str(index) + "]"
+    if not isinstance(entry, (list, tuple)) or len(entry) not in (4, 5):
+        errors.append(where + " must be [name, pin, feed, task] or [name, pin, feed, task, debounce ms]")
+        return None
+    name, pin, feed, task = entry[0], entry[1], entry[2], entry[3]
+    debounce_ms = default_debounce
+    if len(entry) > 4 and entry[4] is not None:
+        debounce_ms = entry[4]
+    count = len(errors)
+
+    if not isinstance(name, str) or len(name) == 0:
+        errors.append(where + " zone name must be a string")
+    if not isinstance(feed, str) or len(feed) == 0:
+        errors.append(where + " feed must be a string")
+    if not isinstance(debounce_ms, int) or debounce_ms < 0:
+        errors.append(where + " debounce must be a whole number of milliseconds")
+    pin_name = _pin_name(pin, pin_names)
+    if pin_name is None:
+        errors.append(where + " pin " + repr(pin) + " is not a board pin")
+    if len(errors) > count:
+        return None
+
+    for kind, value in (("name", name), ("pin", pin_name), ("feed", feed)):
+        if (kind, value) in used:
+            errors.append(where + " " + kind + " " + str(value) + " is already used by " + used[(kind, value)])
+        else:
+            used[(kind, value)] = str(name)
+    if len(errors) > count:
+        return None
+    return [name, pin_name, feed, str(task), debounce_ms, local_mqtt.get_formatted_topic(feed),
+            feed[feed.find(".") + 1:]]
+
+
+# Check system_data["partitions"]: [[name, [zone name, ...], "yelp" or "steady"], ...]
+# A zone can be in more than one partition
+# Returns the compiled partitions
+def _compile_partitions(partition_list, zones, errors):
+    zone_bits = {}
+    for index in range(len(zones)):
+        zone_bits[zones[index][ZONE_NAME]] = 1 << index
+    if partition_list is None:
+        mask = 0
+        for bit in zone_bits.values():
+            mask |= bit
+        return [["house", mask, "yelp"]]
+    if not isinstance(partition_list, (list, tuple)) or len(partition_list) == 0:
+        errors.append("system_data['partitions'] must be a list of [name, [zone name, ...], siren]")
+        return []
+    if len(partition_list) > MAX_PARTITIONS:
+        errors.append("system_data['partitions'] has more than " + str(MAX_PARTITIONS) + " partitions")
+
+    partitions = []
+    for position in range(len(partition_list)):
+        entry = partition_list[position]
+        where = "system_data['partitions'][" + str(position) + "]"
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3 or not isinstance(entry[1], (list, tuple)):
+            errors.append(where + " must be [name, [zone name, ...], siren]")
+            continue
+        name, members, siren = entry
+        if not isinstance(name, str) or len(name) == 0 or not name.isalpha():
+            errors.append(where + " partition name must be a word, not " + repr(name))
+        elif name in [partition[PARTITION_NAME] for partition in partitions]:
+            errors.append(where + " partition " + name + " is defined twice")
+        if siren not in PARTITION_SIRENS:
+            errors.append(where + " siren must be yelp or steady, not " + repr(siren))
+        if len(members) == 0:
+            errors.append(where + " has no zones")
+        mask = 0
+        for member in members:
+            if member not in zone_bits:
+                errors.append(where + " zone " + repr(member) + " is not in system_data['zones']")
+            else:
+                mask |= zone_bits[member]
+        partitions.append([name, mask, siren])
+    return partitions
+
+
+# Return a map of every board pin to one of its names
+# board also holds buses, board_id and the like, only microcontroller.Pin objects are pins
+def _get_pin_names():
+    pin_names = {}
+    for name in dir(board):
+        if name.startswith("_"):
+            continue
+        pin = getattr(board, name)
+        if isinstance(pin, microcontroller.Pin) and id(pin) not in pin_names:
+            pin_names[id(pin)] = name
+    return pin_names
+
+
+# Return the board name of a pin, which may be given as the pin or as its name
+def _pin_name(pin, pin_names):
+    if isinstance(pin, str):
+        if not pin.startswith("_") and isinstance(getattr(board, pin, None), microcontroller.Pin):
+            return pin
+        return None
+    if pin is None:
+        return None
+    return pin_names.get(id(pin))
+
+
+def _cache_file():
+    return data_source.data.get("sd_mount", "/sd") + "/" + data_source.data.get("config_cache_file", "config_cache")
+
+
+# Return the cached compiled configuration if it was compiled from the configuration files as they are now
+def _read_cache(fingerprint):
+    if fingerprint is None:
+        return None
+    try:
+        with open(_cache_file(), 'r') as cache:
+            cached = json.load(cache)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("fingerprint") != fingerprint:
+        return None
+    return cached
+
+
+def _write_cache(config):
+    if config.get("fingerprint") is None:
+        return
+    try:
+        with open(_cache_file(), 'w') as cache:
+            json.dump(config, cache)
+    except OSError as e:
+        logger.getLocalLogger().log_message("Unable to save the compiled configuration: " + str(e), "warning")
@@ -0,0 +1,244 @@
+# SPDX-License-Identifier: MIT
+
+# Connection to the MQTT broker, brought up and kept up by one async task
+# The connection goes through Wi-Fi -> socket pool -> TLS context -> MQTT, one step per pass of run()
+# Each step is skipped if what it makes is still there, so a reconnect after an MQTT drop only redoes the MQTT step:
+# the socket pool and TLS context (with the CA from mqtt_data["cert_file"]) are made once and reused
+# CircuitPython's ssl module has no session API, each MQTT connect still does a full handshake
+
+# A failed step goes back to the Wi-Fi step if Wi-Fi has dropped, otherwise the same step is tried again
+# A failed step is retried after a jittered exponential backoff, starting at data["network_retry"] seconds and
+# doubling up to data["network_retry_max"]
+# The failure count is only cleared once the connection has stayed up for network_retry_max seconds,
+# a broker that drops every connection straight away is not hammered
+
+# Nothing here blocks for long on a reconnect: the Wi-Fi join is bounded by data["wifi_connect_timeout"], the MQTT
+# (and TLS) connect by data["mqtt_connect_timeout"], MiniMQTT is limited to one connect attempt and the disconnect
+# callback only marks the connection down, run() does the rest
+# A join or connect that times out is a failed step like any other and backs off
+# Time to reconnect is measured from the connection going down to MQTT being connected again
+
+import asyncio
+import random
+import wifi
+from adafruit_ticks import ticks_ms, ticks_diff
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+import local_logger as logger
+import publish_queue
+import config_compiler
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+try:
+    from mqtt_data import mqtt_data
+except ImportError:
+    print("MQTT information is stored in mtqq_data.py, please create file", "critical")
+    raise
+
+STATE_OFFLINE = 0  # Wi-Fi not connected
+STATE_WIFI = 1  # Wi-Fi connected
+STATE_SOCKET = 2  # Socket pool ready
+STATE_TLS = 3  # TLS context ready
+STATE_UP = 4  # MQTT connected
+STATE_NAMES = ("offline", "wifi", "socket", "tls", "mqtt")
+
+connection = None
+
+
+# Create the connection singleton
+def _addConnection():
+    global connection
+
+    if connection is None:
+        connection = Connection(data.get("network_retry", 10), data.get("network_retry_max", 120),
+                                data.get("network_check_interval", 1))
+
+
+# Get the connection singleton
+def getConnection():
+    _addConnection()
+    return connection
+
+
+class Connection:
+
+    # Should never be called directly, use getConnection() instead
+    def __init__(self, retry, retry_max, check_interval):
+        self.retry = retry
+        self.retry_max = retry_max
+        self.check_interval = check_interval
+        self.state = STATE_OFFLINE
+        self.failures = 0
+        self.pool = None
+        self.ssl_context = None
+        self.my_mqtt = None
+        self.handlers = (None, None, None)  # on_message, on_connect, on_disconnect for the MQTT client
+        self.on_up = None  # called with True when MQTT first connects, False on every reconnect after that
+        self.down_since = ticks_ms()
+        self.up_since = None
+        self.step_started = ticks_ms()
+        self.first_steps = []  # (step, milliseconds) of the first connection
+        self.attempts = 0
+        self.connects = 0
+        self.reconnect_last_ms = 0
+        self.reconnect_max_ms = 0
+        self.reconnect_total_ms = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return True while MQTT is connected
+    def is_up(self):
+        return self.state == STATE_UP
+
+    # Return the MQTT helper, None until the TLS step is done
+    def get_mqtt(self):
+        return self.my_mqtt
+
+    # Return how long, in seconds, to wait before the next attempt
+    # Exponential in the number of failures, then somewhere between half and all of that so devices don't retry
+    # in step
+    def get_backoff(self):
+        delay = self.retry * (1 << min(self.failures - 1, 16))
+        if delay > self.retry_max:
+            delay = self.retry_max
+        return delay * (0.5 + random.random() / 2)
+
+    # Return the step times of the first connection as one line, e.g. wifi 812ms; socket 3ms; ...
+    def get_step_times(self):
+        line = ""
+        for name, elapsed in self.first_steps:
+            line += name + " " + str(elapsed) + "ms; "
+        return line.rstrip("; ")
+
+    # Return the reconnect figures as one line
+    # e.g. connection connects=3 attempts=7 reconnect last=5012ms max=9120ms mean=6022ms
+    def get_metrics(self):
+        mean = 0
+        if self.connects > 1:
+            mean = self.reconnect_total_ms // (self.connects - 1)
+        return ("connection connects=" + str(self.connects) + " attempts=" + str(self.attempts) + " reconnect last=" +
+                str(self.reconnect_last_ms) + "ms max=" + str(self.reconnect_max_ms) + "ms mean=" + str(mean) + "ms")
+
+    # --- Setters --- #
+
+    # Callbacks given to the MQTT client when it is made
+    def set_handlers(self, on_message, on_connect, on_disconnect):
+        self.handlers = (on_message, on_connect, on_disconnect)
+
+    # Called when the connection is found to be broken, e.g. from the MQTT disconnect callback
+    # run() starts bringing it back up from the Wi-Fi step on its next pass
+    def mark_down(self, reason):
+        if self.state == STATE_OFFLINE:
+            return
+        self.my_log.log_message("Connection down: " + str(reason), "warning")
+        if self.state == STATE_UP:
+            self.down_since = ticks_ms()
+            self.up_since = None
+        self.state = STATE_OFFLINE
+
+    # --- Connection --- #
+
+    # Try the next step of bringing the connection up, returns True if it worked
+    def step(self):
+        self.attempts += 1
+        try:
+            if self.state == STATE_OFFLINE:
+                if not wifi.radio.connected:
+                    wifi.radio.connect(data["wifi_ssid"], data["wifi_password"],
+                                       timeout=data.get("wifi_connect_timeout", 10))
+                    self.my_log.log_message("Connected to Wi-Fi Network " + str(wifi.radio.ap_info.ssid), "info")
+            elif self.state == STATE_WIFI:
+                if self.pool is None:
+                    import adafruit_connection_manager
+
+                    self.pool = adafruit_connection_manager.get_radio_socketpool(wifi.radio)
+            elif self.state == STATE_SOCKET:
+                if self.ssl_context is None:
+                    self._create_ssl_context()
+            elif self.state == STATE_TLS:
+                if self.my_mqtt is None:
+                    self._create_mqtt()
+                client = self.my_mqtt.mqtt_client
+                client._socket_timeout = data.get("mqtt_connect_timeout", 5)
+                self.my_mqtt.connect()
+                client._socket_timeout = data.get("mqtt_poll_timeout", 0.01)
+        except (ConnectionError, OSError, RuntimeError, MMQTTException) as e:
+            self.my_log.log_message("Unable to connect (" + STATE_NAMES[self.state + 1] + "): " + str(e), "error")
+            if self.state != STATE_OFFLINE and not wifi.radio.connected:
+                self.state = STATE_OFFLINE  # the socket pool and TLS context are kept, only Wi-Fi is redone first
+            return False
+
+        self.state += 1
+        if self.connects == 0:
+            now = ticks_ms()
+            self.first_steps.append((STATE_NAMES[self.state], ticks_diff(now, self.step_started)))
+            self.step_started = now
+        return True
+
+    # Bring the connection up and keep it up
+    async def run(self):
+        while True:
+            if self.state == STATE_UP:
+                if not wifi.radio.connected:
+                    self.mark_down("Wi-Fi lost")
+                    continue
+                if self.failures > 0 and ticks_diff(ticks_ms(), self.up_since) > self.retry_max * 1000:
+                    self.failures = 0
+                await asyncio.sleep(self.check_interval)
+            elif self.step() is True:
+                if self.state == STATE_UP:
+                    self._connected()
+                await asyncio.sleep(0)
+            else:
+                self.failures += 1
+                await asyncio.sleep(self.get_backoff())
+
+    # --- Private Methods --- #
+
+    # Record the time to reconnect and let code.py know
+    def _connected(self):
+        now = ticks_ms()
+        self.up_since = now
+        self.connects += 1
+        if self.connects > 1:
+            elapsed = ticks_diff(now, self.down_since)
+            self.reconnect_last_ms = elapsed
+            self.reconnect_total_ms += elapsed
+            if elapsed > self.reconnect_max_ms:
+                self.reconnect_max_ms = elapsed
+            self.my_log.log_message("Reconnected in " + str(elapsed) + "ms", "info")
+            topic = config_compiler.getConfig()["diagnostics_topic"]
+            publish_queue.enqueue(topic, self.get_metrics(), "info", publish_queue.PRIORITY_LOW)
+        if self.on_up is not None:
+            self.on_up(self.connects == 1)
+
+    # The CA is read and parsed once, the context is reused for every connect
+    def _create_ssl_context(self):
+        import adafruit_connection_manager
+
+        with open(mqtt_data["cert_file"], 'r') as file:
+            cert_data = file.read()
+        ssl_context = adafruit_connection_manager.get_radio_ssl_context(wifi.radio)
+        ssl_context.load_verify_locations(cadata=cert_data)
+        self.ssl_context = ssl_context
+
+    # Make the MQTT client on the pooled sockets
+    # The helper takes no client settings, they are set on the client it makes
+    # The socket timeout is the connect timeout while connecting, then the listener's poll timeout once connected,
+    # MiniMQTT does not allow a loop timeout below it
+    # Its own connect retries would block, it is left with one attempt and run() does the retrying
+    def _create_mqtt(self):
+        import local_mqtt
+
+        my_mqtt = local_mqtt.getMqtt(self.pool, self.ssl_context, use_logger=True)
+        client = my_mqtt.mqtt_client
+        client._reconnect_attempts_max = 1
+        client.on_message = self.handlers[0]
+        client.on_connect = self.handlers[1]
+        client.on_disconnect = self.handlers[2]
+        self.my_mqtt = my_mqtt
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MIT
+
+# Debounce engine for the zone detectors
+# A zone only changes state once its raw value has held for the zone's stable window
+# A raw change that flips back before the window runs out is a bounce, it is counted and never reported
+
+# Each zone's window is the optional 5th entry of its line in system_data["zones"] (milliseconds)
+# Zones without one use system_data["zone_debounce_ms"], the config compiler works out the window of each zone
+# A window of 0 reports every raw change on the next settle()
+
+import array
+from adafruit_ticks import ticks_diff
+
+
+# Tracks every zone as a bit, bit N belongs to the zone with index N
+# stable holds the settled states, pending holds the zones whose raw value currently differs from stable
+class Debouncer:
+    __slots__ = ("windows", "since", "bounces", "stable", "pending")
+
+    def __init__(self, windows):
+        self.windows = array.array("L", windows)
+        self.since = array.array("L", [0] * len(windows))
+        self.bounces = array.array("L", [0] * len(windows))
+        self.stable = 0
+        self.pending = 0
+
+    # Accept a state as settled without debouncing, used on startup and after a resync
+    def reset(self, state, now):
+        self.stable = state
+        self.pending = 0
+        for index in range(len(self.since)):
+            self.since[index] = now
+
+    # Feed the raw state of every zone as seen at ticks_ms() time now
+    # Starts the window for zones that just moved away from their settled state
+    # Counts a bounce for pending zones that went back before their window ran out
+    def sample(self, raw, now):
+        diff = raw ^ self.stable
+        bounced = self.pending & ~diff
+        started = diff & ~self.pending
+        self.pending = diff
+
+        index = 0
+        while bounced:
+            if bounced & 1:
+                self.bounces[index] += 1
+            bounced >>= 1
+            index += 1
+
+        index = 0
+        while started:
+            if started & 1:
+                self.since[index] = now
+            started >>= 1
+            index += 1
+
+    # Settle the pending zones whose raw value has held for their window
+    # Returns the bitmask of zones that changed state
+    def settle(self, now):
+        settled = 0
+        pending = self.pending
+        index = 0
+        while pending:
+            if pending & 1 and ticks_diff(now, self.since[index]) >= self.windows[index]:
+                settled |= 1 << index
+            pending >>= 1
+            index += 1
+
+        self.stable ^= settled
+        self.pending &= ~settled
+        return settled
+
+    # Return the ticks_ms() time the last change of a zone started, this is when the transition really happened
+    def get_since(self, index):
+        return self.since[index]
+
+    # Return the number of suppressed bounces for a zone
+    def get_bounces(self, index):
+        return self.bounces[index]
+
+    # Return the number of suppressed bounces for all zones
+    def get_total_bounces(self):
+        return sum(self.bounces)
@@ -0,0 +1,357 @@
+# SPDX-License-Identifier: MIT
+
+# Event history on the SD card, answers "which zones opened between 02:00 and 03:00 last Tuesday"
+# without reading the syslog
+# Every zone change, arm/disarm and siren trip is one fixed size record, packed as RECORD_FORMAT:
+#   time      time.time() of the event, 4 bytes
+#   zone      zone index, or ZONE_SYSTEM for the armed state, ZONE_SIREN for the siren, 1 byte
+#   old, new  state before and after: closed/open, disarmed/armed, off/on, 1 byte each
+#   flags     FLAG_ARMED if the system was armed at the time, 1 byte
+# Records are collected in RAM and written data["history_ram_records"] at a time, or once the oldest has waited
+# data["history_flush_interval"] seconds, the state keeper task does the writing
+
+# One segment file per day: <history_file>.YYYYMMDD, segments older than data["history_days"] are removed
+# Each segment has a sparse index, <history_file>.YYYYMMDD.idx, holding the time and record number of every
+# data["history_index_every"]th record, a query reads the index and seeks straight to where its range starts
+# An index entry that could not be written only makes queries read a few more records
+# Records are taken to be in time order within a day, a clock set back by NTP can hide a few from a query
+
+# A record cut short by a power loss is padded out with 0xFF before the next write and skipped by queries
+
+import os
+import time
+import struct
+import asyncio
+from adafruit_ticks import ticks_ms, ticks_diff
+import local_mqtt
+import local_logger as logger
+import publish_queue
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+RECORD_FORMAT = "<IBBBB"
+RECORD_BYTES = 8
+INDEX_FORMAT = "<II"  # time, record number
+INDEX_BYTES = 8
+ZONE_SYSTEM = 255
+ZONE_SIREN = 254
+FLAG_ARMED = 1
+FLAG_PADDING = 0xFF
+DAY_SECONDS = 86400
+READ_RECORDS = 32  # records a query reads from the card at a time
+
+# Indexed by the old/new state of a record, by what the record is about
+SYSTEM_STATES = ("disarmed", "armed")
+SIREN_STATES = ("off", "on")
+ZONE_STATES = ("Closed", "Open")
+
+history = None
+armed = False
+
+
+# Create the event history singleton
+def _addHistory():
+    global history
+
+    if history is None:
+        base = data.get("sd_mount", "/sd") + "/" + data.get("history_file", "history")
+        history = EventHistory(base, data.get("history_ram_records", 32), data.get("history_flush_interval", 60),
+                               data.get("history_index_every", 32), data.get("history_days", 31))
+
+
+# Get the event history singleton
+def getHistory():
+    _addHistory()
+    return history
+
+
+# Record an event, see RECORD_FORMAT
+def record(zone, old, new):
+    getHistory().record(zone, old, new)
+
+
+# Keep the armed flag given to the records in step with the alarm
+def set_armed(value):
+    global armed
+    armed = value is True
+
+
+# Return the YYYYMMDD day name of a time.time() value
+def format_day(timestamp):
+    t = time.localtime(timestamp)
+    return "{:04d}{:02d}{:02d}".format(t[0], t[1], t[2])
+
+
+# Return a time.time() value as YYYY-MM-DDTHH:MM:SS
+def format_time(timestamp):
+    t = time.localtime(timestamp)
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(t[0], t[1], t[2], t[3], t[4], t[5])
+
+
+# Read a time given as seconds since the epoch or as YYYY-MM-DDTHH:MM[:SS], returns None if it can't be read
+def parse_time(text):
+    if text.isdigit():
+        return int(text)
+    try:
+        date, clock = text.split("T")
+        year, month, day = date.split("-")
+        parts = clock.split(":")
+        second = 0
+        if len(parts) > 2:
+            second = int(parts[2])
+        return int(time.mktime((int(year), int(month), int(day), int(parts[0]), int(parts[1]), second, 0, -1, -1)))
+    except (ValueError, IndexError, OverflowError):
+        return None
+
+
+# Run a query sent to data["history_feed_name"] and stream the matching records back
+# The command is <start> <end> [zone name], times as for parse_time()
+# e.g. 2026-10-13T02:00 2026-10-13T03:00 zone_3
+async def query_to_mqtt(command):
+    topic = local_mqtt.getMqtt(use_logger=True).gen_topic
+    queue = publish_queue.getPublishQueue()
+    wait = data.get("publish_interval", 1)
+
+    async def send(chunk):
+        while queue.is_full():
+            await asyncio.sleep(wait)
+        queue.enqueue(topic, chunk, "info", publish_queue.PRIORITY_NORMAL)
+
+    parts = str(command).split()
+    start = None
+    end = None
+    if len(parts) >= 2:
+        start = parse_time(parts[0])
+        end = parse_time(parts[1])
+    if start is None or end is None:
+        await send("Unreadable history query, expected <start> <end> [zone]")
+        return
+    if end < start:
+        await send("History query ends before it starts: " + parts[0] + " " + parts[1])
+        return
+    name = None
+    if len(parts) > 2:
+        name = parts[2]
+    await getHistory().query(start, end, name, data.get("sd_log_chunk_bytes", 256), send)
+
+
+class EventHistory:
+
+    # Should never be called directly, use getHistory() instead
+    def __init__(self, base, ram_records, flush_interval, index_every, days):
+        self.base = base
+        self.ram_records = ram_records
+        self.flush_ms = int(flush_interval * 1000)
+        self.index_every = index_every
+        self.days = days
+        self.buffer = bytearray(RECORD_BYTES * ram_records * 2)  # records not written yet, room for two batches
+        self.count = 0
+        self.oldest = None  # ticks_ms() the oldest record in RAM was made
+        self.day = None  # day name of the records in RAM
+        self.day_end = 0  # time.time() the day of the records in RAM ends
+        self.day_records = None  # records in the day's segment file, None until it has been looked at
+        self.dropped = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the file name of a day's segment
+    def get_segment_file(self, day):
+        return self.base + "." + day
+
+    # Return the number of records dropped because they could not be written
+    def get_dropped(self):
+        return self.dropped
+
+    # --- History --- #
+
+    # Add a record to RAM, nothing is written here
+    # A new day starts a new batch, the records of the day before are written first
+    def record(self, zone, old, new):
+        now = int(time.time())
+        if now >= self.day_end or self.day is None:
+            self.write()
+            self._start_day(now)
+        if self.count * RECORD_BYTES >= len(self.buffer):
+            self.write()
+            if self.count * RECORD_BYTES >= len(self.buffer):
+                self.dropped += 1
+                return
+        flags = 0
+        if armed is True:
+            flags = FLAG_ARMED
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.count * RECORD_BYTES, now, zone, old, new, flags)
+        if self.count == 0:
+            self.oldest = ticks_ms()
+        self.count += 1
+
+    # Write the records in RAM once there is a batch of them or the oldest has waited long enough
+    def service(self):
+        if self.count == 0:
+            return
+        if self.count >= self.ram_records or ticks_diff(ticks_ms(), self.oldest) >= self.flush_ms:
+            self.write()
+
+    # Append the records in RAM to the day's segment and index in one write each
+    # If the card can't be written the records stay in RAM until there is no room left for more
+    def write(self):
+        if self.count == 0:
+            return
+        segment_file = self.get_segment_file(self.day)
+        try:
+            if self.day_records is None:
+                self.day_records = self._open_segment(segment_file)
+            with open(segment_file, 'ab') as segment:
+                segment.write(memoryview(self.buffer)[:self.count * RECORD_BYTES])
+        except OSError as e:
+            self.my_log.log_message("Unable to write event history: " + str(e), "error")
+            self.day_records = None  # a write that failed part way is padded out on the next try
+            return
+
+        index = bytearray()
+        for number in range(self.day_records, self.day_records + self.count):
+            if number % self.index_every == 0:
+                timestamp = struct.unpack_from("<I", self.buffer, (number - self.day_records) * RECORD_BYTES)[0]
+                index += struct.pack(INDEX_FORMAT, timestamp, number)
+        self.day_records += self.count
+        self.count = 0
+        if len(index) > 0:
+            try:
+                with open(segment_file + ".idx", 'ab') as index_file:
+                    index_file.write(index)
+            except OSError as e:
+                self.my_log.log_message("Unable to write event history index: " + str(e), "error")
+
+    # Stream the records from start to end, both time.time() values, to send(chunk) as text lines
+    # Only the records of the zone called name are sent if it is given
+    # The range is cut to the days still kept, from data["history_days"] ago to now
+    # Lines are collected into chunks of up to chunk_bytes, the last line says how many records matched
+    # Other tasks run between every block of records read, a query over many days never holds up the alarm
+    async def query(self, start, end, name, chunk_bytes, send):
+        self.write()
+        now = int(time.time())
+        start = max(start, now - self.days * DAY_SECONDS)
+        end = min(end, now)
+        chunk = ""
+        matched = 0
+        day = start - start % DAY_SECONDS - DAY_SECONDS  # local days may not line up with UTC days
+        while day <= end + DAY_SECONDS:
+            for line in self._read_segment(format_day(day), start, end, name):
+                if line is None:
+                    await asyncio.sleep(0)
+                    continue
+                matched += 1
+                if len(chunk) + len(line) + 1 > chunk_bytes and len(chunk) > 0:
+                    await send(chunk)
+                    chunk = ""
+                chunk += line + "\n"
+            day += DAY_SECONDS
+            await asyncio.sleep(0)
+        chunk += "history " + format_time(start) + " to " + format_time(end) + ": " + str(matched) + " events"
+        await send(chunk)
+
+    # --- Private Methods --- #
+
+    # Note the day a record falls in, a new day removes the segments that are too old
+    def _start_day(self, now):
+        t = time.localtime(now)
+        day_start = now - (t[3] * 3600 + t[4] * 60 + t[5])
+        self.day_end = day_start + DAY_SECONDS
+        day = format_day(now)
+        if day != self.day:
+            self.day = day
+            self.day_records = None
+            self._remove_old(format_day(day_start - self.days * DAY_SECONDS))
+
+    # Return the number of records in a segment, a record cut short is padded out first
+    def _open_segment(self, segment_file):
+        try:
+            size = os.stat(segment_file)[6]
+        except OSError:
+            return 0
+        partial = size % RECORD_BYTES
+        if partial > 0:
+            with open(segment_file, 'ab') as segment:
+                segment.write(bytes([FLAG_PADDING] * (RECORD_BYTES - partial)))
+            size += RECORD_BYTES - partial
+        return size // RECORD_BYTES
+
+    # Yield the lines of the matching records of one day's segment, read READ_RECORDS records at a time
+    # None is yielded after each block read so the caller can let other tasks run
+    def _read_segment(self, day, start, end, name):
+        segment_file = self.get_segment_file(day)
+        first = 0
+        try:
+            with open(segment_file + ".idx", 'rb') as index_file:
+                index = index_file.read()
+            for entry in range(len(index) // INDEX_BYTES):
+                timestamp, number = struct.unpack_from(INDEX_FORMAT, index, entry * INDEX_BYTES)
+                if timestamp >= start:
+                    break
+                first = number
+        except OSError:
+            pass
+
+        try:
+            segment = open(segment_file, 'rb')
+        except OSError:
+            return
+        try:
+            segment.seek(first * RECORD_BYTES)
+            while True:
+                block = segment.read(RECORD_BYTES * READ_RECORDS)
+                if not block:
+                    return
+                for offset in range(0, len(block) - RECORD_BYTES + 1, RECORD_BYTES):
+                    timestamp, zone, old, new, flags = struct.unpack_from(RECORD_FORMAT, block, offset)
+                    if flags == FLAG_PADDING or timestamp < start:
+                        continue
+                    if timestamp > end:
+                        return
+                    line = self._format_record(timestamp, zone, old, new, flags, name)
+                    if line is not None:
+                        yield line
+                yield None
+        finally:
+            segment.close()
+
+    # Return a record as a line, e.g. 2026-10-13T02:14:05 zone_3 Closed>Open armed
+    # Returns None if the record is not about the zone called name
+    def _format_record(self, timestamp, zone, old, new, flags, name):
+        if zone == ZONE_SYSTEM:
+            subject = "system"
+            states = SYSTEM_STATES
+        elif zone == ZONE_SIREN:
+            subject = "siren"
+            states = SIREN_STATES
+        else:
+            import zone as zones
+
+            all_zones = zones.getZones()
+            if zone < len(all_zones):
+                subject = all_zones[zone].name
+            else:
+                subject = "zone " + str(zone)
+            states = ZONE_STATES
+        if name is not None and subject != name:
+            return None
+        line = format_time(timestamp) + " " + subject + " " + states[old & 1] + ">" + states[new & 1]
+        if flags & FLAG_ARMED:
+            line += " armed"
+        return line
+
+    # Remove the segments of days before the day called oldest
+    def _remove_old(self, oldest):
+        split = self.base.rfind("/")
+        folder = self.base[:split] or "/"
+        name = self.base[split + 1:] + "."
+        try:
+            for file_name in os.listdir(folder):
+                if file_name.startswith(name) and file_name[len(name):len(name) + 8] < oldest:
+                    os.remove(folder + "/" + file_name)
+        except OSError as e:
+            self.my_log.log_message("Unable to remove old event history: " + str(e), "error")
@@ -0,0 +1,287 @@
+# SPDX-License-Identifier: MIT
+
+# Store and forward spool for MQTT messages that could not be sent
+# When a publish fails the publish queue moves everything it holds to the spool, messages queued while the broker
+# is still unreachable follow them, and the spool is replayed oldest first once a publish goes through again
+
+# Each message becomes one record with a sequence number and the time it was queued,
+# replayed messages carry both so dashboards can backfill: {"value": ..., "seq": 12, "created_at": "..."}
+
+# Records are collected in RAM and appended to the SD card data["spool_ram_records"] at a time
+# On the card the spool is split into numbered segment files: <spool_file>.0, <spool_file>.1, ...
+# a segment is closed once it reaches data["spool_segment_bytes"] and removed once it has been replayed
+# When the segments hold more than data["spool_max_bytes"] the oldest segment is dropped
+
+# Record format, one per line, tab separated: seq, time, level, topic, message as JSON
+# A record without its newline was cut short by a power loss and is skipped, nothing is ever appended after one:
+# a segment found with a cut short record at boot, or one a write failed on, is closed and a new segment started
+# A record that can't be decoded is skipped and counted on replay, it never holds up the records after it
+# Replay progress within a segment is only kept in memory, after a restart the segment is sent again from the start
+
+import os
+import json
+import time
+import local_logger as logger
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+spool = None
+
+
+# Create the spool singleton and pick up anything left on the SD card
+def _addSpool():
+    global spool
+
+    if spool is None:
+        base = data.get("sd_mount", "/sd") + "/" + data.get("spool_file", "mqtt_spool")
+        spool = EventSpool(base, data.get("spool_ram_records", 16), data.get("spool_segment_bytes", 8192),
+                           data.get("spool_max_bytes", 65536))
+        spool.open()
+
+
+# Get the spool singleton
+def getSpool():
+    _addSpool()
+    return spool
+
+
+# Return a time.time() value as an ISO 8601 string, the form Adafruit IO takes for created_at
+# The time is the RTC's, which time_lord keeps set from NTP
+def format_time(timestamp):
+    t = time.localtime(timestamp)
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(t[0], t[1], t[2], t[3], t[4], t[5])
+
+
+class EventSpool:
+
+    # Should never be called directly, use getSpool() instead
+    def __init__(self, base, ram_records, segment_bytes, max_bytes):
+        self.base = base
+        self.ram_records = ram_records
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.ram = []  # encoded records not written to the card yet, oldest first
+        self.first = 0  # oldest segment on the card
+        self.current = 0  # segment being written
+        self.read_offset = 0  # bytes of the oldest segment already replayed
+        self.sizes = {}  # segment -> bytes
+        self.records = {}  # segment -> records
+        self.read_records = 0  # records of the oldest segment already replayed
+        self.sequence = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the number of records waiting to be replayed
+    def get_count(self):
+        count = len(self.ram) - self.read_records
+        for segment in self.records:
+            count += self.records[segment]
+        return count
+
+    # Return the number of records dropped because the spool was full
+    def get_dropped(self):
+        return self.dropped
+
+    # Return the number of records skipped on replay because they could not be decoded
+    def get_skipped(self):
+        return self.skipped
+
+    # Return the file name of a segment
+    def get_segment_file(self, segment):
+        return self.base + "." + str(segment)
+
+    # --- Spool --- #
+
+    # Find the segments left on the card, count their records and carry on from the last sequence number
+    # If the last segment ends in a record cut short, new records go in a new segment
+    def open(self):
+        folder, name = self._split_base()
+        found = []
+        try:
+            for file_name in os.listdir(folder):
+                if file_name.startswith(name + ".") and file_name[len(name) + 1:].isdigit():
+                    found.append(int(file_name[len(name) + 1:]))
+        except OSError:
+            pass
+        if len(found) == 0:
+            return
+
+        found.sort()
+        self.first = found[0]
+        self.current = found[-1]
+        torn = False
+        # A segment missing from the run is taken as empty so replay carries on past it
+        for segment in range(self.first, self.current + 1):
+            size = 0
+            records = 0
+            torn = False
+            if segment in found:
+                try:
+                    with open(self.get_segment_file(segment), 'rb') as records_file:
+                        for line in records_file:
+                            size += len(line)
+                            if not line.endswith(b"\n"):
+                                torn = True
+                                continue
+                            records += 1
+                            try:
+                                self.sequence = max(self.sequence, int(line[:line.find(b"\t")]) + 1)
+                            except ValueError:
+                                pass
+                except OSError:
+                    pass
+            self.sizes[segment] = size
+            self.records[segment] = records
+        if torn is True:
+            self.current += 1
+        self.my_log.log_message("MQTT spool holds " + str(self.get_count()) + " messages from before the restart",
+                                "info")
+
+    # Add a message, time is the time.time() it was queued
+    # Returns the sequence number it was given
+    def append(self, topic, message, level, timestamp):
+        sequence = self.sequence
+        self.sequence += 1
+        self.ram.append(str(sequence) + "\t" + str(int(timestamp)) + "\t" + str(level) + "\t" + str(topic) + "\t" +
+                        json.dumps(message) + "\n")
+        if len(self.ram) >= self.ram_records:
+            self.write()
+        return sequence
+
+    # Append the records held in RAM to the card in one write
+    # If the card can't be written the records stay in RAM, the oldest are dropped past twice ram_records
+    def write(self):
+        if len(self.ram) == 0:
+            return
+        lines = "".join(self.ram)
+        try:
+            with open(self.get_segment_file(self.current), 'a') as records_file:
+                records_file.write(lines)
+        except OSError as e:
+            self.my_log.log_message("Unable to write MQTT spool: " + str(e), "error")
+            # The write may have stopped part way through a record, the next one starts a new segment
+            self.sizes.setdefault(self.current, 0)
+            self.records.setdefault(self.current, 0)
+            self.current += 1
+            while len(self.ram) > self.ram_records * 2:
+                self.ram.pop(0)
+                self.dropped += 1
+            return
+        self.sizes[self.current] = self.sizes.get(self.current, 0) + len(lines.encode())
+        self.records[self.current] = self.records.get(self.current, 0) + len(self.ram)
+        self.ram.clear()
+
+        if self.sizes[self.current] >= self.segment_bytes:
+            self.current += 1
+        self._enforce_cap()
+
+    # Publish up to limit records, oldest first
+    # publish(topic, payload, level) must raise on failure, the record it failed on is kept for the next replay
+    # Returns the number of records published
+    def replay(self, publish, limit):
+        sent = 0
+        while sent < limit and self.first in self.records:
+            segment = self.first
+            sent += self._replay_segment(publish, limit - sent)
+            if self.first == segment:
+                return sent  # stopped part way through the segment
+        while sent < limit and len(self.ram) > 0:
+            record = self._decode(self.ram[0])
+            if record is not None:
+                publish(*record)
+                sent += 1
+            self.ram.pop(0)
+        return sent
+
+    # --- Private Methods --- #
+
+    # Replay records from the oldest segment, removes it once it has been read to the end
+    # A segment that can't be opened is dropped
+    def _replay_segment(self, publish, limit):
+        try:
+            records_file = open(self.get_segment_file(self.first), 'rb')
+        except OSError:
+            self.dropped += self.records.get(self.first, 0) - self.read_records
+            self._remove_first()
+            return 0
+
+        sent = 0
+        try:
+            records_file.seek(self.read_offset)
+            while sent < limit:
+                line = records_file.readline()
+                if not line:
+                    break
+                if line.endswith(b"\n"):
+                    record = self._decode(line)
+                    if record is not None:
+                        publish(*record)
+                        sent += 1
+                    self.read_records += 1
+                self.read_offset += len(line)
+        finally:
+            records_file.close()
+        if self.read_offset >= self.sizes[self.first]:
+            self._remove_first()
+        return sent
+
+    # Turn a record back into topic, payload and level
+    # Returns None for a record that can't be decoded, it is counted as skipped
+    def _decode(self, record):
+        try:
+            if isinstance(record, bytes):
+                record = record.decode()
+            sequence, timestamp, level, topic, message = record.rstrip("\n").split("\t", 4)
+            message = json.loads(message)
+            sequence = int(sequence)
+            timestamp = int(timestamp)
+        except ValueError:
+            self.skipped += 1
+            if self.skipped == 1:
+                self.my_log.log_message("Skipping MQTT spool records that can't be read", "warning")
+            return None
+        if isinstance(message, dict):
+            payload = message
+        else:
+            payload = {"value": message}
+        payload["seq"] = sequence
+        payload["created_at"] = format_time(timestamp)
+        return topic, payload, level
+
+    # Drop the oldest segments while the card holds more than max_bytes
+    def _enforce_cap(self):
+        total = 0
+        for segment in self.sizes:
+            total += self.sizes[segment]
+        while total > self.max_bytes and self.first < self.current:
+            total -= self.sizes.get(self.first, 0)
+            self.dropped += self.records.get(self.first, 0) - self.read_records
+            self.my_log.log_message("MQTT spool full, oldest messages dropped", "warning")
+            self._remove_first()
+
+    # Remove the oldest segment, the segment being written is started over once it has been replayed
+    def _remove_first(self):
+        try:
+            os.remove(self.get_segment_file(self.first))
+        except OSError:
+            pass
+        self.sizes.pop(self.first, None)
+        self.records.pop(self.first, None)
+        self.read_offset = 0
+        self.read_records = 0
+        if self.first == self.current:
+            self.current += 1
+        self.first += 1
+
+    def _split_base(self):
+        split = self.base.rfind("/")
+        if split < 0:
+            return ".", self.base
+        return self.base[:split] or "/", self.base[split + 1:]
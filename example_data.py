@@ -1,16 +1,79 @@
 import adafruit_logging as logger
 
 data = {
+    'sd_mount': '/sd',  # Where the SD card is mounted
     'timezone': '<your timezone>', # see http://wordtimeapi.org/timezones
     'tz_offset': 0,  # Replace with your TZ offset, be sure to handle when time changes! Need this for NTP
     'log_level': logger.INFO,  # debug, info, warning, error, critical
     'watchdog_timeout': 10,  # how long is the MCU unresponsive before the watchdog raises an error
+    'supervisor_interval': 1,  # How often, in seconds, the supervisor checks the tasks and feeds the watchdog
+    'task_timeout': 5,  # How long, in seconds, a task may go without a heartbeat before it is restarted
+    'task_max_restarts': 5,  # Restarts of a critical task after which the watchdog is no longer fed
+    'task_restart_window': 600,  # How long, in seconds, a task must run after a restart before its restarts are forgotten
+    'supervisor_report_interval': 300,  # How often, in seconds, loop lag and task percentiles are published
     'siren_timeout': 30,  # how long should the siren sound if no one disables it
+    'exit_delay': 30,  # How long, in seconds, after an arm command before the system is armed, 0 arms straight away
+    'entry_delay': 30,  # How long, in seconds, a tripped zone waits for a disarm before the siren sounds, 0 for none
+    'timer_tick': 0.05,  # How often, in seconds, the timer wheel turns, timers are accurate to one tick
+    'timer_slots': 64,  # Slots in the timer wheel, timers further out than slots * timer_tick wait whole turns
     'sd_logfile': '<your system log file dir/filename>',  # The name of the file where you store you system log info
-    'sd_logfile_feed_name': '<your MQTT feed name'>,  # This is the MQTT feed to subscribe to that knows when to dump log data
+    'sd_logfile_feed_name': '<your MQTT feed name>',  # This is the MQTT feed to subscribe to that knows when to dump log data
     'sd_logfile_lines_to_output': 12, # How many lines of the syslog file to read
+    'sd_logger_name': '<your logger name>',  # Name of the adafruit_logging logger whose lines go to the syslog
+    'sd_log_segment_bytes': 32768,  # Size a syslog segment (<sd_logfile>.N) grows to before a new one is started
+    'sd_log_segments': 4,  # How many syslog segments are kept, older ones are removed
+    'sd_log_index_lines': 64,  # How many of the most recent syslog lines can be dumped with a single seek
+    'sd_log_chunk_bytes': 256,  # Size of each MQTT message a syslog dump is sent in
     'alarm_management_feed_name': '<your MQTT feed name>', # This is the MQTT feed to subscribe to that handles arming system
+    'sensor_feeds': ['<your PIR feed name>'],  # Single PIR feeds, motion on any of them trips the relay
+    'sensor_routes': {'sensors/pir/+': 'pir', 'sensors/contact/+': 'zone',
+                      'sensors/heartbeat/+': 'heartbeat'},  # Feed or wildcard pattern -> pir, zone, heartbeat, command or syslog
     'alarm_code': 1234, # Your alarm code
-    'alarm_state_file': '<your alarm state dir/filename>',  # Where the state of the system is stored (armed/disarmed)
-    'excluded_zones_file': '<your excluded zones dir/filename>'  # Where the state of the excluded zones are stored
+    'alarm_command_queue_size': 4,  # How many alarm commands can wait, more are dropped
+    'alarm_command_interval': 0.5,  # Minimum time, in seconds, between two alarm commands being carried out
+    'alarm_max_attempts': 5,  # Wrong codes in a row before alarm commands are locked out
+    'alarm_lockout_seconds': 60,  # How long alarm commands are locked out for
+    'alarm_state_file': '<your alarm state dir/filename>',  # Only read to bring an older system's armed state into state_file
+    'excluded_zones_file': '<your excluded zones dir/filename>',  # Only read to bring an older system's exclusions into state_file
+    'state_file': '<your system state dir/filename>',  # Base name of the state journal (.jnl) and snapshot (.snp)
+    'state_flush_interval': 1,  # How often, in seconds, state changes are written to the SD card
+    'state_compact_after': 64,  # How many journal lines are written before the journal is folded into the snapshot
+    'config_cache_file': '<your config cache dir/filename>',  # Compiled configuration, rebuilt when data.py, mqtt_data.py or system_data.py change
+    'history_file': '<your event history dir/filename>',  # Base name of the daily event history segments (<history_file>.YYYYMMDD)
+    'history_feed_name': '<your MQTT feed name>',  # This is the MQTT feed to subscribe to that takes event history queries
+    'history_ram_records': 32,  # How many event history records are collected in RAM before they are written to the SD card
+    'history_flush_interval': 60,  # Longest time, in seconds, an event history record waits in RAM
+    'history_index_every': 32,  # Every Nth record of a day goes in its index, a query reads at most N records it doesn't need
+    'history_days': 31,  # How many days of event history are kept
+    'mqtt_poll_timeout': 0.01,  # How long, in seconds, each pass of the MQTT listener waits on the socket
+    'poll_fast': 0.1,  # Seconds between MQTT and command checks while armed, sounding, or just after activity
+    'poll_slow': 1,  # Seconds between MQTT and command checks while disarmed and quiet
+    'activity_hold': 30,  # How long, in seconds, a zone change, command or satellite event keeps the fast polling
+    'idle_sleep_after': 120,  # Seconds disarmed and quiet before the board light sleeps between checks, 0 never sleeps
+    'idle_sleep_max': 2,  # Longest light sleep, in seconds, a zone pin changing wakes the board sooner
+    'network_retry': 10,  # How long, in seconds, to wait before the first retry after Wi-Fi or MQTT fails to connect
+    'network_retry_max': 120,  # Longest wait, in seconds, between retries, the wait doubles up to this
+    'network_check_interval': 1,  # How often, in seconds, a connection that is up is checked
+    'wifi_connect_timeout': 10,  # Longest time, in seconds, joining the Wi-Fi network can take before it is retried
+    'mqtt_connect_timeout': 5,  # Longest time, in seconds, the TLS and MQTT connect can take before it is retried
+    'relay_pulse': 4,  # How long, in seconds, the relay is held on when a sensor trips
+    'satellite_heartbeat_interval': 30,  # How often, in seconds, satellites send a heartbeat
+    'satellite_missed_beats': 3,  # Heartbeats a satellite can miss before it is reported as not responding
+    'satellite_dedup_window': 32,  # How many recent sequence numbers of each satellite are checked for duplicates
+    'satellite_heartbeat_feed': 'sensors/heartbeat',  # Satellites send heartbeats to <feed>/<node name>
+    # 'satellite_node': '<this board's name>',  # Set when this board reports to a panel as a satellite
+    'satellite_contact_feed': 'sensors/contact',  # A satellite sends its zone changes to <feed>/<node name>-<zone>
+    'publish_interval': 1,  # How often, in seconds, queued MQTT messages are sent
+    'publish_batch': 4,  # How many queued MQTT messages are sent each publish_interval
+    'publish_queue_size': 32,  # How many MQTT messages can wait before low priority ones are dropped
+    'spool_file': '<your MQTT spool dir/filename>',  # Base name of the segments messages are kept in while MQTT is down
+    'spool_ram_records': 16,  # How many spooled messages are collected in RAM before they are written to the SD card
+    'spool_segment_bytes': 8192,  # Size a spool segment (<spool_file>.N) grows to before a new one is started
+    'spool_max_bytes': 65536,  # Most the spool holds on the SD card, the oldest segment is dropped past this
+    'spool_replay_batch': 8,  # How many spooled messages are replayed each publish_interval once MQTT is back
+    'latency_instrumentation': False,  # Time zone changes from pin to siren/publish, adds a little work to each change
+    'latency_report_interval': 300,  # How often, in seconds, latency percentiles are published to the diagnostics feed
+    'heap_telemetry': False,  # Track heap use and growth per task, adds two heap reads to each pass of each task
+    'heap_report_interval': 300,  # How often, in seconds, garbage is collected and heap figures are published
+    'heap_snapshot_file': '<your heap snapshot dir/filename>'  # Heap figures are appended here before a watchdog reset
 }
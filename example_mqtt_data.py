@@ -3,5 +3,6 @@ mqtt_data = {
     'key': '<your MQTT key>',
     'server': '<your MQTT server>',
     'port': 0000,  # Port for your MQTT server
-    'primary_feed': '<your MQTT feed name>'  # This is the general logging (syslog) feed name
+    'primary_feed': '<your MQTT feed name>',  # This is the general logging (syslog) feed name
+    'diagnostics_feed': '<your MQTT feed name>'  # Latency and other diagnostics are published here
 }
@@ -1,13 +1,24 @@
 import board
 
 system_data = {
-    'zones': [['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>'],
+    # Optional 5th entry per zone: how long in ms a change must hold before it is reported (debounce)
+    'zones': [['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>', 50],
               ['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>'],
               ['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>'],
               ['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>'],
               ['<zone_name>', board.GPIO, '<MQTT feed name>', '<asyncio task name>']
               ],
+    # Optional partitions, each armed and disarmed on its own: [name, [zone names], siren]
+    # siren is yelp or steady, a zone can be in more than one partition
+    # Without partitions every zone is in one partition, house, that yelps the siren
+    'partitions': [['perimeter', ['<zone_name>', '<zone_name>'], 'yelp'],
+                   ['interior', ['<zone_name>', '<zone_name>', '<zone_name>'], 'steady']
+                   ],
     'siren_steady': board.GPIO,
     'siren_yelp': board.GPIO,
-    'siren_feed_name': "<MQTT feed name>"  # Feed that publishes attempts to arm the system via code
+    'siren_feed_name': "<MQTT feed name>",  # Feed that publishes attempts to arm the system via code
+    'zone_detection': 'keypad',  # keypad (hardware event queue) or poll (read every zone pin on each check)
+    'zone_scan_interval': 0.02,  # Seconds between keypad scans of the zone pins
+    'zone_scan_quiet_interval': 0.1,  # Seconds between zone checks while the system is disarmed and quiet
+    'zone_debounce_ms': 50  # Default debounce window for zones without their own, 0 turns debouncing off
 }
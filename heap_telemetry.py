@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: MIT
+
+# Heap and garbage collector telemetry
+# Each async task registers itself and wraps one pass of its loop with begin()/end()
+# The heap allocated during the pass is added to the task, so heap growth can be traced back to a task
+# The lowest free heap seen at the end of any pass is kept as the low-water mark
+
+# Explicit collections go through collect(), which counts and times them
+# A pass that is interrupted by an automatic collection can appear to shrink the heap, it counts as no growth
+
+# Snapshots are published to the diagnostics feed and appended to data["heap_snapshot_file"] on the SD card,
+# code.py saves one before a watchdog reset so there is something to look at after the restart
+
+# Turned on and off with data["heap_telemetry"] or set_enabled() at runtime
+# When off begin() and end() return straight away
+
+import gc
+import time
+import array
+from adafruit_ticks import ticks_ms, ticks_diff
+import local_logger as logger
+import publish_queue
+import config_compiler
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+# The heap counters are CircuitPython/MicroPython only, they read as 0 elsewhere
+try:
+    mem_free = gc.mem_free
+    mem_alloc = gc.mem_alloc
+except AttributeError:
+    def mem_free():
+        return 0
+
+    def mem_alloc():
+        return 0
+
+enabled = data.get("heap_telemetry", False)
+task_names = []
+task_passes = array.array("L")  # passes recorded for each task
+task_growth = array.array("L")  # bytes allocated over all passes of each task
+task_peak = array.array("L")  # most bytes allocated by one pass of each task
+low_water = None  # lowest free heap seen, None until the first pass is recorded
+collections = 0
+collect_ms = 0  # total time spent in collect()
+collect_max_ms = 0  # longest collect()
+
+
+# Turn the telemetry on or off
+def set_enabled(value: bool):
+    global enabled
+    enabled = value
+
+
+# Add a task and return its index for begin()/end()
+# Registering the same name again returns the existing index, so restarted tasks keep their figures
+def register(name):
+    if name in task_names:
+        return task_names.index(name)
+    task_names.append(name)
+    task_passes.append(0)
+    task_growth.append(0)
+    task_peak.append(0)
+    return len(task_names) - 1
+
+
+# Called at the start of a task's pass, returns what end() needs
+def begin():
+    if enabled is False:
+        return 0
+    return mem_alloc()
+
+
+# Called at the end of a task's pass with what begin() returned
+def end(task, started):
+    global low_water
+
+    if enabled is False:
+        return
+    grown = mem_alloc() - started
+    if grown < 0:
+        grown = 0
+    task_passes[task] += 1
+    task_growth[task] += grown
+    if grown > task_peak[task]:
+        task_peak[task] = grown
+    free = mem_free()
+    if low_water is None or free < low_water:
+        low_water = free
+
+
+# Run a full collection and time it, returns the bytes freed
+def collect():
+    global collections, collect_ms, collect_max_ms
+
+    before = mem_free()
+    started = ticks_ms()
+    gc.collect()
+    elapsed = ticks_diff(ticks_ms(), started)
+    collections += 1
+    collect_ms += elapsed
+    if elapsed > collect_max_ms:
+        collect_max_ms = elapsed
+    return mem_free() - before
+
+
+# Return the lowest free heap seen, or the current free heap if nothing has been recorded
+def get_low_water():
+    if low_water is None:
+        return mem_free()
+    return low_water
+
+
+# Return the figures as one line
+# e.g. heap free=81234 alloc=40312 low=60112 gc n=3 total=12ms max=5ms; zone_scan n=500 grew=2048 peak=64; ...
+def get_snapshot():
+    line = ("heap free=" + str(mem_free()) + " alloc=" + str(mem_alloc()) + " low=" + str(get_low_water()) +
+            " gc n=" + str(collections) + " total=" + str(collect_ms) + "ms max=" + str(collect_max_ms) + "ms;")
+    for task in range(len(task_names)):
+        line += (" " + task_names[task] + " n=" + str(task_passes[task]) + " grew=" + str(task_growth[task]) +
+                 " peak=" + str(task_peak[task]) + ";")
+    return line
+
+
+# Clear the per task figures, the low-water mark and collection figures are kept
+def reset():
+    for task in range(len(task_names)):
+        task_passes[task] = 0
+        task_growth[task] = 0
+        task_peak[task] = 0
+
+
+# Publish a snapshot to the diagnostics feed and start new per task figures
+def publish():
+    if enabled is False:
+        return
+    topic = config_compiler.getConfig()["diagnostics_topic"]
+    publish_queue.enqueue(topic, get_snapshot(), "info", publish_queue.PRIORITY_LOW)
+    reset()
+
+
+# Append a snapshot to the SD card, reason says why it was taken, e.g. watchdog
+# Written straight away, the system is usually about to restart
+def save_snapshot(reason):
+    snapshot_file = data.get("sd_mount", "/sd") + "/" + data.get("heap_snapshot_file", "heap_snapshot")
+    try:
+        with open(snapshot_file, 'a') as snapshot:
+            snapshot.write(str(time.time()) + " " + str(reason) + " " + get_snapshot() + "\n")
+    except OSError as e:
+        logger.getLocalLogger().log_message("Unable to save heap snapshot: " + str(e), "error")
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: MIT
+
+# Hot path latency instrumentation
+# Every zone change is timed from the moment its pin changed (the sample that started the change) through
+# the stages it goes through: detector check, zone report, alarm handling, siren output and MQTT publish
+# Each stage has a fixed histogram, recording a sample only increments a bucket
+
+# Buckets are powers of two in microseconds: bucket N holds samples below 2^N us, the last one everything above
+# Percentiles are reported as the upper bound of the bucket they fall in
+
+# Turned on and off with data["latency_instrumentation"] or set_enabled() at runtime
+# When off every hook returns straight away
+
+import time
+import array
+from adafruit_ticks import ticks_ms, ticks_diff
+import config_compiler
+import publish_queue
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+STAGE_CHECK = 0  # Detector has settled the change
+STAGE_REPORT = 1  # Zone.report() has logged/queued the change
+STAGE_ALARM = 2  # Alarm handling has looked at the change
+STAGE_SIREN = 3  # Siren output driven
+STAGE_PUBLISH = 4  # Message about the change has left for the broker
+STAGE_NAMES = ("check", "report", "alarm", "siren", "publish")
+
+BUCKETS = 25  # up to ~16 s
+
+enabled = data.get("latency_instrumentation", False)
+edge_ns = 0  # time.monotonic_ns() of the pin change being followed, 0 when there is none
+histograms = array.array("L", [0] * (BUCKETS * len(STAGE_NAMES)))
+
+
+# Turn the instrumentation on or off
+def set_enabled(value: bool):
+    global enabled
+    enabled = value
+
+
+# Start following a change, since is the ticks_ms() time its pin changed
+def start_edge(since):
+    global edge_ns
+
+    if enabled is False:
+        return
+    edge_ns = time.monotonic_ns() - ticks_diff(ticks_ms(), since) * 1000000
+
+
+# Stop following the change once alarm handling is done with it
+def end_edge():
+    global edge_ns
+    edge_ns = 0
+
+
+# Return the start of the change being followed, saved with queued messages so their publish can be timed
+def get_edge():
+    return edge_ns
+
+
+# Record that the change being followed has reached a stage
+def mark(stage):
+    if enabled is False or edge_ns == 0:
+        return
+    record(stage, edge_ns)
+
+
+# Record a stage for a change that started at start_ns
+def record(stage, start_ns):
+    if enabled is False or start_ns == 0:
+        return
+    elapsed = (time.monotonic_ns() - start_ns) // 1000
+    bucket = 0
+    while elapsed > 0 and bucket < BUCKETS - 1:
+        elapsed >>= 1
+        bucket += 1
+    histograms[stage * BUCKETS + bucket] += 1
+
+
+# Return the sample count and the upper bound in microseconds of the p50, p95 and p99 buckets for a stage
+def get_percentiles(stage):
+    base = stage * BUCKETS
+    count = 0
+    for bucket in range(BUCKETS):
+        count += histograms[base + bucket]
+    if count == 0:
+        return 0, 0, 0, 0
+
+    result = [count]
+    for percent in (50, 95, 99):
+        target = (count * percent + 99) // 100
+        seen = 0
+        for bucket in range(BUCKETS):
+            seen += histograms[base + bucket]
+            if seen >= target:
+                result.append(1 << bucket)
+                break
+    return result[0], result[1], result[2], result[3]
+
+
+# Clear every histogram
+def reset():
+    for index in range(len(histograms)):
+        histograms[index] = 0
+
+
+# Publish the percentiles of every stage to the diagnostics feed and start new histograms
+# e.g. latency check n=3 p50<=64us p95<=128us p99<=128us; report ...
+def publish():
+    if enabled is False:
+        return
+    message = "latency"
+    for stage in range(len(STAGE_NAMES)):
+        count, p50, p95, p99 = get_percentiles(stage)
+        if count > 0:
+            message += (" " + STAGE_NAMES[stage] + " n=" + str(count) + " p50<=" + str(p50) + "us p95<=" + str(p95) +
+                        "us p99<=" + str(p99) + "us;")
+    topic = config_compiler.getConfig()["diagnostics_topic"]
+    publish_queue.enqueue(topic, message, "info", publish_queue.PRIORITY_LOW)
+    reset()
@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: MIT
+
+# Log level check for the reporting path
+# Messages below data["log_level"] are thrown away by the logger anyway, checking first means they are never
+# formatted or queued
+# Levels are the adafruit_logging numbers, the system passes them around by name
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+LEVELS = {"notset": 0, "debug": 10, "info": 20, "warning": 30, "error": 40, "critical": 50}
+
+threshold = data.get("log_level", 0)
+
+
+# Change the lowest level that is reported
+def set_threshold(level):
+    global threshold
+    threshold = level
+
+
+# Return True if a message at this level would be reported
+def enabled(level):
+    return LEVELS.get(level, 0) >= threshold
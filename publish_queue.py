@@ -0,0 +1,220 @@
+# SPDX-License-Identifier: MIT
+
+# Outbound MQTT publish queue
+# Zones, the siren and code.py hand their messages to the queue instead of publishing straight away
+# The queue is flushed in small batches on a fixed tick so hosted brokers (Adafruit IO) stay under their rate limit
+# and a slow publish never holds up zone monitoring
+
+# State topics are coalesced: only the latest value waiting for a topic is sent
+# When the queue is full the oldest, lowest priority message is dropped
+# High priority messages (siren, alarm) are never dropped, the queue grows past its capacity for them instead
+# Entry lists are kept for reuse once their message is sent or dropped, queueing a message does not allocate one
+
+# When a publish fails everything queued is moved to the store and forward spool (event_spool.py) in the order it
+# was queued, and so is everything queued after it until the spool has been replayed
+# Each flush first replays up to data["spool_replay_batch"] spooled messages, the first one to go through ends
+# the outage
+
+import time
+import local_mqtt
+import local_logger as logger
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+import latency
+import event_spool
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+PRIORITY_LOW = 0  # Zone states and chatter, first to go
+PRIORITY_NORMAL = 1  # General log messages
+PRIORITY_HIGH = 2  # Siren and alarm messages, never dropped
+
+publish_queue = None
+
+
+# Create the queue singleton
+def _addPublishQueue():
+    global publish_queue
+
+    if publish_queue is None:
+        publish_queue = PublishQueue(data.get("publish_queue_size", 32), data.get("publish_batch", 4))
+
+
+# Get the publish queue singleton
+def getPublishQueue():
+    _addPublishQueue()
+    return publish_queue
+
+
+# Shortcut to add a message to the queue singleton
+def enqueue(topic, message, level="info", priority=PRIORITY_NORMAL, coalesce=False):
+    return getPublishQueue().enqueue(topic, message, level, priority, coalesce)
+
+
+class PublishQueue:
+
+    # Should never be called directly, use getPublishQueue() instead
+    def __init__(self, capacity, batch):
+        self.capacity = capacity
+        self.batch = batch
+        # key -> [topic, message, level, start of the zone change it reports (latency), time.time() queued, order]
+        self.entries = {}
+        self.lanes = ([], [], [])  # keys waiting to be sent, oldest first, one list per priority
+        self.spare = []  # entry lists ready for reuse, at most capacity of them
+        self.size = 0
+        self.sequence = 0  # keys for messages that are not coalesced
+        self.order = 0  # order messages were queued in, across every lane
+        self.dropped = 0
+        self.coalesced = 0
+        self.spool = None
+        self.replay_batch = data.get("spool_replay_batch", 8)
+        self.my_mqtt = None
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the number of messages waiting
+    def get_size(self):
+        return self.size
+
+    # Return True when a new low or normal priority message may push out an older one
+    def is_full(self):
+        return self.size >= self.capacity
+
+    # Return how many messages were dropped and how many were merged into a newer value
+    def get_counters(self):
+        return self.dropped, self.coalesced
+
+    # Return the number of messages waiting in the spool
+    def get_spooled(self):
+        if self.spool is None:
+            return 0
+        return self.spool.get_count()
+
+    # --- Queue --- #
+
+    # Add a message to the queue
+    # With coalesce set, a message still waiting for the same topic is replaced by this one
+    # Returns False if the message was dropped
+    def enqueue(self, topic, message, level="info", priority=PRIORITY_NORMAL, coalesce=False):
+        if coalesce is True:
+            entry = self.entries.get(topic)
+            if entry is not None:
+                self.order += 1
+                entry[1] = message
+                entry[2] = level
+                entry[4] = time.time()
+                entry[5] = self.order
+                self.coalesced += 1
+                return True
+            key = topic
+        else:
+            self.sequence += 1
+            key = self.sequence
+
+        if self.size >= self.capacity and self._make_room(priority) is False:
+            self.dropped += 1
+            return False
+
+        self.order += 1
+        if len(self.spare) > 0:
+            entry = self.spare.pop()
+            entry[0] = topic
+            entry[1] = message
+            entry[2] = level
+            entry[3] = latency.get_edge()
+            entry[4] = time.time()
+            entry[5] = self.order
+        else:
+            entry = [topic, message, level, latency.get_edge(), time.time(), self.order]
+        self.entries[key] = entry
+        self.lanes[priority].append(key)
+        self.size += 1
+        return True
+
+    # Publish up to one batch of messages, highest priority first
+    # Spooled messages are replayed before anything queued, which waits in the spool until the replay is done
+    # A failed publish moves everything queued to the spool
+    # Returns the number of messages published
+    def flush(self, limit=None):
+        if self.spool is None:
+            self.spool = event_spool.getSpool()
+        if self.size == 0 and self.spool.get_count() == 0:
+            return 0
+        if limit is None:
+            limit = self.batch
+        if self.my_mqtt is None:
+            self.my_mqtt = local_mqtt.getMqtt(use_logger=True)
+
+        sent = 0
+        if self.spool.get_count() > 0:
+            try:
+                sent = self.spool.replay(self.my_mqtt.publish, self.replay_batch)
+            except (OSError, MMQTTException):
+                self._spool_queued()
+                return 0
+            if self.spool.get_count() > 0:
+                self._spool_queued()
+                return sent
+            self.my_log.log_message("MQTT spool replayed", "info")
+
+        priority = PRIORITY_HIGH
+        while priority >= PRIORITY_LOW and sent < limit:
+            lane = self.lanes[priority]
+            while len(lane) > 0 and sent < limit:
+                key = lane.pop(0)
+                entry = self.entries.pop(key)
+                self.size -= 1
+                try:
+                    self.my_mqtt.publish(entry[0], entry[1], entry[2])
+                except (OSError, MMQTTException) as e:
+                    self.entries[key] = entry
+                    lane.insert(0, key)
+                    self.size += 1
+                    self.my_log.log_message("Publish failed, spooling messages until the broker is back: " + str(e),
+                                            "warning")
+                    self._spool_queued()
+                    return sent
+                latency.record(latency.STAGE_PUBLISH, entry[3])
+                self._release(entry)
+                sent += 1
+            priority -= 1
+        return sent
+
+    # Drop the oldest message at or below the new message's priority, high priority messages are never dropped
+    # A high priority message is always let in, even if nothing could be dropped
+    def _make_room(self, priority):
+        lane = PRIORITY_LOW
+        while lane <= priority and lane < PRIORITY_HIGH:
+            if len(self.lanes[lane]) > 0:
+                key = self.lanes[lane].pop(0)
+                self._release(self.entries.pop(key))
+                self.size -= 1
+                self.dropped += 1
+                return True
+            lane += 1
+        return priority == PRIORITY_HIGH
+
+    # Move every queued message to the spool, in the order they were queued
+    def _spool_queued(self):
+        if self.size == 0:
+            return
+        waiting = []
+        for lane in self.lanes:
+            for key in lane:
+                waiting.append(self.entries.pop(key))
+            lane.clear()
+        waiting.sort(key=lambda entry: entry[5])
+        for entry in waiting:
+            self.spool.append(entry[0], entry[1], entry[2], entry[4])
+            self._release(entry)
+        self.size = 0
+
+    # Keep a sent or dropped entry for reuse, the message is let go so it can be collected
+    def _release(self, entry):
+        if len(self.spare) < self.capacity:
+            entry[1] = None
+            self.spare.append(entry)
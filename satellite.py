@@ -0,0 +1,247 @@
+# SPDX-License-Identifier: MIT
+
+# Satellite protocol for boards that report sensors to the panel over MQTT
+# A satellite sends its events and heartbeats as one compact line: <node>,<boot>,<seq>,<value>
+#   node   the satellite's name, data["satellite_node"] on the satellite
+#   boot   a random number picked when the satellite starts, a new boot starts a new sequence
+#   seq    counts up by one for every message the satellite sends, events and heartbeats share it
+#   value  the sensor value, for a heartbeat the seconds the satellite has been up
+# e.g. hall,4821,57,1 is the 57th message from hall since it started, reporting 1 (open / motion)
+
+# Satellite side: Satellite.send() queues an event, the wired zones of a board with data["satellite_node"] send
+# every change to <data["satellite_contact_feed"]>/<node>-<zone> (1 open, 0 closed), where the panel's
+# sensors/contact/+ route picks them up
+# run() sends a heartbeat to data["satellite_heartbeat_feed"] every data["satellite_heartbeat_interval"] seconds
+# Heartbeats are only queued while MQTT is up and are coalesced in the publish queue, an outage does not store up
+# a backlog of them
+# The first heartbeat comes after a random part of the interval so boards started together don't beat in step
+
+# Panel side: the node registry takes every message from a satellite through accept()
+# The last data["satellite_dedup_window"] sequence numbers of each node are kept as a bitmask, a message whose
+# number is already in the window (a QoS redelivery) or older than the window is dropped
+# A node that has not been heard from for data["satellite_missed_beats"] heartbeats is marked stale, and marked
+# back when it is heard from again, both are reported on the siren feed
+# Messages without the node fields, from satellites that predate the protocol, are passed through unchecked
+
+import asyncio
+import json
+import random
+import time
+from adafruit_ticks import ticks_ms, ticks_diff
+import local_mqtt
+import local_logger as logger
+import publish_queue
+import task_supervisor
+import config_compiler
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+# A node is a list: [boot, highest sequence number, window bitmask, ticks_ms() last heard, stale, duplicates]
+NODE_BOOT = 0
+NODE_HIGHEST = 1
+NODE_WINDOW = 2
+NODE_HEARD = 3
+NODE_STALE = 4
+NODE_DUPLICATES = 5
+
+registry = None
+satellite = None
+
+
+# Create the node registry singleton, used by the panel
+def _addRegistry():
+    global registry
+
+    if registry is None:
+        registry = NodeRegistry(data.get("satellite_heartbeat_interval", 30), data.get("satellite_missed_beats", 3),
+                                data.get("satellite_dedup_window", 32))
+
+
+# Get the node registry singleton
+def getRegistry():
+    _addRegistry()
+    return registry
+
+
+# Create the satellite singleton, used when this board reports to a panel
+def _addSatellite():
+    global satellite
+
+    if satellite is None:
+        satellite = Satellite(data["satellite_node"], data.get("satellite_heartbeat_feed", "sensors/heartbeat"),
+                              data.get("satellite_heartbeat_interval", 30))
+
+
+# Get the satellite singleton
+def getSatellite():
+    _addSatellite()
+    return satellite
+
+
+# Split a satellite message into node, boot, sequence number and value
+# Returns None for a message without the node fields
+def parse(message):
+    message = str(message)
+    if message.startswith("{"):
+        # Replayed from a spool, the line is the value
+        try:
+            message = str(json.loads(message).get("value"))
+        except ValueError:
+            return None
+    fields = message.split(",", 3)
+    if len(fields) != 4 or not fields[1].isdigit() or not fields[2].isdigit():
+        return None
+    return fields[0], int(fields[1]), int(fields[2]), fields[3]
+
+
+class NodeRegistry:
+
+    # Should never be called directly, use getRegistry() instead
+    def __init__(self, interval, missed_beats, window):
+        self.stale_ms = int(interval * missed_beats * 1000)
+        self.interval = interval
+        self.window = window
+        self.window_mask = (1 << window) - 1
+        self.nodes = {}  # node name -> node
+        self.duplicates = 0
+        self.topic = config_compiler.getConfig()["siren_topic"]
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the names of the nodes marked stale
+    def get_stale(self):
+        return [name for name in self.nodes if self.nodes[name][NODE_STALE] is True]
+
+    # Return one line per node, e.g. hall seq=57 age=12s duplicates=1
+    def get_summary(self):
+        now = ticks_ms()
+        lines = []
+        for name in sorted(self.nodes):
+            node = self.nodes[name]
+            line = (name + " seq=" + str(node[NODE_HIGHEST]) + " age=" +
+                    str(ticks_diff(now, node[NODE_HEARD]) // 1000) + "s duplicates=" + str(node[NODE_DUPLICATES]))
+            if node[NODE_STALE] is True:
+                line += " stale"
+            lines.append(line)
+        return "; ".join(lines)
+
+    # --- Registry --- #
+
+    # Check a message from a satellite and note the node as heard from
+    # Returns the value to act on, or None if the message is a duplicate or too old
+    def accept(self, message):
+        fields = parse(message)
+        if fields is None:
+            return message
+        name, boot, sequence, value = fields
+
+        node = self.nodes.get(name)
+        if node is None:
+            node = [boot, sequence, 1, ticks_ms(), False, 0]
+            self.nodes[name] = node
+            self.my_log.log_message("Satellite " + name + " joined", "info")
+            return value
+        self._heard(name, node)
+
+        if boot != node[NODE_BOOT]:
+            # The satellite restarted, its sequence starts again
+            node[NODE_BOOT] = boot
+            node[NODE_HIGHEST] = sequence
+            node[NODE_WINDOW] = 1
+            return value
+
+        behind = node[NODE_HIGHEST] - sequence
+        if behind < 0:
+            if -behind < self.window:
+                node[NODE_WINDOW] = ((node[NODE_WINDOW] << -behind) | 1) & self.window_mask
+            else:
+                node[NODE_WINDOW] = 1
+            node[NODE_HIGHEST] = sequence
+            return value
+        if behind < self.window and node[NODE_WINDOW] & (1 << behind) == 0:
+            # Late but not seen before
+            node[NODE_WINDOW] |= 1 << behind
+            return value
+
+        node[NODE_DUPLICATES] += 1
+        self.duplicates += 1
+        return None
+
+    # Mark the nodes that have missed their heartbeats as stale
+    def check(self):
+        now = ticks_ms()
+        for name in self.nodes:
+            node = self.nodes[name]
+            if node[NODE_STALE] is False and ticks_diff(now, node[NODE_HEARD]) > self.stale_ms:
+                node[NODE_STALE] = True
+                self._report("Satellite " + name + " is not responding", "warning")
+
+    # Check on the nodes for ever
+    # Beats as the supervisor's satellites task when it is supervised
+    async def run(self):
+        supervisor = task_supervisor.getSupervisor()
+        heartbeat = None
+        if "satellites" in supervisor.names:
+            heartbeat = supervisor.find("satellites")
+        while True:
+            self.check()
+            if heartbeat is not None:
+                supervisor.beat(heartbeat)
+            await asyncio.sleep(min(self.interval, 1))
+
+    # --- Private Methods --- #
+
+    def _heard(self, name, node):
+        node[NODE_HEARD] = ticks_ms()
+        if node[NODE_STALE] is True:
+            node[NODE_STALE] = False
+            self._report("Satellite " + name + " is back", "info")
+
+    # Log a change of a node and queue it for the siren feed
+    def _report(self, message, level):
+        self.my_log.log_message(message, level)
+        publish_queue.enqueue(self.topic, message, level, publish_queue.PRIORITY_HIGH)
+
+
+class Satellite:
+
+    # Should never be called directly, use getSatellite() instead
+    def __init__(self, node, heartbeat_feed, interval):
+        self.node = node
+        self.boot = random.randint(0, 65535)
+        self.sequence = 0
+        self.interval = interval
+        self.started = time.monotonic()
+        self.heartbeat_topic = local_mqtt.get_formatted_topic(heartbeat_feed + "/" + node)
+        self.prefix = node + "," + str(self.boot) + ","
+
+    # --- Satellite --- #
+
+    # Return the next message line for a value
+    def format(self, value):
+        line = self.prefix + str(self.sequence) + "," + str(value)
+        self.sequence += 1
+        return line
+
+    # Queue an event for a feed, value is the sensor value
+    def send(self, feed, value, priority=publish_queue.PRIORITY_NORMAL):
+        return publish_queue.enqueue(local_mqtt.get_formatted_topic(feed), self.format(value), "info", priority)
+
+    # Queue a heartbeat, replaces one still waiting in the queue
+    def heartbeat(self):
+        uptime = int(time.monotonic() - self.started)
+        publish_queue.enqueue(self.heartbeat_topic, self.format(uptime), "info", publish_queue.PRIORITY_LOW,
+                              coalesce=True)
+
+    # Send heartbeats for ever, is_up() returns True while MQTT is connected
+    async def run(self, is_up):
+        await asyncio.sleep(random.random() * self.interval)
+        while True:
+            if is_up() is True:
+                self.heartbeat()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,270 @@
+# SPDX-License-Identifier: MIT
+
+# Segmented syslog on the SD card
+# The log is split into numbered segment files: <sd_logfile>.0, <sd_logfile>.1, ...
+# A segment is closed once it reaches data["sd_log_segment_bytes"], only the newest data["sd_log_segments"]
+# segments are kept, older ones are removed as new ones start
+
+# The byte offsets of the most recent lines are kept in a small ring (the tail index)
+# Dumping the last N lines is one seek to the N-th last offset and reading forward, however big the log is
+# On start up the index is rebuilt from the newest two segments, which are bounded in size
+
+# The dump is streamed to MQTT in data["sd_log_chunk_bytes"] pieces through the publish queue,
+# it waits for the queue to have room instead of building the whole dump in memory
+
+import os
+import array
+import asyncio
+import local_mqtt
+import local_logger as logger
+import publish_queue
+
+try:
+    from adafruit_logging import Handler
+except ImportError:
+    Handler = object
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+syslog = None
+
+
+# Create the syslog singleton and open the newest segment
+def _addSyslog():
+    global syslog
+
+    if syslog is None:
+        base = data.get("sd_mount", "/sd") + "/" + data["sd_logfile"]
+        index_lines = max(data.get("sd_log_index_lines", 64), data.get("sd_logfile_lines_to_output", 12))
+        syslog = SegmentedLog(base, data.get("sd_log_segment_bytes", 32768), data.get("sd_log_segments", 4),
+                              index_lines)
+        syslog.open()
+
+
+# Get the syslog singleton
+def getSyslog():
+    _addSyslog()
+    return syslog
+
+
+# Send every line logged through the adafruit_logging logger with this name to the syslog
+def attach(logger_name):
+    import adafruit_logging
+
+    adafruit_logging.getLogger(logger_name).addHandler(SegmentedLogHandler(getSyslog()))
+
+
+# Stream the last lines of the syslog to the syslog feed
+# Started as a task when a dump is requested on data["sd_logfile_feed_name"]
+async def dump_to_mqtt(lines=None):
+    if lines is None:
+        lines = data.get("sd_logfile_lines_to_output", 12)
+    topic = local_mqtt.getMqtt(use_logger=True).gen_topic
+    queue = publish_queue.getPublishQueue()
+    wait = data.get("publish_interval", 1)
+
+    async def send(chunk):
+        while queue.is_full():
+            await asyncio.sleep(wait)
+        queue.enqueue(topic, chunk, "info", publish_queue.PRIORITY_NORMAL)
+
+    await getSyslog().tail(lines, data.get("sd_log_chunk_bytes", 256), send)
+
+
+# Return how many bytes at the start of a UTF-8 chunk are whole characters, a character cut off at the end is left out
+def _whole_chars(chunk):
+    end = len(chunk)
+    index = end - 1
+    while index >= 0 and index >= end - 4:
+        byte = chunk[index]
+        if byte & 0xC0 != 0x80:  # first byte of a character, its top bits give the character's length
+            if byte >= 0xF0:
+                size = 4
+            elif byte >= 0xE0:
+                size = 3
+            elif byte >= 0xC0:
+                size = 2
+            else:
+                size = 1
+            if index + size <= end:
+                return end
+            return index
+        index -= 1
+    return end
+
+
+class SegmentedLog:
+
+    # Should never be called directly, use getSyslog() instead
+    def __init__(self, base, segment_bytes, segments, index_lines):
+        self.base = base
+        self.segment_bytes = segment_bytes
+        self.segments = segments
+        self.current = 0  # number of the segment being written
+        self.size = 0  # bytes in the segment being written
+        self.file = None
+        self.index_segments = array.array("L", [0] * index_lines)  # tail index ring: segment of each line
+        self.index_offsets = array.array("L", [0] * index_lines)  # tail index ring: byte offset of each line
+        self.index_head = 0  # next slot in the ring
+        self.index_count = 0  # lines in the ring
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the file name of a segment
+    def get_segment_file(self, segment):
+        return self.base + "." + str(segment)
+
+    # Return the number of the oldest segment still kept
+    def get_first_segment(self):
+        return max(0, self.current - self.segments + 1)
+
+    # --- Log --- #
+
+    # Find the newest segment, remove any beyond the segment limit and rebuild the tail index
+    def open(self):
+        folder, name = self._split_base()
+        newest = None
+        found = []
+        try:
+            for file_name in os.listdir(folder):
+                if file_name.startswith(name + ".") and file_name[len(name) + 1:].isdigit():
+                    segment = int(file_name[len(name) + 1:])
+                    found.append(segment)
+                    if newest is None or segment > newest:
+                        newest = segment
+        except OSError:
+            pass
+
+        if newest is not None:
+            self.current = newest
+            for segment in found:
+                if segment < self.get_first_segment():
+                    self._remove(segment)
+            if self.current > 0:
+                self._index_segment(self.current - 1)
+            self.size = self._index_segment(self.current)
+
+    # Append one line to the newest segment, starting a new segment once it is full
+    def write(self, line):
+        encoded = line.encode() + b"\n"
+        try:
+            if self.file is None:
+                self.file = open(self.get_segment_file(self.current), 'ab')
+            self.file.write(encoded)
+            self.file.flush()
+        except OSError:
+            self._close()
+            return
+        self._index(self.current, self.size)
+        self.size += len(encoded)
+        if self.size >= self.segment_bytes:
+            self._rotate()
+
+    # Pass the last lines of the log to the coroutine send in chunks of at most chunk_bytes
+    # Only the segments holding those lines are read, starting at the indexed offset
+    # Chunks end after the last whole line they hold, the rest is carried into the next read so a character is never
+    # split between two chunks. A line longer than a chunk is cut after its last whole character
+    async def tail(self, lines, chunk_bytes, send):
+        segment, offset = self._tail_start(lines)
+        if segment is None:
+            return
+        while segment <= self.current:
+            try:
+                with open(self.get_segment_file(segment), 'rb') as log:
+                    log.seek(offset)
+                    carry = b""
+                    while True:
+                        read = log.read(max(1, chunk_bytes - len(carry)))
+                        chunk = carry + read
+                        if not read:
+                            chunk = chunk[:_whole_chars(chunk)]  # a torn last line loses its cut character
+                            if chunk:
+                                await send(chunk.decode())
+                            break
+                        end = chunk.rfind(b"\n") + 1
+                        if end == 0:
+                            end = _whole_chars(chunk)
+                        carry = chunk[end:]
+                        if end > 0:
+                            await send(chunk[:end].decode())
+            except (OSError, UnicodeError):
+                pass
+            segment += 1
+            offset = 0
+
+    # --- Private Methods --- #
+
+    # Return the segment and offset of the lines-th last line, or (None, 0) for an empty log
+    def _tail_start(self, lines):
+        if self.index_count == 0:
+            return None, 0
+        lines = min(lines, self.index_count)
+        slot = (self.index_head - lines) % len(self.index_offsets)
+        segment = self.index_segments[slot]
+        if segment < self.get_first_segment():
+            return self.get_first_segment(), 0
+        return segment, self.index_offsets[slot]
+
+    # Add a line to the tail index ring
+    def _index(self, segment, offset):
+        self.index_segments[self.index_head] = segment
+        self.index_offsets[self.index_head] = offset
+        self.index_head = (self.index_head + 1) % len(self.index_offsets)
+        if self.index_count < len(self.index_offsets):
+            self.index_count += 1
+
+    # Add every line of a segment to the tail index, returns the size of the segment
+    def _index_segment(self, segment):
+        offset = 0
+        try:
+            with open(self.get_segment_file(segment), 'rb') as log:
+                for line in log:
+                    self._index(segment, offset)
+                    offset += len(line)
+        except OSError:
+            pass
+        return offset
+
+    # Close the full segment, start the next one and remove the one that falls off the end
+    def _rotate(self):
+        self._close()
+        self.current += 1
+        self.size = 0
+        expired = self.current - self.segments
+        if expired >= 0:
+            self._remove(expired)
+
+    def _remove(self, segment):
+        try:
+            os.remove(self.get_segment_file(segment))
+        except OSError:
+            pass
+
+    def _close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def _split_base(self):
+        split = self.base.rfind("/")
+        if split < 0:
+            return ".", self.base
+        return self.base[:split] or "/", self.base[split + 1:]
+
+
+# adafruit_logging handler that writes to the segmented syslog, see attach()
+class SegmentedLogHandler(Handler):
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+
+    def emit(self, record):
+        self.log.write(self.format(record))
@@ -0,0 +1,25 @@
+# SPDX-License-Identifier: MIT
+
+# Host simulation backend
+# Stand-ins for the CircuitPython modules (board, digitalio, keypad, wifi, neopixel, rtc, microcontroller, watchdog,
+# alarm),
+# the PCF8523 RTC, the local logging/MQTT/time helpers and an in-process MQTT broker
+# With the sim directory first on sys.path the whole stack imports and runs under CPython
+
+# The pure Python Adafruit libraries (adafruit_ticks, adafruit_minimqtt) are not simulated,
+# install them with pip: adafruit-circuitpython-ticks adafruit-circuitpython-minimqtt adafruit-circuitpython-logging
+
+import os
+import sys
+
+sim_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(sim_dir)
+
+
+# Put the simulation modules ahead of everything else on the import path
+# The repository itself comes next so the real system modules are used
+def install():
+    for path in (repo_dir, sim_dir):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated adafruit_connection_manager, the socket pool and SSL context are never used for real traffic
+
+
+class _SSLContext:
+    def __init__(self):
+        self.cadata = None
+
+    def load_verify_locations(self, cafile=None, capath=None, cadata=None):
+        self.cadata = cadata
+
+
+class _SocketPool:
+    pass
+
+
+_pool = _SocketPool()
+_ssl_context = _SSLContext()
+
+
+def get_radio_socketpool(radio):
+    return _pool
+
+
+def get_radio_ssl_context(radio):
+    return _ssl_context
+
+
+def connection_manager_close_all(socket_pool=None, release_references=False):
+    pass
+
+
+# Imported by adafruit_minimqtt, the simulated client never asks it for a socket
+class _ConnectionManager:
+    def get_socket(self, *args, **kwargs):
+        raise OSError("The simulation has no real sockets")
+
+    def close_socket(self, socket):
+        pass
+
+    def free_socket(self, socket):
+        pass
+
+
+def get_connection_manager(socket_pool):
+    return _ConnectionManager()
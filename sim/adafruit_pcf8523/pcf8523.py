@@ -0,0 +1,21 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated PCF8523 real time clock, starts at the host time and can be set like the real one
+
+import time
+
+
+class PCF8523:
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.offset = 0
+        self.lost_power = False
+        self.battery_low = False
+
+    @property
+    def datetime(self):
+        return time.localtime(time.time() + self.offset)
+
+    @datetime.setter
+    def datetime(self, value):
+        self.offset = time.mktime(value) - time.time()
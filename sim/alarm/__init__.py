@@ -0,0 +1,40 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated alarm, light sleep only
+# light_sleep_until_alarms() blocks like the real one, nothing else runs until a time alarm is due or a pin alarm's
+# pin reaches its level
+
+import time as host_time
+import digitalio
+from . import time
+from . import pin
+
+wake_alarm = None
+sleeps = 0
+
+
+def light_sleep_until_alarms(*alarms):
+    global wake_alarm, sleeps
+
+    sleeps += 1
+    if len(alarms) == 0:
+        return None
+    while True:
+        now = host_time.monotonic()
+        for alarm in alarms:
+            if isinstance(alarm, time.TimeAlarm):
+                if now >= alarm.monotonic_time:
+                    wake_alarm = alarm
+                    return alarm
+            elif _level(alarm) == alarm.value:
+                wake_alarm = alarm
+                return alarm
+        host_time.sleep(0.002)
+
+
+# An input that was never driven reads as its pull, the zones are pulled up
+def _level(alarm):
+    level = digitalio.levels.get(alarm.pin)
+    if level is None:
+        return True
+    return level
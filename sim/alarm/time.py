@@ -0,0 +1,9 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated alarm.time
+
+
+class TimeAlarm:
+    def __init__(self, *, monotonic_time=None, epoch_time=None):
+        self.monotonic_time = monotonic_time
+        self.epoch_time = epoch_time
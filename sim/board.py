@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated board pins
+# Pins are microcontroller.Pin objects as on the board, digitalio keeps their levels
+
+from microcontroller import Pin
+
+
+for _name in ("A0", "A1", "A2", "A3", "A4", "A5", "D4", "D5", "D6", "D9", "D10", "D11", "D12", "D13", "D14", "D15",
+              "D26", "D27", "D32", "D33", "D37", "SCK", "MOSI", "MISO", "RX", "TX", "SDA", "SCL", "NEOPIXEL"):
+    globals()[_name] = Pin(_name)
+
+
+# The shared I2C bus, nothing is ever sent on it
+class _Bus:
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+
+_i2c = _Bus()
+
+
+def I2C():
+    return _i2c
@@ -0,0 +1,59 @@
+# SPDX-License-Identifier: MIT
+
+# In-process stand-in for the MQTT broker
+# Records every publish with its time.monotonic_ns() timestamp and delivers injected messages to subscribers
+# Set online to False to simulate a broker or network outage: connects and publishes then fail
+
+import time
+
+online = True
+published = []  # (topic, message, level, time.monotonic_ns())
+clients = []
+listeners = []  # callables (topic, message, timestamp) told about every publish
+publish_delay = 0  # seconds each publish takes, to model a slow link
+
+
+# Forget everything, used between scenarios
+def reset():
+    global online, publish_delay
+
+    online = True
+    publish_delay = 0
+    published.clear()
+    for client in clients:
+        client.inbox.clear()
+        client.subscriptions.clear()
+
+
+def connect(client):
+    if online is False:
+        raise OSError("Broker unreachable")
+    if client not in clients:
+        clients.append(client)
+    client.is_connected = True
+
+
+# Take a publish from a client
+def publish(topic, message, level="info"):
+    if online is False:
+        raise OSError("Broker unreachable")
+    if publish_delay > 0:
+        time.sleep(publish_delay)
+    now = time.monotonic_ns()
+    published.append((topic, message, level, now))
+    for listener in listeners:
+        listener(topic, message, now)
+    deliver(topic, message)
+
+
+# Send a message to every client subscribed to the topic, as if another device had published it
+def deliver(topic, message):
+    for client in clients:
+        if client.is_subscribed(topic):
+            client.inbox.append((topic, message))
+
+
+# Drop every client connection, each client's on_disconnect is called on its next loop
+def drop_connections():
+    for client in clients:
+        client.dropped = True
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: MIT
+
+# Simulation configuration, see example_data.py for what each entry does
+# The SD card is a temporary directory on the host
+
+import tempfile
+
+data = {
+    'timezone': 'Etc/UTC',
+    'tz_offset': 0,
+    'log_level': 20,  # adafruit_logging.INFO
+    'watchdog_timeout': 10,
+    'supervisor_interval': 0.5,
+    'task_timeout': 2,
+    'task_max_restarts': 5,
+    'task_restart_window': 600,
+    'supervisor_report_interval': 300,
+    'siren_timeout': 30,
+    'exit_delay': 0,
+    'entry_delay': 0,
+    'timer_tick': 0.05,
+    'timer_slots': 64,
+    'sd_mount': tempfile.mkdtemp(prefix="sim_sd_"),
+    'sd_logfile': 'syslog.txt',
+    'sd_logfile_feed_name': 'syslog-dump',
+    'sd_logfile_lines_to_output': 12,
+    'sd_logger_name': 'sim',
+    'sd_log_segment_bytes': 4096,
+    'sd_log_segments': 4,
+    'sd_log_index_lines': 64,
+    'sd_log_chunk_bytes': 256,
+    'alarm_management_feed_name': 'alarm-management',
+    'alarm_code': 1234,
+    'alarm_command_queue_size': 4,
+    'alarm_command_interval': 0.5,
+    'alarm_max_attempts': 5,
+    'alarm_lockout_seconds': 60,
+    'alarm_state_file': 'alarm_state.txt',
+    'excluded_zones_file': 'excludes.txt',
+    'state_file': 'system_state',
+    'state_flush_interval': 1,
+    'state_compact_after': 64,
+    'config_cache_file': 'config_cache',
+    'history_file': 'history',
+    'history_feed_name': 'history-query',
+    'history_ram_records': 32,
+    'history_flush_interval': 60,
+    'history_index_every': 32,
+    'history_days': 31,
+    'mqtt_poll_timeout': 0.01,
+    'poll_fast': 0.1,
+    'poll_slow': 1,
+    'activity_hold': 30,
+    'idle_sleep_after': 120,
+    'idle_sleep_max': 2,
+    'network_retry': 0.5,
+    'network_retry_max': 4,
+    'network_check_interval': 0.5,
+    'wifi_connect_timeout': 10,
+    'mqtt_connect_timeout': 5,
+    'relay_pulse': 4,
+    'satellite_heartbeat_interval': 30,
+    'satellite_missed_beats': 3,
+    'satellite_dedup_window': 32,
+    'satellite_heartbeat_feed': 'sensors/heartbeat',
+    'publish_interval': 1,
+    'publish_batch': 4,
+    'publish_queue_size': 32,
+    'spool_file': 'mqtt_spool',
+    'spool_ram_records': 16,
+    'spool_segment_bytes': 8192,
+    'spool_max_bytes': 65536,
+    'spool_replay_batch': 8,
+    'latency_instrumentation': True,
+    'latency_report_interval': 300,
+    'heap_telemetry': True,
+    'heap_report_interval': 300,
+    'heap_snapshot_file': 'heap_snapshot',
+    'wifi_ssid': 'simulated',
+    'wifi_password': 'simulated',
+    'sensor_feeds': ['pir1'],
+    'sensor_routes': {'sensors/pir/+': 'pir', 'sensors/contact/+': 'zone',
+                      'sensors/heartbeat/+': 'heartbeat'}
+}
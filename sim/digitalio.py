@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated digitalio
+# Input levels are set with set_level(), the level of an input that was never set comes from its pull
+# Every output change is recorded with its time.monotonic_ns() timestamp and passed to any watchers
+
+import time
+
+levels = {}  # pin -> level the outside world drives it to
+outputs = {}  # pin -> (level, time.monotonic_ns()) of the last change made by the system
+watchers = []  # callables (pin, level, timestamp) told about every output change
+input_watchers = []  # callables (pin, level, timestamp) told about every input change
+
+
+class Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+
+class Pull:
+    UP = 1
+    DOWN = 2
+
+
+# Drive an input pin, used by scenarios to open and close zones
+def set_level(pin, level):
+    if levels.get(pin) is level:
+        return
+    levels[pin] = level
+    now = time.monotonic_ns()
+    for watcher in input_watchers:
+        watcher(pin, level, now)
+
+
+# Return the last output change for a pin, (level, timestamp) or None
+def get_output(pin):
+    return outputs.get(pin)
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self._value = False
+
+    @property
+    def value(self):
+        if self.direction == Direction.OUTPUT:
+            return self._value
+        level = levels.get(self.pin)
+        if level is None:
+            return self.pull == Pull.UP
+        return level
+
+    @value.setter
+    def value(self, level):
+        self._value = level
+        now = time.monotonic_ns()
+        outputs[self.pin] = (level, now)
+        for watcher in watchers:
+            watcher(self.pin, level, now)
+
+    def deinit(self):
+        pass
@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated keypad.Keys
+# Instead of scanning, Keys watches the simulated input pins and queues an event the moment one changes
+
+import digitalio
+from adafruit_ticks import ticks_ms
+
+
+class Event:
+    def __init__(self, key_number=0, pressed=True, timestamp=0):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.timestamp = timestamp
+
+    @property
+    def released(self):
+        return not self.pressed
+
+
+class EventQueue:
+    def __init__(self, max_events):
+        self.max_events = max_events
+        self.queue = []
+        self.overflowed = False
+
+    def get(self):
+        event = Event()
+        if self.get_into(event) is False:
+            return None
+        return event
+
+    def get_into(self, event):
+        if len(self.queue) == 0:
+            return False
+        event.key_number, event.pressed, event.timestamp = self.queue.pop(0)
+        return True
+
+    def clear(self):
+        self.queue.clear()
+        self.overflowed = False
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _put(self, key_number, pressed):
+        if len(self.queue) >= self.max_events:
+            self.overflowed = True
+            return
+        self.queue.append((key_number, pressed, ticks_ms()))
+
+
+class Keys:
+    def __init__(self, pins, *, value_when_pressed, pull=True, interval=0.02, max_events=64, debounce_threshold=1):
+        self.pins = tuple(pins)
+        self.value_when_pressed = value_when_pressed
+        self.pull = pull
+        self.events = EventQueue(max_events)
+        self.pressed = [False] * len(self.pins)
+        digitalio.input_watchers.append(self._changed)
+
+    @property
+    def key_count(self):
+        return len(self.pins)
+
+    # Assume every key is released, keys that are pressed right now queue a new pressed event
+    def reset(self):
+        for key_number in range(len(self.pins)):
+            self.pressed[key_number] = False
+            if self._level(key_number) == self.value_when_pressed:
+                self.pressed[key_number] = True
+                self.events._put(key_number, True)
+
+    def deinit(self):
+        if self._changed in digitalio.input_watchers:
+            digitalio.input_watchers.remove(self._changed)
+
+    def _level(self, key_number):
+        level = digitalio.levels.get(self.pins[key_number])
+        if level is None:
+            return self.value_when_pressed is False if self.pull else False
+        return level
+
+    def _changed(self, pin, level, timestamp):
+        if pin not in self.pins:
+            return
+        key_number = self.pins.index(pin)
+        pressed = level == self.value_when_pressed
+        if pressed is not self.pressed[key_number]:
+            self.pressed[key_number] = pressed
+            self.events._put(key_number, pressed)
@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated local_logger, logs through the adafruit_logging logger named "sim"
+# The most recent lines are kept in memory, set echo to True to also print them
+
+import time
+import adafruit_logging
+
+echo = False
+max_lines = 1000
+
+my_log = None
+
+
+def getLocalLogger(use_time=False):
+    global my_log
+
+    if my_log is None:
+        my_log = LocalLogger()
+    return my_log
+
+
+class MemoryHandler(adafruit_logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append((time.monotonic_ns(), record.levelname, str(record.msg)))
+        if len(self.lines) > max_lines:
+            self.lines.pop(0)
+        if echo is True:
+            print(record.levelname, record.msg)
+
+
+class LocalLogger:
+    def __init__(self):
+        self.logger = adafruit_logging.getLogger("sim")
+        self.logger.setLevel(adafruit_logging.DEBUG)
+        self.handler = MemoryHandler()
+        self.logger.addHandler(self.handler)
+        self.lines = self.handler.lines
+
+    def log_message(self, message, level="info"):
+        level = str(level).lower()
+        if level == "notset":
+            level = "debug"
+        getattr(self.logger, level, self.logger.info)(str(message))
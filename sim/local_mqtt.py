@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated local_mqtt helper, talks to the in-process broker instead of a server
+
+import time
+import broker
+
+try:
+    from mqtt_data import mqtt_data
+except ImportError:
+    print("MQTT information is stored in mtqq_data.py, please create file", "critical")
+    raise
+
+mqtt = None
+
+
+# Return the full topic for a feed name
+def get_formatted_topic(feed):
+    return mqtt_data["username"] + "/feeds/" + feed
+
+
+def getMqtt(pool=None, ssl_context=None, use_logger=False):
+    global mqtt
+
+    if mqtt is None:
+        mqtt = LocalMqtt(use_logger)
+    return mqtt
+
+
+# MQTT topic filter match, + is one level and # every level after it
+def _matches(pattern, levels):
+    for index in range(len(pattern)):
+        if pattern[index] == "#":
+            return True
+        if index >= len(levels) or (pattern[index] != "+" and pattern[index] != levels[index]):
+            return False
+    return len(pattern) == len(levels)
+
+
+# Mirrors the parts of adafruit_minimqtt.MQTT that the system uses
+class Client:
+    def __init__(self):
+        self.on_message = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.inbox = []
+        self.subscriptions = set()
+        self.is_connected = False
+        self.dropped = False
+        self._socket_timeout = 1
+        self._reconnect_attempts_max = 5
+        self.userdata = None
+
+    def connect(self, *args, **kwargs):
+        broker.connect(self)
+        if self.on_connect is not None:
+            self.on_connect(self, self.userdata, 0, 0)
+
+    def disconnect(self):
+        self.is_connected = False
+
+    def subscribe(self, topic, qos=0):
+        if isinstance(topic, list):
+            for item in topic:
+                self.subscribe(item)
+            return
+        if isinstance(topic, tuple):
+            topic = topic[0]
+        self.subscriptions.add(topic)
+
+    def is_subscribed(self, topic):
+        if topic in self.subscriptions:
+            return True
+        levels = topic.split("/")
+        for subscription in self.subscriptions:
+            if _matches(subscription.split("/"), levels):
+                return True
+        return False
+
+    # Deliver waiting messages, with nothing waiting the call blocks for timeout like a socket read would
+    def loop(self, timeout=1.0):
+        if timeout < self._socket_timeout:
+            raise ValueError("loop timeout must be >= socket timeout")
+        if self.dropped is True:
+            self.dropped = False
+            self.is_connected = False
+            if self.on_disconnect is not None:
+                self.on_disconnect(self, self.userdata, 0)
+            return None
+        if len(self.inbox) == 0:
+            time.sleep(timeout)
+            return None
+        rcs = []
+        while len(self.inbox) > 0:
+            topic, message = self.inbox.pop(0)
+            if self.on_message is not None:
+                self.on_message(self, topic, message)
+            rcs.append(0x30)
+        return rcs
+
+
+class LocalMqtt:
+    def __init__(self, use_logger=False):
+        self.use_logger = use_logger
+        self.gen_topic = get_formatted_topic(mqtt_data["primary_feed"])
+        self.mqtt_client = Client()
+        self.io = None
+
+    def get_io(self):
+        return self.io
+
+    def connect(self):
+        self.mqtt_client.connect()
+        self.io = self.mqtt_client
+
+    # Takes feed names or feed patterns, like the real helper
+    def subscribe(self, topics):
+        for feed in topics:
+            self.mqtt_client.subscribe(get_formatted_topic(feed))
+
+    def publish(self, topic, message, level="info"):
+        if topic is None:
+            topic = self.gen_topic
+        broker.publish(topic, message, level)
@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated microcontroller
+
+
+# A pin, board holds one for each of its pin names
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "board." + self.name
+
+
+class _WatchDog:
+    def __init__(self):
+        self.timeout = None
+        self.mode = None
+        self.feeds = 0
+
+    def feed(self):
+        self.feeds += 1
+
+    def deinit(self):
+        self.mode = None
+
+
+class _Processor:
+    temperature = 25.0
+    frequency = 240000000
+
+
+watchdog = _WatchDog()
+cpu = _Processor()
+nvm = bytearray(8192)
+
+
+def reset():
+    raise SystemExit("microcontroller.reset()")
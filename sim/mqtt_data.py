@@ -0,0 +1,13 @@
+# SPDX-License-Identifier: MIT
+
+# Simulation configuration, see example_mqtt_data.py for what each entry does
+
+mqtt_data = {
+    'username': 'sim',
+    'key': 'sim',
+    'server': 'broker.sim',
+    'port': 8883,
+    'primary_feed': 'syslog',
+    'diagnostics_feed': 'diagnostics',
+    'cert_file': __file__  # any readable file will do, the simulated SSL context does not check it
+}
@@ -0,0 +1,20 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated neopixel, remembers the colors it was given
+
+
+class NeoPixel(list):
+    def __init__(self, pin, n, **kwargs):
+        super().__init__([0] * n)
+        self.pin = pin
+        self.brightness = kwargs.get("brightness", 1.0)
+
+    def fill(self, color):
+        for index in range(len(self)):
+            self[index] = color
+
+    def show(self):
+        pass
+
+    def deinit(self):
+        pass
@@ -0,0 +1,10 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated rtc, the host clock is used whatever time source is set
+
+time_source = None
+
+
+def set_time_source(source):
+    global time_source
+    time_source = source
@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+
+# Run code.py on the host against the simulation backend
+# python3 sim/run.py
+
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim  # noqa: E402
+
+sim.install()
+runpy.run_path(os.path.join(sim.repo_dir, "code.py"), run_name="__main__")
@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: MIT
+
+# Simulation configuration, see example_system_data.py for what each entry does
+
+import board
+
+system_data = {
+    'zones': [['zone_1', board.D4, 'monitoring.zone-1', 'zone_1_task'],
+              ['zone_2', board.D5, 'monitoring.zone-2', 'zone_2_task'],
+              ['zone_3', board.D6, 'monitoring.zone-3', 'zone_3_task'],
+              ['zone_4', board.D9, 'monitoring.zone-4', 'zone_4_task'],
+              ['zone_5', board.D10, 'monitoring.zone-5', 'zone_5_task'],
+              ['zone_6', board.D11, 'monitoring.zone-6', 'zone_6_task'],
+              ['zone_7', board.D12, 'monitoring.zone-7', 'zone_7_task'],
+              ['zone_8', board.D13, 'monitoring.zone-8', 'zone_8_task']
+              ],
+    'partitions': [['perimeter', ['zone_1', 'zone_2', 'zone_3', 'zone_4'], 'yelp'],
+                   ['interior', ['zone_5', 'zone_6', 'zone_7', 'zone_8'], 'steady']
+                   ],
+    'siren_steady': board.D14,
+    'siren_yelp': board.D15,
+    'siren_feed_name': 'alarm-siren',
+    'zone_detection': 'keypad',
+    'zone_scan_interval': 0.02,
+    'zone_scan_quiet_interval': 0.1,
+    'zone_debounce_ms': 50
+}
@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated watchdog
+
+
+class WatchDogMode:
+    RAISE = 1
+    RESET = 2
+
+
+class WatchDogTimeout(Exception):
+    pass
@@ -0,0 +1,34 @@
+# SPDX-License-Identifier: MIT
+
+# Simulated wifi
+# Set radio.available to False to simulate a network outage
+
+
+class _Network:
+    def __init__(self, ssid):
+        self.ssid = ssid
+        self.rssi = -50
+
+
+class _Radio:
+    def __init__(self):
+        self.available = True
+        self.connected = False
+        self.ap_info = None
+        self.ipv4_address = None
+        self.connect_attempts = 0
+
+    def connect(self, ssid, password=None, *, channel=0, bssid=None, timeout=None):
+        self.connect_attempts += 1
+        if self.available is False:
+            raise ConnectionError("No network with that ssid")
+        self.connected = True
+        self.ap_info = _Network(ssid)
+        self.ipv4_address = "192.168.4.2"
+
+    def disconnect(self):
+        self.connected = False
+        self.ap_info = None
+
+
+radio = _Radio()
@@ -5,10 +5,18 @@
 
 import digitalio
 import local_logger as logger
-import local_mqtt
+import publish_queue
+import latency
+import log_levels
+import timer_wheel
+import config_compiler
 
 main_siren = None
-siren_cache = {}
+siren_cache = {}  # siren type -> its DigitalInOut, each output is created the first time it sounds
+
+# Siren messages are built once, triggering or disabling the siren does not build a string
+TRIGGERED_MESSAGES = {"yelp": "Siren yelp triggered", "steady": "Siren steady triggered"}
+DISABLED_MESSAGES = {"yelp": "Siren yelp disabled", "steady": "Siren steady disabled", None: "Siren None disabled"}
 
 
 def _addSiren(mqtt):
@@ -36,6 +44,12 @@ except ImportError:
     print(error_message)
     raise
 
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
 
 class Siren:
 
@@ -47,9 +61,12 @@ class Siren:
         self.feed = system_data["siren_feed_name"]
         self.state = True  # Off
         self.mqtt = mqtt
+        self.timeout = data["siren_timeout"]
+        self.timeout_timer = None  # switches the siren off after siren_timeout seconds
+        self.on_timeout = None  # called after the siren has been switched off by the time out
         self.my_log = logger.getLocalLogger()  # Get the logger singleton here to avoid startup timing conflicts
         if self.mqtt is True:
-            self.my_mqtt = local_mqtt.getMqtt(use_logger=True)
+            self.gen_topic = config_compiler.getConfig()["primary_topic"]
 
     # Return the siren state
     def get_siren_state(self):
@@ -57,48 +74,71 @@ class Siren:
 
     # Trigger the yelp siren
     def yelp(self):
-        self.name = "yelp"
-        log_message = "Siren " + str(self.name) + " triggered"
-        self.print(message=log_message, level="warning")
-        if self.name not in siren_cache:
-            Alarm.__create_alarm(self, system_data["siren_yelp"])
-        Alarm.__enable(self)
+        self.print(message=TRIGGERED_MESSAGES["yelp"], level="warning")
+        Alarm._select(self, "yelp", config_compiler.getConfig()["siren_yelp"])
+        Alarm._enable(self)
 
     # Trigger the steady siren
     def steady(self):
-        self.name = "steady"
-        log_message = "Siren " + str(self.name) + " triggered"
-        self.print(message=log_message, level="warning")
-        if self.name not in siren_cache:
-            Alarm.__create_alarm(self, system_data["siren_steady"])
-        Alarm.__enable(self)
-
-    # Disable active siren
+        self.print(message=TRIGGERED_MESSAGES["steady"], level="warning")
+        Alarm._select(self, "steady", config_compiler.getConfig()["siren_steady"])
+        Alarm._enable(self)
+
+    # Disable active siren, only the output that is sounding is switched off
     def disable(self):
-        log_message = "Siren " + str(self.name) + " disabled"
-        self.print(message=log_message, level="info")
+        self.print(message=DISABLED_MESSAGES[self.name], level="info")
+        timer_wheel.cancel(self.timeout_timer)
+        self.timeout_timer = None
         if self.state is False:
             self.state = True
             self.pin.value = True
 
+    # Siren messages go out ahead of everything else in the publish queue and are never dropped
+    # Messages below the reported log level are skipped
     def print(self, message, level, mqtt=False, topic=None):
+        if log_levels.enabled(level) is False:
+            return
         if mqtt is True:
             if topic is None:
-                topic = self.my_mqtt.gen_topic
-            self.my_mqtt.publish(topic, message, level)
+                topic = self.gen_topic
+            publish_queue.enqueue(topic, message, level, publish_queue.PRIORITY_HIGH)
         else:
             self.my_log.log_message(str(message), str(level))
 
+    # Called by the timer wheel once the siren has sounded for siren_timeout seconds without being disabled
+    def _timed_out(self, argument):
+        self.timeout_timer = None
+        self.print(message="Siren timed out after " + str(self.timeout) + " seconds", level="warning")
+        self.disable()
+        if self.on_timeout is not None:
+            self.on_timeout()
+
 
 # Creating and activating an alarm is private
 # It can only be accessed via yelp() or steady()
 class Alarm(Siren):
-    def __create_alarm(self, pin):
-        self.pin = digitalio.DigitalInOut(pin)
-        self.pin.direction = digitalio.Direction.OUTPUT
-        siren_cache[self.name] = self.name
+    def _create_alarm(self, pin):
+        output = digitalio.DigitalInOut(pin)
+        output.direction = digitalio.Direction.OUTPUT
+        output.value = True  # off
+        return output
+
+    # Make name the active siren output, pin_name is its board pin
+    # A siren already sounding on the other output is moved over to this one
+    def _select(self, name, pin_name):
+        output = siren_cache.get(name)
+        if output is None:
+            output = Alarm._create_alarm(self, config_compiler.get_pin(pin_name))
+            siren_cache[name] = output
+        if self.pin is not None and self.pin is not output and self.state is False:
+            self.pin.value = True
+            output.value = False
+        self.pin = output
+        self.name = name
 
-    def __enable(self):
+    def _enable(self):
         if self.state is True:
             self.pin.value = False
             self.state = False
+            latency.mark(latency.STAGE_SIREN)
+            self.timeout_timer = timer_wheel.schedule(self.timeout, self._timed_out)
@@ -0,0 +1,204 @@
+# SPDX-License-Identifier: MIT
+
+# Persistent system state on the SD card
+# Holds the armed state of each partition and the excluded zones in one place
+
+# Changes are kept in memory and appended to a journal once per tick (flush), several changes = one write
+# The journal file is kept open between flushes so a flush does not pay for a FAT open/close
+# Once the journal holds data["state_compact_after"] lines the whole state is written to a snapshot and
+# the journal is started over
+
+# File format, snapshot and journal alike: one key=value per line
+# The snapshot ends with an end marker line, a snapshot without it was cut short and is ignored
+# A journal line without its newline was cut short by a power loss and is ignored, nothing is ever appended after
+# one: load() and a failed flush() both write a fresh snapshot and start the journal over before the next change
+
+# Keys used by the system:
+# armed:<partition>  True/False
+# armed              True/False, the whole system's armed state before partitions, only read if no partition is saved
+# excludes           comma separated zone names used for exclusions
+
+import os
+import local_logger as logger
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+END_MARKER = "#end"
+
+state_store = None
+
+
+# Create the state store singleton and load the saved state
+def _addStateStore():
+    global state_store
+
+    if state_store is None:
+        base = data.get("sd_mount", "/sd") + "/" + data.get("state_file", "system_state")
+        state_store = StateStore(base, data.get("state_compact_after", 64))
+        state_store.load()
+
+
+# Get the state store singleton
+def getStateStore():
+    _addStateStore()
+    return state_store
+
+
+class StateStore:
+
+    # Should never be called directly, use getStateStore() instead
+    def __init__(self, base, compact_after):
+        self.snapshot_file = base + ".snp"
+        self.tmp_file = base + ".tmp"
+        self.journal_file = base + ".jnl"
+        self.compact_after = compact_after
+        self.values = {}
+        self.dirty = {}
+        self.journal = None
+        self.journal_lines = 0
+        self.torn = False  # the journal may end part way through a line, compact before appending to it
+        self.writes = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the saved value for a key, or default if there is none
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    # Return True if a key has a saved value
+    def has(self, key):
+        return key in self.values
+
+    # Return the number of writes made to the SD card
+    def get_write_count(self):
+        return self.writes
+
+    # --- Setters --- #
+
+    # Change a value, it is written to the SD card on the next flush()
+    # Setting a value to what it already is does not cause a write
+    def set(self, key, value):
+        value = str(value)
+        if self.values.get(key) == value and key not in self.dirty:
+            return
+        self.values[key] = value
+        self.dirty[key] = value
+
+    # --- Persistence --- #
+
+    # Load the snapshot then replay the journal over it
+    # If the power went out while a snapshot was replacing the old one, the complete copy is used
+    # A journal that ends part way through a line is compacted straight away
+    def load(self):
+        self.values = {}
+        if self._read_snapshot(self.snapshot_file) is False:
+            self._read_snapshot(self.tmp_file)
+
+        self.journal_lines = 0
+        try:
+            with open(self.journal_file, 'r') as journal:
+                for line in journal:
+                    if line.endswith("\n"):
+                        self._apply(line)
+                        self.journal_lines += 1
+                    else:
+                        self.torn = True
+        except OSError:
+            pass
+        if self.torn is True:
+            self.my_log.log_message("System state journal was cut short, compacting it", "warning")
+            self.compact()
+
+    # Append every changed value to the journal in one write
+    # Compacts the journal when it has grown past compact_after lines
+    def flush(self):
+        if len(self.dirty) == 0:
+            return
+        if self.torn is True:
+            # Every value, dirty or not, goes in the snapshot
+            self.compact()
+            if self.torn is False:
+                self.dirty.clear()
+            return
+        lines = ""
+        for key in self.dirty:
+            lines += key + "=" + self.dirty[key] + "\n"
+        try:
+            if self.journal is None:
+                self.journal = open(self.journal_file, 'a')
+            self.journal.write(lines)
+            self.journal.flush()
+        except OSError as e:
+            self.my_log.log_message("Unable to write system state: " + str(e), "error")
+            self._close_journal()
+            self.torn = True  # the write may have stopped part way through a line
+            return
+        self.writes += 1
+        self.journal_lines += len(self.dirty)
+        self.dirty.clear()
+
+        if self.journal_lines >= self.compact_after:
+            self.compact()
+
+    # Write the whole state to a new snapshot and start an empty journal
+    # The snapshot is written to a temporary file first and renamed into place when complete
+    def compact(self):
+        self._close_journal()
+        lines = ""
+        for key in self.values:
+            lines += key + "=" + self.values[key] + "\n"
+        try:
+            with open(self.tmp_file, 'w') as snapshot:
+                snapshot.write(lines + END_MARKER + "\n")
+            self._replace(self.tmp_file, self.snapshot_file)
+            with open(self.journal_file, 'w'):
+                pass
+        except OSError as e:
+            self.my_log.log_message("Unable to compact system state: " + str(e), "error")
+            return
+        self.writes += 1
+        self.journal_lines = 0
+        self.torn = False
+
+    # --- Private Methods --- #
+
+    # Read a snapshot file, returns False if it is missing or was not written completely
+    def _read_snapshot(self, file_name):
+        try:
+            with open(file_name, 'r') as snapshot:
+                lines = snapshot.read()
+        except OSError:
+            return False
+        if not lines.endswith(END_MARKER + "\n"):
+            return False
+        for line in lines.split("\n"):
+            self._apply(line)
+        return True
+
+    # Apply one key=value line to the in memory state
+    def _apply(self, line):
+        split = line.find("=")
+        if split > 0:
+            self.values[line[:split]] = line[split + 1:].rstrip("\n")
+
+    # FAT will not rename over an existing file, the old one is removed first
+    # load() falls back to the temporary file if the power goes out in between
+    def _replace(self, source, target):
+        try:
+            os.rename(source, target)
+        except OSError:
+            os.remove(target)
+            os.rename(source, target)
+
+    def _close_journal(self):
+        if self.journal is not None:
+            try:
+                self.journal.close()
+            except OSError:
+                pass
+            self.journal = None
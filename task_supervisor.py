@@ -0,0 +1,272 @@
+# SPDX-License-Identifier: MIT
+
+# Supervisor for the long running async tasks
+# Every task is added with add() and started by run(), which then checks on them every data["supervisor_interval"]
+# A task that crashes is restarted, so is a task that has not called beat() within its timeout (hung)
+# A task added with forever=False is not restarted when it returns normally (a one off start up job)
+
+# The watchdog is only fed while every critical task is running and has beaten within its timeout
+# A critical task restarted more than data["task_max_restarts"] times stops the feeding, the watchdog then resets
+# the board
+# Only recent restarts count: once a task has run for data["task_restart_window"] seconds since its last restart its
+# count starts again from 0, the odd restart spread over weeks of uptime never stops the feeding
+# A task blocked without awaiting holds up the supervisor as well, the unfed watchdog covers that case
+# The watchdog's WatchDogTimeout is raised in whichever task is running, it is passed on to run() so it
+# reaches the handler around asyncio.run() in code.py
+
+# While the board light sleeps nothing runs, resumed() moves every heartbeat on by the time slept so no task is
+# taken as hung for it and the sleep is not counted as loop lag
+
+# Loop lag (how late the supervisor's own sleep wakes up) and the length of each task pass are kept in
+# power of two millisecond histograms, the pass lengths show which task is holding on to the core
+
+import array
+import asyncio
+import watchdog
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+import local_logger as logger
+import publish_queue
+import config_compiler
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+BUCKETS = 16  # up to ~32 s
+MAX_TASKS = 16
+
+supervisor = None
+
+
+# Create the supervisor singleton
+def _addSupervisor():
+    global supervisor
+
+    if supervisor is None:
+        supervisor = Supervisor(data.get("supervisor_interval", 1), data.get("task_max_restarts", 5),
+                                data.get("task_restart_window", 600))
+
+
+# Get the supervisor singleton
+def getSupervisor():
+    _addSupervisor()
+    return supervisor
+
+
+# Return the histogram bucket for a number of milliseconds
+def _bucket(elapsed):
+    bucket = 0
+    while elapsed > 0 and bucket < BUCKETS - 1:
+        elapsed >>= 1
+        bucket += 1
+    return bucket
+
+
+class Supervisor:
+
+    # Should never be called directly, use getSupervisor() instead
+    def __init__(self, interval, max_restarts, restart_window):
+        self.interval = interval
+        self.max_restarts = max_restarts
+        self.restart_window_ms = int(restart_window * 1000)
+        self.names = []
+        self.factories = []  # called with no arguments, returns a new coroutine for the task
+        self.critical = []
+        self.forever = []
+        self.tasks = []
+        self.running = []  # False once the task has crashed or returned
+        self.crashed = []  # True if the task ended with an exception
+        self.timeouts = array.array("L", [0] * MAX_TASKS)  # milliseconds, 0 = not checked for hanging
+        self.beats = array.array("L", [0] * MAX_TASKS)  # ticks_ms() of the last beat
+        self.restarts = array.array("L", [0] * MAX_TASKS)  # since boot, for the diagnostics feed
+        self.recent_restarts = array.array("L", [0] * MAX_TASKS)  # since the task last ran restart_window_ms
+        self.restarted_at = array.array("L", [0] * MAX_TASKS)  # ticks_ms() of the last restart
+        self.pass_histograms = array.array("L", [0] * (BUCKETS * MAX_TASKS))
+        self.lag_histogram = array.array("L", [0] * BUCKETS)
+        self.started = False
+        self.fault = None  # WatchDogTimeout caught in a task, raised again by run()
+        self.slept_ms = 0  # milliseconds the board light slept since the supervisor last woke
+        self.watchdog = None
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the index of a task by name, tasks use it for beat()
+    def find(self, name):
+        return self.names.index(name)
+
+    # Return how long ago, in milliseconds, a task last beat
+    def get_beat_age(self, task):
+        return ticks_diff(ticks_ms(), self.beats[task])
+
+    # Return True if every critical task is running, beating and has not used up its recent restarts
+    def is_healthy(self):
+        for task in range(len(self.names)):
+            if self.critical[task] is False:
+                continue
+            if self._needs_restart(task) is True or self.recent_restarts[task] > self.max_restarts:
+                return False
+            if self._is_hung(task) is True:
+                return False
+        return True
+
+    # Return the sample count and the upper bound in milliseconds of the p50, p95 and p99 loop lag buckets
+    def get_lag_percentiles(self):
+        return self._percentiles(self.lag_histogram, 0)
+
+    # Return the sample count and the upper bound in milliseconds of the p50, p95 and p99 pass length buckets
+    def get_pass_percentiles(self, task):
+        return self._percentiles(self.pass_histograms, task * BUCKETS)
+
+    # --- Setters --- #
+
+    # The watchdog to feed while the critical tasks are healthy, e.g. microcontroller.watchdog
+    def set_watchdog(self, watchdog):
+        self.watchdog = watchdog
+
+    # --- Tasks --- #
+
+    # Add a task, started straight away if run() has already started the others
+    # timeout is how long, in seconds, the task may go without calling beat(), None if it is not checked
+    def add(self, name, factory, critical=False, timeout=None, forever=True):
+        if len(self.names) >= MAX_TASKS:
+            self.my_log.log_message("Too many supervised tasks, " + str(name) + " not added", "error")
+            return None
+        task = len(self.names)
+        self.names.append(name)
+        self.factories.append(factory)
+        self.critical.append(critical)
+        self.forever.append(forever)
+        self.tasks.append(None)
+        self.running.append(False)
+        self.crashed.append(False)
+        if timeout is not None:
+            self.timeouts[task] = int(timeout * 1000)
+        if self.started is True:
+            self._start(task)
+        return task
+
+    # Called by a task on every pass, started is the ticks_ms() time the pass began
+    def beat(self, task, started=None):
+        now = ticks_ms()
+        self.beats[task] = now
+        if started is not None:
+            self.pass_histograms[task * BUCKETS + _bucket(ticks_diff(now, started))] += 1
+
+    # Called after the board has light slept for slept milliseconds
+    def resumed(self, slept):
+        for task in range(len(self.names)):
+            self.beats[task] = ticks_add(self.beats[task], slept)
+        self.slept_ms += slept
+
+    # Start every task, then check on them for ever
+    async def run(self):
+        self.started = True
+        for task in range(len(self.names)):
+            self._start(task)
+
+        interval_ms = int(self.interval * 1000)
+        while True:
+            slept = ticks_ms()
+            await asyncio.sleep(self.interval)
+            if self.fault is not None:
+                raise self.fault
+            lag = ticks_diff(ticks_ms(), slept) - interval_ms - self.slept_ms
+            self.slept_ms = 0
+            self.lag_histogram[_bucket(max(0, lag))] += 1
+            self.check()
+
+    # Restart crashed and hung tasks and feed the watchdog if the critical tasks are healthy
+    # A task that has run restart_window_ms since its last restart has its recent restarts forgotten
+    def check(self):
+        now = ticks_ms()
+        for task in range(len(self.names)):
+            if self.recent_restarts[task] > 0 and ticks_diff(now, self.restarted_at[task]) > self.restart_window_ms:
+                self.recent_restarts[task] = 0
+            if self._needs_restart(task) is True:
+                if self.crashed[task] is True:
+                    self._restart(task, "crashed")
+                else:
+                    self._restart(task, "ended")
+            elif self.running[task] is True and self._is_hung(task) is True:
+                self.tasks[task].cancel()
+                self._restart(task, "hung")
+
+        self.feed()
+
+    # Feed the watchdog if the critical tasks are healthy
+    def feed(self):
+        if self.watchdog is not None and self.is_healthy() is True:
+            self.watchdog.feed()
+
+    # Publish loop lag and pass length percentiles to the diagnostics feed
+    # e.g. tasks lag n=300 p50<=1ms p95<=2ms p99<=16ms; zone_scan n=15000 p50<=1ms p95<=1ms p99<=2ms restarts=0; ...
+    def publish(self):
+        count, p50, p95, p99 = self.get_lag_percentiles()
+        message = ("tasks lag n=" + str(count) + " p50<=" + str(p50) + "ms p95<=" + str(p95) + "ms p99<=" +
+                   str(p99) + "ms;")
+        for task in range(len(self.names)):
+            count, p50, p95, p99 = self.get_pass_percentiles(task)
+            message += (" " + self.names[task] + " n=" + str(count) + " p50<=" + str(p50) + "ms p95<=" + str(p95) +
+                        "ms p99<=" + str(p99) + "ms restarts=" + str(self.restarts[task]) + ";")
+        topic = config_compiler.getConfig()["diagnostics_topic"]
+        publish_queue.enqueue(topic, message, "info", publish_queue.PRIORITY_LOW)
+
+    # --- Private Methods --- #
+
+    # A task that crashed is always restarted, one that returned only if it should run for ever
+    def _needs_restart(self, task):
+        if self.running[task] is True:
+            return False
+        return self.crashed[task] is True or self.forever[task] is True
+
+    # A task with a timeout that has not beaten within it
+    def _is_hung(self, task):
+        return self.timeouts[task] > 0 and self.get_beat_age(task) > self.timeouts[task]
+
+    def _start(self, task):
+        self.beats[task] = ticks_ms()
+        self.running[task] = True
+        self.crashed[task] = False
+        self.tasks[task] = asyncio.create_task(self._guard(task))
+
+    def _restart(self, task, reason):
+        self.restarts[task] += 1
+        self.recent_restarts[task] += 1
+        self.restarted_at[task] = ticks_ms()
+        self.my_log.log_message("Task " + self.names[task] + " " + reason + ", restarting (" +
+                                str(self.recent_restarts[task]) + " recently, " + str(self.restarts[task]) +
+                                " since boot)", "error")
+        self._start(task)
+
+    # Runs the task's coroutine and notes when it ends, a crash is logged instead of taking down the loop
+    # Cancelling is not caught here, it is how a hung task is stopped
+    async def _guard(self, task):
+        try:
+            await self.factories[task]()
+        except watchdog.WatchDogTimeout as e:
+            self.fault = e
+        except Exception as e:
+            self.my_log.log_message("Task " + self.names[task] + " crashed: " + repr(e), "error")
+            self.crashed[task] = True
+        self.running[task] = False
+
+    def _percentiles(self, histogram, base):
+        count = 0
+        for bucket in range(BUCKETS):
+            count += histogram[base + bucket]
+        if count == 0:
+            return 0, 0, 0, 0
+
+        result = [count]
+        for percent in (50, 95, 99):
+            target = (count * percent + 99) // 100
+            seen = 0
+            for bucket in range(BUCKETS):
+                seen += histogram[base + bucket]
+                if seen >= target:
+                    result.append(1 << bucket)
+                    break
+        return result[0], result[1], result[2], result[3]
@@ -0,0 +1,13 @@
+# SPDX-License-Identifier: MIT
+
+# Host tests, run against the simulation backend (sim/)
+# python3 -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim  # noqa: E402
+
+sim.install()
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+import alarm_commands
+import alarm_handler
+
+CODE = alarm_handler.data["alarm_code"]
+
+
+# Only the code matters to the pipeline, the alarm itself is not touched
+class FakeAlarm:
+    def __init__(self):
+        self.handled = []
+
+    def handle_command(self, action, code, zones, partitions=None):
+        if code != CODE:
+            return "Incorrect code, system state unchanged", "warning", False
+        self.handled.append(code)
+        return "System armed", "info", True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(alarm_commands, "ticks_ms", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def pipeline(clock, monkeypatch):
+    alarm = FakeAlarm()
+    monkeypatch.setattr(alarm_handler, "get_alarm_prime", lambda: alarm)
+    commands = alarm_commands.CommandPipeline(4, 0.5, 3, 60)
+    commands.reports = []
+    monkeypatch.setattr(commands, "report", lambda message, level: commands.reports.append((message, level)))
+    commands.alarm = alarm
+    return commands
+
+
+def test_wrong_codes_lock_out_commands_until_the_lockout_ends(pipeline, clock):
+    for _ in range(3):
+        pipeline.process("9999")
+    assert pipeline.reports[-1] == ("Incorrect code, system state unchanged; locked out for 60 seconds", "critical")
+    assert pipeline.is_locked() is True
+
+    clock[0] += 59999
+    pipeline.process(str(CODE))
+    assert pipeline.reports[-1][0] == "Too many incorrect codes, commands are locked out"
+    assert pipeline.alarm.handled == []
+
+    clock[0] += 1
+    assert pipeline.is_locked() is False
+    pipeline.process(str(CODE))
+    assert pipeline.reports[-1] == ("System armed", "info")
+    assert pipeline.alarm.handled == [CODE]
+
+
+def test_a_correct_code_clears_the_wrong_code_count(pipeline):
+    pipeline.process("9999")
+    pipeline.process("9999")
+    pipeline.process(str(CODE))
+    pipeline.process("9999")
+    pipeline.process("9999")
+    assert pipeline.is_locked() is False
+    assert pipeline.failures == 2
+
+
+def test_unreadable_commands_do_not_count_as_wrong_codes(pipeline):
+    for _ in range(5):
+        pipeline.process("open sesame")
+    assert pipeline.is_locked() is False
+    assert pipeline.reports[-1] == ("Unreadable command, system state unchanged", "warning")
+
+
+def test_full_queue_drops_commands(pipeline):
+    for _ in range(4):
+        assert pipeline.submit(str(CODE)) is True
+    assert pipeline.submit(str(CODE)) is False
+    assert pipeline.get_dropped() == 1
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+import alarm_handler
+import siren
+import state_store
+import timer_wheel
+import zone
+
+CODE = alarm_handler.data["alarm_code"]
+
+
+# Forget the armed partitions and exclusions, as a reboot does
+def reset_handler(monkeypatch):
+    monkeypatch.setattr(alarm_handler, "alarm_set", None)
+    monkeypatch.setattr(alarm_handler, "armed_partitions", 0)
+    monkeypatch.setattr(alarm_handler, "armed_mask", 0)
+    monkeypatch.setattr(alarm_handler, "yelp_mask", 0)
+    monkeypatch.setattr(alarm_handler, "excludes", set())
+    monkeypatch.setattr(alarm_handler, "excluded_mask", None)
+    monkeypatch.setattr(alarm_handler, "alarm_prime", None)
+
+
+# A state store on its own SD directory, read from the card as at boot
+def load_store(monkeypatch, base):
+    store = state_store.StateStore(str(base), 64)
+    store.load()
+    monkeypatch.setattr(state_store, "state_store", store)
+    return store
+
+
+# Turn the wheel on by seconds, its timers fire as they would on the board
+def run_timers(seconds):
+    wheel = timer_wheel.getWheel()
+    for _ in range(int(seconds * 1000) // wheel.tick_ms):
+        wheel._turn()
+
+
+# Every zone closed, a fresh state store and timer wheel and nothing armed
+@pytest.fixture
+def panel(tmp_path, monkeypatch):
+    load_store(monkeypatch, tmp_path / "state")
+    monkeypatch.setattr(timer_wheel, "ticks_ms", lambda: 1000)
+    monkeypatch.setattr(timer_wheel, "wheel", timer_wheel.TimerWheel(8, 0.05))
+    if len(zone.getZones()) == 0:
+        zone.buildZones()
+    monkeypatch.setattr(zone, "open_mask", 0)
+    reset_handler(monkeypatch)
+    yield alarm_handler.get_alarm_prime()
+    my_siren = siren.getSiren()
+    if my_siren.get_siren_state() is False:
+        my_siren.disable()
+
+
+def test_code_then_zone_digits():
+    assert alarm_handler.parse_command(str(CODE)) == (alarm_handler.ACTION_TOGGLE, CODE, [], None)
+    assert alarm_handler.parse_command(str(CODE) + "35") == (alarm_handler.ACTION_TOGGLE, CODE, ["3", "5"], None)
+
+
+def test_code_must_be_digits():
+    assert alarm_handler.parse_command("12a4") is None
+    assert alarm_handler.parse_command(str(CODE) + "3x") is None
+    assert alarm_handler.parse_command("open 1234") is None
+
+
+def test_separated_zones_can_have_more_than_one_digit():
+    expected = (alarm_handler.ACTION_TOGGLE, CODE, ["12", "3"], None)
+    assert alarm_handler.parse_command(str(CODE) + "*12*3") == expected
+    assert alarm_handler.parse_command(str(CODE) + ",12,3") == expected
+    assert alarm_handler.parse_command(str(CODE) + " 12 3") == expected
+    # Separated, the code is not cut at the configured length
+    assert alarm_handler.parse_command("123456*7") == (alarm_handler.ACTION_TOGGLE, 123456, ["7"], None)
+
+
+def test_action_words_and_partition_names():
+    assert alarm_handler.parse_command("arm " + str(CODE) + " 3 12") == (alarm_handler.ACTION_ARM, CODE, ["3", "12"],
+                                                                         None)
+    assert alarm_handler.parse_command("Disarm " + str(CODE)) == (alarm_handler.ACTION_DISARM, CODE, [], None)
+    assert alarm_handler.parse_command("exclude " + str(CODE) + " 4") == (alarm_handler.ACTION_EXCLUDE, CODE, ["4"],
+                                                                          None)
+    assert alarm_handler.parse_command("arm Perimeter,interior " + str(CODE)) == (
+        alarm_handler.ACTION_ARM, CODE, [], ["perimeter", "interior"])
+
+
+def test_arming_is_refused_with_an_open_zone(panel, monkeypatch):
+    monkeypatch.setattr(zone, "open_mask", 1 << 1)
+    message, level, accepted = panel.handle_command(alarm_handler.ACTION_ARM, CODE, [])
+    assert accepted is True
+    assert message.startswith("Cannot arm")
+    assert alarm_handler.get_armed_partitions() == []
+
+    # The interior partition has no open zone and can still be armed on its own
+    message, level, accepted = panel.handle_command(alarm_handler.ACTION_ARM, CODE, [], ["interior"])
+    assert alarm_handler.get_armed_partitions() == ["interior"]
+
+
+def test_disarm_cancels_the_entry_delay(panel, monkeypatch):
+    panel.entry_delay = 0.5
+    panel.handle_command(alarm_handler.ACTION_ARM, CODE, [])
+    monkeypatch.setattr(zone, "open_mask", 1 << 0)
+    assert panel.check_zones() is True
+    assert panel.entry_timer is not None
+
+    panel.handle_command(alarm_handler.ACTION_DISARM, CODE, [])
+    assert panel.entry_timer is None
+    run_timers(1)
+    assert siren.getSiren().get_siren_state() is True
+
+
+def test_entry_delay_running_out_trips_the_siren(panel, monkeypatch):
+    panel.entry_delay = 0.5
+    panel.handle_command(alarm_handler.ACTION_ARM, CODE, [])
+    monkeypatch.setattr(zone, "open_mask", 1 << 0)
+    assert panel.check_zones() is True
+    run_timers(0.4)
+    assert siren.getSiren().get_siren_state() is True
+    run_timers(0.2)
+    assert panel.entry_timer is None
+    assert siren.getSiren().get_siren_state() is False
+
+
+def test_exclusions_come_back_after_a_restart(panel, tmp_path, monkeypatch):
+    message, level = panel.manage_alarm(str(CODE) + "3")
+    assert message == "System armed"
+    assert alarm_handler.get_exclusions() == {"zone-3"}
+
+    load_store(monkeypatch, tmp_path / "state")
+    reset_handler(monkeypatch)
+    alarm_handler.set_zone_exclusions()
+    alarm_handler.set_alarm_state()
+    assert alarm_handler.get_armed_partitions() == ["perimeter", "interior"]
+    assert alarm_handler.get_exclusions() == {"zone-3"}
+
+    monkeypatch.setattr(zone, "open_mask", 1 << 2)
+    assert alarm_handler.get_alarm_prime().check_zones() is False
+    assert siren.getSiren().get_siren_state() is True
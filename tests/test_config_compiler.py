@@ -0,0 +1,18 @@
+# SPDX-License-Identifier: MIT
+
+import board
+import config_compiler
+
+
+def test_pin_may_be_given_as_the_pin_or_its_name():
+    pin_names = config_compiler._get_pin_names()
+    assert config_compiler._pin_name("D9", pin_names) == "D9"
+    assert config_compiler._pin_name(board.D9, pin_names) == "D9"
+
+
+def test_board_names_that_are_not_pins_are_refused():
+    pin_names = config_compiler._get_pin_names()
+    for name in ("I2C", "_i2c", "D99"):
+        assert config_compiler._pin_name(name, pin_names) is None
+    assert config_compiler._pin_name(board.I2C, pin_names) is None
+    assert config_compiler._pin_name(None, pin_names) is None
@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: MIT
+
+from debounce import Debouncer
+
+
+def test_change_settles_once_window_has_passed():
+    debouncer = Debouncer([50, 50])
+    debouncer.reset(0b00, 1000)
+    debouncer.sample(0b01, 1000)
+    assert debouncer.settle(1049) == 0
+    assert debouncer.settle(1050) == 0b01
+    assert debouncer.stable == 0b01
+    assert debouncer.get_since(0) == 1000
+
+
+def test_bounce_is_counted_and_never_reported():
+    debouncer = Debouncer([50])
+    debouncer.reset(0, 1000)
+    debouncer.sample(1, 1000)
+    debouncer.sample(0, 1020)
+    assert debouncer.settle(1100) == 0
+    assert debouncer.stable == 0
+    assert debouncer.get_bounces(0) == 1
+    assert debouncer.get_total_bounces() == 1
+
+
+def test_each_zone_has_its_own_window():
+    debouncer = Debouncer([0, 200])
+    debouncer.reset(0, 1000)
+    debouncer.sample(0b11, 1000)
+    assert debouncer.settle(1000) == 0b01
+    assert debouncer.settle(1199) == 0
+    assert debouncer.settle(1200) == 0b10
+
+
+def test_window_works_across_ticks_wrap():
+    debouncer = Debouncer([50])
+    debouncer.reset(0, 0x3FFFFFF0)
+    debouncer.sample(1, 0x3FFFFFF0)
+    assert debouncer.settle(0x20) == 0
+    assert debouncer.settle(0x22) == 1
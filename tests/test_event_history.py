@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import time
+import pytest
+import event_history
+from event_history import EventHistory, ZONE_SIREN, ZONE_SYSTEM
+
+ZONE = 200  # not a built zone, its records read as "zone 200"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [int(time.mktime((2026, 10, 13, 22, 0, 0, 0, -1, -1)))]
+    monkeypatch.setattr(event_history.time, "time", lambda: now[0])
+    monkeypatch.setattr(event_history, "armed", False)
+    return now
+
+
+# Run a query and return its lines, the count line last
+def query(history, start, end, name=None, chunk_bytes=96):
+    chunks = []
+
+    async def send(chunk):
+        chunks.append(chunk)
+
+    asyncio.run(history.query(start, end, name, chunk_bytes, send))
+    assert all(len(chunk) <= chunk_bytes for chunk in chunks[:-1])
+    return "".join(chunks).split("\n")
+
+
+# A record every 30 minutes from 22:00 on 2026-10-13 to 04:00 on 2026-10-14, returns their (time, line)
+def record_two_days(history, clock):
+    recorded = []
+    for number in range(13):
+        if number % 4 == 0:
+            zone, subject, states = ZONE_SIREN, "siren", ("off", "on")
+        elif number % 4 == 2:
+            zone, subject, states = ZONE_SYSTEM, "system", ("disarmed", "armed")
+        else:
+            zone, subject, states = ZONE, "zone 200", ("Closed", "Open")
+        old = number % 2
+        history.record(zone, old, 1 - old)
+        line = event_history.format_time(clock[0]) + " " + subject + " " + states[old] + ">" + states[1 - old]
+        recorded.append((clock[0], line))
+        history.service()
+        clock[0] += 1800
+    return recorded
+
+
+def test_query_returns_the_records_in_range_across_two_days(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(event_history, "READ_RECORDS", 2)
+    history = EventHistory(str(tmp_path / "history"), 4, 60, 3, 31)
+    recorded = record_two_days(history, clock)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["history.20261013", "history.20261013.idx",
+                                                          "history.20261014", "history.20261014.idx"]
+
+    start = recorded[3][0] - 600  # 23:20 on the first day
+    end = recorded[9][0]  # 02:30 on the second day, the end is included
+    lines = query(history, start, end)
+    assert lines[:-1] == [line for timestamp, line in recorded[3:10]]
+    assert lines[-1].endswith(": 7 events")
+
+
+def test_query_of_one_record_and_of_one_zone(tmp_path, clock):
+    history = EventHistory(str(tmp_path / "history"), 4, 60, 3, 31)
+    recorded = record_two_days(history, clock)
+
+    lines = query(history, recorded[4][0], recorded[4][0])
+    assert lines[:-1] == [recorded[4][1]]
+
+    lines = query(history, recorded[0][0], recorded[-1][0], "siren")
+    assert lines[:-1] == [line for timestamp, line in recorded if " siren " in line]
+    assert lines[-1].endswith(": 4 events")
+
+
+def test_query_with_nothing_in_range(tmp_path, clock):
+    history = EventHistory(str(tmp_path / "history"), 4, 60, 3, 31)
+    recorded = record_two_days(history, clock)
+    lines = query(history, recorded[2][0] + 1, recorded[3][0] - 1)
+    assert len(lines) == 1
+    assert lines[0].endswith(": 0 events")
@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import event_spool
+
+
+def make_spool(base):
+    spool = event_spool.EventSpool(str(base), 2, 4096, 65536)
+    spool.open()
+    return spool
+
+
+def replay_all(spool):
+    values = []
+    spool.replay(lambda topic, payload, level: values.append(payload["value"]), 100)
+    return values
+
+
+def test_records_are_replayed_in_order_after_a_restart(tmp_path):
+    base = tmp_path / "spool"
+    spool = make_spool(base)
+    for value in ("one", "two", "three"):
+        spool.append("t/a", value, "info", 0)
+    spool.write()
+    spool = make_spool(base)
+    assert spool.get_count() == 3
+    assert replay_all(spool) == ["one", "two", "three"]
+    assert spool.get_count() == 0
+
+
+def test_record_cut_short_is_skipped_and_new_records_go_in_a_new_segment(tmp_path):
+    base = tmp_path / "spool"
+    spool = make_spool(base)
+    spool.append("t/a", "one", "info", 0)
+    spool.append("t/a", "two", "info", 0)
+    with open(str(base) + ".0", "a") as records_file:
+        records_file.write('2\t0\tinfo\tt/a\t"thr')
+
+    spool = make_spool(base)
+    assert spool.get_count() == 2
+    assert spool.current == 1
+    spool.append("t/a", "four", "info", 0)
+    spool.append("t/a", "five", "info", 0)
+    assert replay_all(spool) == ["one", "two", "four", "five"]
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_undecodable_record_is_skipped_and_counted(tmp_path):
+    base = tmp_path / "spool"
+    with open(str(base) + ".0", "w") as records_file:
+        records_file.write('0\t0\tinfo\tt/a\t"one"\n')
+        records_file.write('garbage\n')
+        records_file.write('2\t0\tinfo\tt/a\t"three"\n')
+    spool = make_spool(base)
+    assert replay_all(spool) == ["one", "three"]
+    assert spool.get_skipped() == 1
+    assert spool.sequence == 3
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: MIT
+
+import event_spool
+import publish_queue
+import zone
+from publish_queue import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, message, level="info"):
+        self.sent.append((topic, message))
+
+
+def make_queue(tmp_path, capacity=4, batch=10):
+    queue = publish_queue.PublishQueue(capacity, batch)
+    queue.spool = event_spool.EventSpool(str(tmp_path / "spool"), 4, 4096, 65536)
+    queue.my_mqtt = Recorder()
+    return queue
+
+
+def test_state_topic_is_coalesced_to_its_latest_value(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("zone_1", "Open", priority=PRIORITY_LOW, coalesce=True)
+    queue.enqueue("zone_1", "Closed", priority=PRIORITY_LOW, coalesce=True)
+    assert queue.get_size() == 1
+    assert queue.get_counters() == (0, 1)
+    queue.flush()
+    assert queue.my_mqtt.sent == [("zone_1", "Closed")]
+
+
+def test_messages_without_coalesce_are_all_sent(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("log", "one")
+    queue.enqueue("log", "two")
+    queue.flush()
+    assert queue.my_mqtt.sent == [("log", "one"), ("log", "two")]
+
+
+def test_higher_priority_is_sent_first(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("low", "1", priority=PRIORITY_LOW)
+    queue.enqueue("normal", "2", priority=PRIORITY_NORMAL)
+    queue.enqueue("high", "3", priority=PRIORITY_HIGH)
+    queue.flush(2)
+    assert queue.my_mqtt.sent == [("high", "3"), ("normal", "2")]
+    queue.flush()
+    assert queue.my_mqtt.sent[-1] == ("low", "1")
+
+
+def test_full_queue_drops_oldest_lowest_priority(tmp_path):
+    queue = make_queue(tmp_path, capacity=2)
+    queue.enqueue("low", "old", priority=PRIORITY_LOW)
+    queue.enqueue("normal", "kept", priority=PRIORITY_NORMAL)
+    assert queue.enqueue("normal", "new", priority=PRIORITY_NORMAL) is True
+    assert queue.get_counters()[0] == 1
+    assert queue.enqueue("low", "refused", priority=PRIORITY_LOW) is False
+    queue.flush()
+    assert queue.my_mqtt.sent == [("normal", "kept"), ("normal", "new")]
+
+
+def test_high_priority_is_never_dropped(tmp_path):
+    queue = make_queue(tmp_path, capacity=1)
+    for number in range(3):
+        assert queue.enqueue("siren", str(number), priority=PRIORITY_HIGH) is True
+    assert queue.get_size() == 3
+    queue.flush()
+    assert [message for _, message in queue.my_mqtt.sent] == ["0", "1", "2"]
+
+
+def test_quick_zone_toggles_leave_one_state_waiting(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    monkeypatch.setattr(publish_queue, "publish_queue", queue)
+    contact = zone.Zone(None, "monitoring.zone-test", "Zone test", None, True, 0, False, 0, "zone_test")
+    contact.apply_event(0, 0)
+    queue.flush()
+    queue.my_mqtt.sent.clear()
+
+    contact.apply_event(1, 10)
+    contact.apply_event(0, 20)
+    assert list(queue.entries).count("zone_test") == 1
+    queue.flush()
+    assert [message for topic, message in queue.my_mqtt.sent if topic == "zone_test"] == [{"value": 0}]
@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: MIT
+
+import satellite
+
+
+def make_registry(window=8):
+    return satellite.NodeRegistry(30, 3, window)
+
+
+def test_redelivered_message_is_dropped():
+    registry = make_registry()
+    assert registry.accept("hall,1,5,1") == "1"
+    assert registry.accept("hall,1,6,0") == "0"
+    assert registry.accept("hall,1,6,0") is None
+    assert registry.accept("hall,1,5,1") is None
+    assert registry.duplicates == 2
+
+
+def test_late_message_not_seen_before_is_accepted_once():
+    registry = make_registry()
+    registry.accept("hall,1,5,1")
+    registry.accept("hall,1,8,1")
+    assert registry.accept("hall,1,7,0") == "0"
+    assert registry.accept("hall,1,7,0") is None
+
+
+def test_message_older_than_the_window_is_dropped():
+    registry = make_registry(window=8)
+    registry.accept("hall,1,20,1")
+    assert registry.accept("hall,1,12,1") is None
+    assert registry.accept("hall,1,13,1") == "1"
+
+
+def test_restarted_satellite_starts_a_new_sequence():
+    registry = make_registry()
+    registry.accept("hall,1,50,1")
+    assert registry.accept("hall,2,0,1") == "1"
+    assert registry.accept("hall,2,0,1") is None
+
+
+def test_nodes_are_kept_apart():
+    registry = make_registry()
+    assert registry.accept("hall,1,5,1") == "1"
+    assert registry.accept("porch,1,5,1") == "1"
+
+
+def test_message_without_node_fields_passes_through():
+    registry = make_registry()
+    assert registry.accept("1") == "1"
+    assert registry.accept("1") == "1"
+
+
+def test_satellite_numbers_events_and_heartbeats_in_one_sequence(monkeypatch):
+    queued = []
+    monkeypatch.setattr(satellite.publish_queue, "enqueue",
+                        lambda topic, message, level, priority, coalesce=False: queued.append(message))
+    monkeypatch.setattr(satellite.time, "monotonic", lambda: 1000.0)
+    node = satellite.Satellite("hall", "sensors/heartbeat", 30)
+    monkeypatch.setattr(satellite.time, "monotonic", lambda: 1042.5)
+    node.send("sensors/contact/hall-zone-1", 1)
+    node.heartbeat()
+    prefix = "hall," + str(node.boot) + ","
+    assert queued == [prefix + "0,1", prefix + "1,42"]
+    registry = make_registry()
+    assert [registry.accept(message) for message in queued] == ["1", "42"]
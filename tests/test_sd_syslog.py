@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import os
+import sd_syslog
+
+
+def make_log(tmp_path, segment_bytes=64, segments=3, index_lines=16):
+    log = sd_syslog.SegmentedLog(str(tmp_path / "syslog"), segment_bytes, segments, index_lines)
+    log.open()
+    return log
+
+
+# Run tail() and return the chunks it sent
+def tail(log, lines, chunk_bytes):
+    chunks = []
+
+    async def send(chunk):
+        chunks.append(chunk)
+
+    asyncio.run(log.tail(lines, chunk_bytes, send))
+    return chunks
+
+
+def test_tail_reads_across_segment_rollover(tmp_path):
+    log = make_log(tmp_path)
+    written = ["line " + str(number) for number in range(40)]
+    for line in written:
+        log.write(line)
+    log._close()
+    assert log.current > 2
+    assert sorted(os.listdir(tmp_path)) == ["syslog." + str(segment) for segment in range(log.current - 2,
+                                                                                         log.current + 1)]
+
+    chunks = tail(log, 10, 32)
+    assert "".join(chunks) == "".join(line + "\n" for line in written[-10:])
+    assert all(len(chunk.encode()) <= 32 for chunk in chunks)
+
+    # The index is rebuilt from the newest two segments on start up
+    reopened = make_log(tmp_path)
+    assert "".join(tail(reopened, 3, 32)) == "".join(line + "\n" for line in written[-3:])
+
+
+def test_tail_never_splits_a_character_between_chunks(tmp_path):
+    log = make_log(tmp_path, segment_bytes=4096)
+    written = ["température " + str(number) + " °C" for number in range(8)]
+    for line in written:
+        log.write(line)
+    log._close()
+
+    expected = "".join(line + "\n" for line in written)
+    # Every chunk size puts some multi-byte character across a read boundary
+    for chunk_bytes in range(4, 40):
+        chunks = tail(log, 8, chunk_bytes)
+        assert "".join(chunks) == expected
+        assert all(len(chunk.encode()) <= chunk_bytes for chunk in chunks)
+
+
+def test_line_longer_than_a_chunk_is_cut_between_characters(tmp_path):
+    log = make_log(tmp_path, segment_bytes=4096)
+    log.write("€" * 10)
+    log._close()
+
+    chunks = tail(log, 1, 8)
+    assert chunks[0] == "€€"
+    assert "".join(chunks) == "€" * 10 + "\n"
+
+
+def test_torn_last_line_is_sent_without_its_cut_character(tmp_path):
+    log = make_log(tmp_path, segment_bytes=4096)
+    log.write("first")
+    log._close()
+    with open(log.get_segment_file(0), "ab") as file:
+        file.write("ok é".encode()[:-1])
+    log._index(0, 6)
+
+    assert "".join(tail(log, 2, 16)) == "first\nok "
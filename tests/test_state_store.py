@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: MIT
+
+import state_store
+
+
+class BrokenJournal:
+    def write(self, text):
+        raise OSError("card removed")
+
+    def close(self):
+        pass
+
+
+def make_store(base):
+    store = state_store.StateStore(str(base), 64)
+    store.load()
+    return store
+
+
+def test_values_survive_a_restart(tmp_path):
+    base = tmp_path / "state"
+    store = make_store(base)
+    store.set("armed:perimeter", True)
+    store.set("excludes", "zone_1,zone_2")
+    store.flush()
+    store = make_store(base)
+    assert store.get("armed:perimeter") == "True"
+    assert store.get("excludes") == "zone_1,zone_2"
+
+
+def test_line_cut_short_is_ignored_and_journal_compacted(tmp_path):
+    base = tmp_path / "state"
+    store = make_store(base)
+    store.set("armed:perimeter", True)
+    store.flush()
+    with open(str(base) + ".jnl", "a") as journal:
+        journal.write("armed:perimeter=Fal")
+
+    store = make_store(base)
+    assert store.get("armed:perimeter") == "True"
+    with open(str(base) + ".jnl") as journal:
+        assert journal.read() == ""
+
+    store.set("excludes", "zone_1")
+    store.flush()
+    store = make_store(base)
+    assert store.get("armed:perimeter") == "True"
+    assert store.get("excludes") == "zone_1"
+
+
+def test_failed_write_compacts_before_the_next_append(tmp_path):
+    base = tmp_path / "state"
+    store = make_store(base)
+    store.set("armed:perimeter", True)
+    store.journal = BrokenJournal()
+    store.flush()
+    assert store.torn is True
+
+    store.set("excludes", "zone_1")
+    store.flush()
+    assert store.torn is False
+    store = make_store(base)
+    assert store.get("armed:perimeter") == "True"
+    assert store.get("excludes") == "zone_1"
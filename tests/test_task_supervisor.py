@@ -0,0 +1,34 @@
+# SPDX-License-Identifier: MIT
+
+from adafruit_ticks import ticks_ms, ticks_add
+import task_supervisor
+
+
+async def idle():
+    pass
+
+
+def make_supervisor(max_restarts=2, window=600):
+    supervisor = task_supervisor.Supervisor(1, max_restarts, window)
+    task = supervisor.add("scan", idle, critical=True)
+    supervisor.running[task] = True
+    return supervisor, task
+
+
+def test_too_many_recent_restarts_stop_the_feeding():
+    supervisor, task = make_supervisor()
+    supervisor.recent_restarts[task] = 3
+    supervisor.restarted_at[task] = ticks_ms()
+    supervisor.check()
+    assert supervisor.is_healthy() is False
+
+
+def test_restarts_are_forgotten_after_the_window():
+    supervisor, task = make_supervisor()
+    supervisor.restarts[task] = 3
+    supervisor.recent_restarts[task] = 3
+    supervisor.restarted_at[task] = ticks_add(ticks_ms(), -601000)
+    supervisor.check()
+    assert supervisor.recent_restarts[task] == 0
+    assert supervisor.restarts[task] == 3
+    assert supervisor.is_healthy() is True
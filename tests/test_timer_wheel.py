@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+import timer_wheel
+
+
+# The wheel's ticks_ms() only moves when the test moves it
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(timer_wheel, "ticks_ms", lambda: now[0])
+    return now
+
+
+def make_wheel(slots=8, tick=0.05):
+    return timer_wheel.TimerWheel(slots, tick)
+
+
+def test_timer_fires_after_its_delay():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0.1, fired.append, "a")
+    assert wheel.get_pending() == 1
+    wheel._turn()
+    assert fired == []
+    wheel._turn()
+    assert fired == ["a"]
+    assert wheel.get_pending() == 0
+
+
+def test_timer_longer_than_one_turn_counts_down_turns():
+    wheel = make_wheel(slots=4)
+    fired = []
+    wheel.schedule(0.5, fired.append, "long")  # 10 ticks on a 4 slot wheel
+    for _ in range(9):
+        wheel._turn()
+    assert fired == []
+    wheel._turn()
+    assert fired == ["long"]
+
+
+def test_cancelled_timer_never_fires():
+    wheel = make_wheel()
+    fired = []
+    timer = wheel.schedule(0.05, fired.append, "a")
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    wheel.cancel(None)
+    assert wheel.get_pending() == 0
+    for _ in range(16):
+        wheel._turn()
+    assert fired == []
+
+
+def test_callback_may_schedule_another_timer():
+    wheel = make_wheel()
+    fired = []
+
+    def again(name):
+        fired.append(name)
+        if name == "first":
+            wheel.schedule(0.05, again, "second")
+
+    wheel.schedule(0.05, again, "first")
+    wheel._turn()
+    wheel._turn()
+    assert fired == ["first", "second"]
+
+
+def test_service_catches_up_on_missed_ticks(clock):
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0.1, fired.append, "a")
+    clock[0] += 200
+    wheel.service()
+    assert fired == ["a"]
+    assert wheel.position == 4
+
+
+def test_timer_scheduled_part_way_through_a_tick_never_fires_early(clock):
+    wheel = make_wheel()
+    fired = []
+    clock[0] += 40
+    wheel.schedule(0.1, fired.append, "a")
+    clock[0] += 99
+    wheel.service()
+    assert fired == []
+    clock[0] += 1
+    wheel.service()
+    assert fired == []
+    clock[0] += 10
+    wheel.service()
+    assert fired == ["a"]
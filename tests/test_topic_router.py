@@ -0,0 +1,56 @@
+# SPDX-License-Identifier: MIT
+
+import local_mqtt
+import topic_router
+
+
+def topic(feed):
+    return local_mqtt.get_formatted_topic(feed)
+
+
+def make_router():
+    router = topic_router.Router()
+    router.add("pir1", "pir1")
+    router.add("sensors/pir/+", "pir")
+    router.add("sensors/#", "sensors")
+    router.add("sensors/pir/hall", "hall")
+    return router
+
+
+def route(router, feed):
+    found = router.find(topic(feed))
+    if found is None:
+        return None
+    return found[0]
+
+
+def test_exact_feed_is_not_a_prefix_match():
+    router = make_router()
+    assert route(router, "pir1") == "pir1"
+    assert route(router, "pir10") is None
+
+
+def test_exact_route_wins_over_a_pattern():
+    assert route(make_router(), "sensors/pir/hall") == "hall"
+
+
+def test_plus_matches_one_level_and_wins_over_hash():
+    router = make_router()
+    assert route(router, "sensors/pir/porch") == "pir"
+    assert route(router, "sensors/pir/porch/extra") == "sensors"
+    assert route(router, "sensors/contact/door") == "sensors"
+
+
+def test_hash_matches_its_parent_level():
+    assert route(make_router(), "sensors") == "sensors"
+
+
+def test_dispatch_calls_the_handler_and_counts():
+    router = topic_router.Router()
+    calls = []
+    router.add("sensors/+/door", lambda name, message, argument: calls.append((name, message, argument)), 7)
+    assert router.dispatch(topic("sensors/contact/door"), "1") is True
+    assert router.dispatch(topic("other"), "1") is False
+    assert calls == [(topic("sensors/contact/door"), "1", 7)]
+    assert router.get_counts() == (1, 1)
+    assert router.get_subscriptions() == ["sensors/+/door"]
@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: MIT
+
+import zone_events
+from zone_events import EventDetector, FakeEvent, FakeKeys
+
+
+# Stands in for a zone, keeps every reported (value, timestamp)
+class Recorder:
+    def __init__(self, debounce_ms=0):
+        self.debounce_ms = debounce_ms
+        self.events = []
+
+    def apply_event(self, value, timestamp, log_level="notset"):
+        self.events.append((value, timestamp))
+
+
+class Clock:
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# A detector on FakeKeys that has gone through its boot scan, every zone closed
+def make_detector(monkeypatch, count=3, debounce_ms=50, max_events=64):
+    clock = Clock()
+    monkeypatch.setattr(zone_events, "ticks_ms", clock)
+    zones = [Recorder(debounce_ms) for _ in range(count)]
+    keys = FakeKeys(count, max_events)
+    detector = EventDetector(zones, keys, FakeEvent(), 0.02)
+    assert detector.update() == 0  # keypad has not scanned yet
+    clock.now += 40
+    assert detector.update() == 0b111
+    for z in zones:
+        z.events.clear()
+    return detector, keys, zones, clock
+
+
+def test_boot_reports_every_zone_once(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(zone_events, "ticks_ms", clock)
+    zones = [Recorder() for _ in range(3)]
+    keys = FakeKeys(3)
+    keys.closed[1] = False
+    detector = EventDetector(zones, keys, FakeEvent(), 0.02)
+    clock.now += 40
+    assert detector.update() == 0b111
+    assert detector.get_open_mask() == 0b010
+    assert [z.events for z in zones] == [[(0, 1040)], [(1, 1040)], [(0, 1040)]]
+
+
+def test_open_is_reported_once_its_window_has_passed(monkeypatch):
+    detector, keys, zones, clock = make_detector(monkeypatch)
+    keys.open_zone(2, 1100)
+    clock.now = 1149
+    assert detector.update() == 0
+    assert detector.get_open_mask() == 0
+    clock.now = 1150
+    assert detector.update() == 0b100
+    assert detector.get_open_mask() == 0b100
+    assert zones[2].events == [(1, 1100)]
+
+    keys.close_zone(2, 1200)
+    clock.now = 1250
+    assert detector.update() == 0b100
+    assert detector.get_open_mask() == 0
+    assert zones[2].events == [(1, 1100), (0, 1200)]
+
+
+def test_bounce_is_counted_and_not_reported(monkeypatch):
+    detector, keys, zones, clock = make_detector(monkeypatch)
+    keys.open_zone(0, 1100)
+    keys.close_zone(0, 1110)
+    keys.open_zone(0, 1120)
+    keys.close_zone(0, 1130)
+    clock.now = 1300
+    assert detector.update() == 0
+    assert detector.get_open_mask() == 0
+    assert detector.get_bounces(0) == 2
+    assert detector.get_bounces() == 2
+    assert zones[0].events == []
+
+
+def test_open_after_a_bounce_is_reported_from_the_edge_that_held(monkeypatch):
+    detector, keys, zones, clock = make_detector(monkeypatch)
+    keys.open_zone(1, 1100)
+    keys.close_zone(1, 1110)
+    keys.open_zone(1, 1120)
+    clock.now = 1200
+    assert detector.update() == 0b010
+    assert detector.get_open_mask() == 0b010
+    assert detector.get_bounces(1) == 1
+    assert zones[1].events == [(1, 1120)]
+
+
+def test_overflow_resynchronizes_and_reports_only_what_changed(monkeypatch):
+    detector, keys, zones, clock = make_detector(monkeypatch, max_events=4)
+    keys.open_zone(0, 1100)
+    for timestamp in range(1110, 1160, 10):
+        keys.open_zone(1, timestamp)
+        keys.close_zone(1, timestamp + 5)
+    assert keys.events.overflowed is True
+    clock.now = 1200
+    assert detector.update() == 0
+    assert keys.events.overflowed is False
+
+    # Zone 0 is still open after the reset, zones 1 and 2 are closed as they were
+    clock.now = 1239
+    assert detector.update() == 0
+    clock.now = 1240
+    assert detector.update() == 0b001
+    assert detector.get_open_mask() == 0b001
+    assert zones[0].events == [(1, 1240)]
+    assert zones[1].events == []
+    assert zones[2].events == []
@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: MIT
+
+# Timer wheel for the one off timers of the alarm: siren time out, relay pulses, entry and exit delays
+# One task turns the wheel every data["timer_tick"] seconds, there is no coroutine per timer
+# The wheel has data["timer_slots"] slots, a timer goes in the slot its deadline falls in and counts down the
+# number of whole turns left, so schedule() and cancel() take the same time however many timers are waiting
+# cancel() only marks the timer, it is taken out of its slot when the wheel next reaches it
+
+# Timers are only as accurate as the tick, a timer never fires early: its ticks are counted from the last turn of
+# the wheel, the part of a tick already gone by since then is added to its delay, it fires up to one tick late
+# If the task is held up the wheel catches up on the ticks it missed on its next pass
+# Nothing here needs the network, timers keep running through an outage
+
+import asyncio
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+import local_logger as logger
+import task_supervisor
+
+try:
+    from data import data
+except ImportError:
+    print("Configuration data stored in data.py, please create file")
+    raise
+
+# A timer is a list: [turns left, callback, argument, active]
+TIMER_TURNS = 0
+TIMER_CALLBACK = 1
+TIMER_ARGUMENT = 2
+TIMER_ACTIVE = 3
+
+wheel = None
+
+
+# Create the timer wheel singleton
+def _addWheel():
+    global wheel
+
+    if wheel is None:
+        wheel = TimerWheel(data.get("timer_slots", 64), data.get("timer_tick", 0.05))
+
+
+# Get the timer wheel singleton
+def getWheel():
+    _addWheel()
+    return wheel
+
+
+# Call callback(argument) in delay seconds, returns the timer to pass to cancel()
+def schedule(delay, callback, argument=None):
+    return getWheel().schedule(delay, callback, argument)
+
+
+# Stop a timer from firing, a timer of None or one that has already fired is ignored
+def cancel(timer):
+    getWheel().cancel(timer)
+
+
+class TimerWheel:
+
+    # Should never be called directly, use getWheel() instead
+    def __init__(self, slots, tick):
+        self.tick = tick
+        self.tick_ms = int(tick * 1000)
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.turned_at = ticks_ms()  # ticks_ms() of the last tick the wheel turned for
+        self.pending = 0
+        self.fired = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the number of timers waiting, cancelled timers still in their slot are not counted
+    def get_pending(self):
+        return self.pending
+
+    # --- Timers --- #
+
+    # Call callback(argument) in delay seconds, returns the timer
+    def schedule(self, delay, callback, argument=None):
+        elapsed = max(0, ticks_diff(ticks_ms(), self.turned_at))
+        ticks = (int(delay * 1000) + elapsed + self.tick_ms - 1) // self.tick_ms
+        if ticks < 1:
+            ticks = 1
+        size = len(self.slots)
+        timer = [(ticks - 1) // size, callback, argument, True]
+        self.slots[(self.position + ticks) % size].append(timer)
+        self.pending += 1
+        return timer
+
+    # Stop a timer from firing
+    def cancel(self, timer):
+        if timer is None or timer[TIMER_ACTIVE] is False:
+            return
+        timer[TIMER_ACTIVE] = False
+        timer[TIMER_CALLBACK] = None
+        timer[TIMER_ARGUMENT] = None
+        self.pending -= 1
+
+    # Turn the wheel for every tick that has gone by since the last call
+    def service(self):
+        elapsed = ticks_diff(ticks_ms(), self.turned_at)
+        if elapsed < self.tick_ms:
+            return
+        ticks = elapsed // self.tick_ms
+        self.turned_at = ticks_add(self.turned_at, ticks * self.tick_ms)
+        for _ in range(ticks):
+            self._turn()
+
+    # Turn the wheel for ever
+    # Beats as the supervisor's timer_wheel task when it is supervised
+    async def run(self):
+        supervisor = task_supervisor.getSupervisor()
+        heartbeat = None
+        if "timer_wheel" in supervisor.names:
+            heartbeat = supervisor.find("timer_wheel")
+        self.turned_at = ticks_ms()
+        while True:
+            pass_started = ticks_ms()
+            self.service()
+            if heartbeat is not None:
+                supervisor.beat(heartbeat, pass_started)
+            await asyncio.sleep(self.tick)
+
+    # --- Private Methods --- #
+
+    # Move on one slot and fire its timers that are due
+    # Timers are taken out of the slot before any callback runs, a callback may schedule into the same slot
+    def _turn(self):
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        due = None
+        index = 0
+        while index < len(slot):
+            timer = slot[index]
+            if timer[TIMER_ACTIVE] is True and timer[TIMER_TURNS] > 0:
+                timer[TIMER_TURNS] -= 1
+                index += 1
+                continue
+            # Swap the last timer into this place, order within a slot does not matter
+            slot[index] = slot[-1]
+            slot.pop()
+            if timer[TIMER_ACTIVE] is True:
+                if due is None:
+                    due = []
+                due.append(timer)
+        if due is None:
+            return
+
+        for timer in due:
+            callback = timer[TIMER_CALLBACK]
+            argument = timer[TIMER_ARGUMENT]
+            timer[TIMER_ACTIVE] = False
+            timer[TIMER_CALLBACK] = None
+            timer[TIMER_ARGUMENT] = None
+            self.pending -= 1
+            self.fired += 1
+            try:
+                callback(argument)
+            except Exception as e:
+                self.my_log.log_message("Timer callback failed: " + repr(e), "error")
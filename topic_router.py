@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: MIT
+
+# Routing table for incoming MQTT messages
+# Routes are added by feed, or by feed pattern with the MQTT wildcards: + for one level, # for every level after it
+# e.g. "pir1" routes one feed, "sensors/pir/+" routes every PIR satellite, "sensors/#" everything under sensors
+# get_subscriptions() gives the feeds and patterns to subscribe to, one subscription covers all the satellites
+# of a pattern however many there are
+
+# A route is a handler and an argument, handler(topic, message, argument) is called for each message it matches
+# Exact topics are one dict lookup, no substring tests, "pir1" does not match "pir10"
+# Wildcard patterns are kept in a trie with one node per topic level, matching walks the topic level by level
+# An exact route wins over a pattern, a named level over +, and + over #
+
+import local_mqtt
+import local_logger as logger
+import log_levels
+
+# A trie node is a list: [child nodes by level, route or None]
+NODE_CHILDREN = 0
+NODE_ROUTE = 1
+
+router = None
+
+
+# Create the router singleton
+def _addRouter():
+    global router
+
+    if router is None:
+        router = Router()
+
+
+# Get the router singleton
+def getRouter():
+    _addRouter()
+    return router
+
+
+class Router:
+
+    # Should never be called directly, use getRouter() instead
+    def __init__(self):
+        self.exact = {}  # full topic -> (handler, argument)
+        self.trie = [{}, None]
+        self.feeds = []  # feeds and patterns to subscribe to
+        self.routed = 0
+        self.unrouted = 0
+        self.my_log = logger.getLocalLogger()
+
+    # --- Getters --- #
+
+    # Return the feeds and feed patterns to subscribe to
+    def get_subscriptions(self):
+        return self.feeds
+
+    # Return the number of messages routed and the number that matched no route
+    def get_counts(self):
+        return self.routed, self.unrouted
+
+    # --- Routes --- #
+
+    # Route a feed, or a feed pattern with + and # wildcards, to handler(topic, message, argument)
+    # Adding the same feed again replaces its route
+    def add(self, feed, handler, argument=None):
+        topic = local_mqtt.get_formatted_topic(feed)
+        if feed not in self.feeds:
+            self.feeds.append(feed)
+        if "+" not in topic and "#" not in topic:
+            self.exact[topic] = (handler, argument)
+            return
+
+        node = self.trie
+        for level in topic.split("/"):
+            child = node[NODE_CHILDREN].get(level)
+            if child is None:
+                child = [{}, None]
+                node[NODE_CHILDREN][level] = child
+            node = child
+        node[NODE_ROUTE] = (handler, argument)
+
+    # Return the route for a topic, or None
+    def find(self, topic):
+        route = self.exact.get(topic)
+        if route is not None:
+            return route
+        if len(self.trie[NODE_CHILDREN]) == 0:
+            return None
+        return self._match(self.trie, topic.split("/"), 0)
+
+    # Hand a message to the handler of its route, called from the MQTT message callback
+    # Returns False if no route matched
+    def dispatch(self, topic, message):
+        route = self.find(topic)
+        if route is None:
+            self.unrouted += 1
+            if log_levels.enabled("debug") is True:
+                self.my_log.log_message("No route for " + str(topic), "debug")
+            return False
+        self.routed += 1
+        route[0](topic, message, route[1])
+        return True
+
+    # --- Private Methods --- #
+
+    # Walk the trie from node for the topic levels from index on
+    def _match(self, node, levels, index):
+        children = node[NODE_CHILDREN]
+        if index == len(levels):
+            if node[NODE_ROUTE] is not None:
+                return node[NODE_ROUTE]
+            # "a/#" also matches "a" itself
+            child = children.get("#")
+            if child is not None:
+                return child[NODE_ROUTE]
+            return None
+
+        for level in (levels[index], "+"):
+            child = children.get(level)
+            if child is not None:
+                route = self._match(child, levels, index + 1)
+                if route is not None:
+                    return route
+        child = children.get("#")
+        if child is not None:
+            return child[NODE_ROUTE]
+        return None
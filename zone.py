@@ -1,45 +1,66 @@
 # SPDX-License-Identifier: MIT
-import time
 import digitalio
+from adafruit_ticks import ticks_ms
 import local_mqtt
 import local_logger as logger
+import debounce
+import publish_queue
+import latency
+import log_levels
+import event_history
+import config_compiler
+import satellite
 
-zone_cache = {}
-all_zones = []
-
-# import zone information
 try:
-    from system_data import system_data
+    from data import data
 except ImportError:
-    print("Zone information stored in system_data.py, please create file", "critical")
+    print("Configuration data stored in data.py, please create file")
     raise
 
-# import mqtt data for publishing
-try:
-    from mqtt_data import mqtt_data
-except ImportError:
-    print("MQTT information is stored in mtqq_data.py, please create file", "critical")
-    raise
+zone_cache = {}
+all_zones = []
+zone_bank = None
+feed_zone_names = {}  # feed name -> zone name used for exclusions, e.g. monitoring.zone-3 -> zone-3
+exclusion_bits = {}  # zone name used for exclusions -> the zone's bit, e.g. zone-3 -> 1 << index
+open_mask = 0  # bit N is set while all_zones[N] is open, updated by the zones on every state change
 
+# Indexed by zone state (0 = closed, 1 = open) so reporting a state does not build a string
+STATE_NAMES = ("Closed", "Open")
 
 # If a zone object does not already exist in the zone_cache, create it and append it the array of all zones
-def _addZone(name, pin, feed, task, mqtt) -> None:
+# entry is a compiled zone, see config_compiler.py
+def _addZone(entry, mqtt, claim_pin=True) -> None:
+    name = entry[config_compiler.ZONE_NAME]
     if name not in zone_cache:
-        new_zone = Zone(pin, feed, name, task, mqtt)
-        if name in ["zone_3", "zone_4"]:  # remove me before real life!
-            zone_cache[name] = new_zone
-            all_zones.append(zone_cache[name])
+        feed = entry[config_compiler.ZONE_FEED]
+        new_zone = Zone(config_compiler.get_pin(entry[config_compiler.ZONE_PIN]), feed, name,
+                        entry[config_compiler.ZONE_TASK], mqtt, len(all_zones), claim_pin,
+                        entry[config_compiler.ZONE_DEBOUNCE], entry[config_compiler.ZONE_TOPIC])
+        zone_cache[name] = new_zone
+        all_zones.append(new_zone)
+        feed_zone_names[feed] = new_zone.exclusion_name
+        exclusion_bits[new_zone.exclusion_name] = 1 << new_zone.index
+
+
+# Return the zone name used for exclusions from a feed name
+# Feeds are named <group>.<zone>, e.g. monitoring.zone-3 -> zone-3
+def get_feed_zone_name(feed):
+    return feed[feed.find(".") + 1:]
 
 
 # This is the method that's called
-# It will get all the zones to create from "zones" in the system_data.py file
+# It will get all the zones to create from "zones" in the system_data.py file, as checked by the config compiler
 # It will return an array of zone objects
-def buildZones(mqtt: bool = False):
-    zone_list = system_data["zones"]
-    for zone in range(len(zone_list)):
-        tmp_zone = zone_list[zone]
-        if tmp_zone[0] is "zone_4":
-            _addZone(tmp_zone[0], tmp_zone[1], tmp_zone[2], tmp_zone[3], mqtt)
+# Set claim_pins to False when something else owns the zone pins (e.g. keypad in zone_events.py)
+def buildZones(mqtt: bool = False, claim_pins: bool = True):
+    global zone_bank
+
+    for entry in config_compiler.getConfig()["zones"]:
+        _addZone(entry, mqtt, claim_pins)
+
+    # One bank scans every zone pin, the zone objects are only touched when their bit changes
+    if claim_pins is True:
+        zone_bank = ZoneBank(all_zones)
 
     message = "Done building security zones"
     all_zones[0].my_log.log_message(message, "info")
@@ -51,32 +72,159 @@ def getZones():
     return all_zones
 
 
+# Return the zone bank, buildZones() must be called first
+def getBank():
+    return zone_bank
+
+
+# Return the bitmask of open zones
+def get_open_mask():
+    return open_mask
+
+
+# Return the names of the zones in a bitmask
+def get_zone_names(mask):
+    names = []
+    index = 0
+    while mask:
+        if mask & 1:
+            names.append(all_zones[index].name)
+        mask >>= 1
+        index += 1
+    return names
+
+
+# Keep the open zone bitmask in step with a zone's state
+def _set_open(index, value):
+    global open_mask
+
+    if value == 1:
+        open_mask |= 1 << index
+    else:
+        open_mask &= ~(1 << index)
+
+
+# Scans all zones as a single integer snapshot
+# Bit N of the snapshot is the settled state of all_zones[N]: 1 = open, 0 = closed
+# Raw scans go through the debouncer, only settled changes are reported
+# Should never be called directly, it is created by buildZones()
+class ZoneBank:
+    __slots__ = ("zones", "pins", "mask", "snapshot", "primed", "debouncer")
+
+    def __init__(self, zones):
+        self.zones = tuple(zones)
+        self.pins = tuple([z.pin for z in zones])
+        self.mask = (1 << len(self.zones)) - 1
+        self.snapshot = 0
+        self.primed = False
+        self.debouncer = debounce.Debouncer([z.debounce_ms for z in zones])
+
+    # Read every zone pin in one pass and return the snapshot
+    def scan(self):
+        snapshot = 0
+        bit = 1
+        for pin in self.pins:
+            if pin.value:
+                snapshot |= bit
+            bit <<= 1
+        return snapshot
+
+    # Scan the zones and return a bitmask of the zones whose settled state changed since the last scan
+    # The first scan is taken as settled and marks every zone as changed so the initial state gets reported
+    def check_zones(self, now):
+        raw = self.scan()
+        if self.primed is True:
+            self.debouncer.sample(raw, now)
+            changed = self.debouncer.settle(now)
+        else:
+            self.debouncer.reset(raw, now)
+            changed = self.mask
+            self.primed = True
+        self.snapshot = self.debouncer.stable
+        return changed
+
+    # Scan the zones and report only the zones whose bit changed
+    # The reported time is when the raw change started, not when it settled
+    # Returns the bitmask of changed zones
+    def update(self, log_level: str = "notset"):
+        now = ticks_ms()
+        changed = self.check_zones(now)
+        pending = changed
+        index = 0
+        while pending:
+            if pending & 1:
+                latency.start_edge(self.debouncer.get_since(index))
+                latency.mark(latency.STAGE_CHECK)
+                self.zones[index].apply_event((self.snapshot >> index) & 1, self.debouncer.get_since(index), log_level)
+            pending >>= 1
+            index += 1
+        return changed
+
+    # Return the bitmask of open zones from the last scan
+    def get_open_mask(self):
+        return self.snapshot
+
+    # Return the number of suppressed bounces for a zone index, or for all zones
+    def get_bounces(self, index=None):
+        if index is None:
+            return self.debouncer.get_total_bounces()
+        return self.debouncer.get_bounces(index)
+
+
 # Build a security zone object
 class Zone:
+    __slots__ = ("pin", "pinID", "name", "feed_name", "task", "index", "state_value", "previous_zone_state",
+                 "previous_state_value", "state_change", "on_startup", "last_change", "debounce_ms", "exclusion_name", "mqtt",
+                 "my_log", "gen_topic", "topic", "satellite_feed", "payloads", "initial_messages", "change_messages")
 
     # The zone object
     # Assigns the pin and direction for the zone
     # Sets the current state for the pin (True/False)
     # Initial object has a previous state of False
     # Assigns the name that it is passed; useful for logging clarity
+    # Assigns the index of the zone, this is the zone's bit in the ZoneBank snapshot
+    # The pin is left unclaimed when claim_pin is False, the zone then only changes through apply_event()
+    # Assigns how long, in milliseconds, a change must hold before it is reported
+    # Builds the zone's topic, payloads and messages once so report() does not allocate, topic may be given already built
     # Should never be called directly, use buildZones() instead
-    def __init__(self, pin, feed_name, name, task, mqtt):
-        self.pin = digitalio.DigitalInOut(pin)
-        self.pin.direction = digitalio.Direction.INPUT
-        self.pin.pull = digitalio.Pull.UP
+    def __init__(self, pin, feed_name, name, task, mqtt, index=0, claim_pin=True, debounce_ms=0, topic=None):
+        if claim_pin is True:
+            self.pin = digitalio.DigitalInOut(pin)
+            self.pin.direction = digitalio.Direction.INPUT
+            self.pin.pull = digitalio.Pull.UP
+        else:
+            self.pin = None
         self.pinID = pin
         self.name = name
         self.feed_name = feed_name
+        self.exclusion_name = get_feed_zone_name(feed_name)
         self.task = task
+        self.index = index
         self.state_value = 0
         self.previous_zone_state = False
         self.previous_state_value = 0
         self.state_change = False
         self.on_startup = True
+        self.last_change = None
+        self.debounce_ms = debounce_ms
         self.mqtt = mqtt
         self.my_log = logger.getLocalLogger()
-        if mqtt is True:
-            self.my_mqtt = local_mqtt.getMqtt(use_logger=True)
+        # Only the topic is needed here, the MQTT client may not exist yet while the network comes up
+        self.gen_topic = config_compiler.getConfig()["primary_topic"]
+        if topic is None:
+            topic = local_mqtt.get_formatted_topic(feed_name)
+        self.topic = topic
+        # A board that reports to a panel as a satellite sends every change of the zone on to it, see satellite.py
+        self.satellite_feed = None
+        if mqtt is True and "satellite_node" in data:
+            self.satellite_feed = (data.get("satellite_contact_feed", "sensors/contact") + "/" +
+                                   data["satellite_node"] + "-" + self.exclusion_name)
+        # Indexed by the zone state the message reports
+        self.payloads = ({"value": 0}, {"value": 1})
+        self.initial_messages = ("Publishing initial state for: " + str(name) + ": Closed",
+                                 "Publishing initial state for: " + str(name) + ": Open")
+        self.change_messages = (str(name) + " state has changed from: Open to Closed",
+                                str(name) + " state has changed from: Closed to Open")
 
     # --- Getters --- #
 
@@ -88,6 +236,10 @@ class Zone:
     def get_state_change(self):
         return self.state_change
 
+    # Return the ticks_ms() timestamp of the last transition seen for this zone
+    def get_last_change(self):
+        return self.last_change
+
     # --- Setters --- #
 
     # Change the on_startup attribute
@@ -101,6 +253,7 @@ class Zone:
             self.state_value = 1
         else:
             self.state_value = 0
+        _set_open(self.index, self.state_value)
 
     # Get the current state of the zone and update values as needed
     # When check_zone() is called it will set the state_change and alarm_trigger
@@ -113,51 +266,61 @@ class Zone:
         else:
             self.state_change = False
 
-    # Log on initial start up and zone state changes only
-    def report(self, log_level: str = "notset"):
-
-        if self.mqtt is True and self.my_mqtt.get_io() is None:
-            log_message = "MQTT not initialized, will attempt to initialize"
-            self.my_log.log_message(log_message, "warning")
-            self.my_mqtt.connect()
-
-        # Set the zone topic for logging
-        zone_topic = local_mqtt.get_formatted_topic(self.feed_name)
-
-        # Set human readable values for zone states for logging
-        if self.state_value is 1:
-            zone_state = "Open"
+    # Called by the ZoneBank when this zone's bit has changed
+    # Sets the state from the bank snapshot instead of reading the pin again, then reports it
+    def apply_state(self, value, log_level: str = "notset"):
+        self.state_value = value
+        _set_open(self.index, value)
+        if value != self.previous_state_value and self.on_startup is False:
+            self.state_change = True
         else:
-            zone_state = "Closed"
+            self.state_change = False
+        self.report(log_level)
 
-        zone_log_message = {"value": self.state_value}
+    # Called by a detection backend with a transition and the ticks_ms() time it happened
+    def apply_event(self, value, timestamp, log_level: str = "notset"):
+        self.last_change = timestamp
+        self.apply_state(value, log_level)
+
+    # Log on initial start up and zone state changes only
+    # Messages wait in the publish queue until MQTT is connected, reporting never waits for the network
+    # Everything reported comes from what __init__() built, nothing is formatted here
+    def report(self, log_level: str = "notset"):
+        value = self.state_value
 
         # Report on zone and update attributes
         if self.on_startup is True:
-            gen_message = ("Publishing initial state for: " + str(self.name) + ": " + str(zone_state))
-            self.print(zone_log_message, "notset", zone_topic)
-            self.print(message=gen_message, level=log_level)
+            self.print(self.payloads[value], "notset", self.topic)
+            self.print(message=self.initial_messages[value], level=log_level)
             self.set_on_startup(False)
 
         if self.get_state_change() is True:
-            gen_message = (str(self.name) + " state has changed from: " + str(self.previous_zone_state) + " to " +
-                           str(zone_state))
-
-            if self.state_value == 1:
+            if value == 1:
                 log_level = "warning"
             else:
                 log_level = "info"
 
-            self.print(message=gen_message, level=log_level)
+            self.print(self.payloads[value], "notset", self.topic)
+            self.print(message=self.change_messages[value], level=log_level)
+            if self.satellite_feed is not None:
+                satellite.getSatellite().send(self.satellite_feed, value, publish_queue.PRIORITY_HIGH)
+            event_history.record(self.index, self.previous_state_value, value)
+            latency.mark(latency.STAGE_REPORT)
 
         # update zone attributes
-        self.previous_state_value = self.state_value
-        self.previous_zone_state = zone_state
+        self.previous_state_value = value
+        self.previous_zone_state = STATE_NAMES[value]
 
+    # Messages for the zone's own feed are zone states, only the latest one waiting in the queue is sent
+    # Zone states are always sent, other messages only when their level is reported
     def print(self, message, level, topic=None):
+        if topic is None and log_levels.enabled(level) is False:
+            return
         if self.mqtt is True:
             if topic is None:
-                self.my_mqtt.publish(topic, message, level)
+                publish_queue.enqueue(self.gen_topic, message, level, publish_queue.PRIORITY_NORMAL)
+            else:
+                publish_queue.enqueue(topic, message, level, publish_queue.PRIORITY_LOW, coalesce=True)
         else:
             self.my_log.log_message(str(message), str(level))
             # print(message)
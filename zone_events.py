@@ -0,0 +1,273 @@
+# SPDX-License-Identifier: MIT
+
+# Event driven zone detection
+# keypad.Keys scans the zone pins in the background and queues every transition with a timestamp,
+# a short door open pulse between two checks is not lost and nothing has to poll pin.value
+# If keypad is not available, or "zone_detection" is "poll", the ZoneBank polling path is used instead
+
+# keypad reports a key as pressed when the pin reads value_when_pressed
+# Zones use a pull up: closed = pin pulled to ground (pressed), open = pin high (released)
+
+import zone
+import debounce
+import latency
+import local_logger as logger
+from adafruit_ticks import ticks_ms, ticks_diff
+
+try:
+    import keypad
+except ImportError:
+    keypad = None
+
+try:
+    from system_data import system_data
+except ImportError:
+    print("Zone information stored in system_data.py, please create file", "critical")
+    raise
+
+detector = None
+zone_pins = None  # pins keypad watches, kept so they can be handed over for light sleep and claimed back
+scan_interval = None
+
+
+# Create the detection backend and the zones it reports to
+# Returns an EventDetector when keypad is available, otherwise the ZoneBank used for polling
+def _addDetector(mqtt):
+    global detector, zone_pins, scan_interval
+
+    backend = system_data.get("zone_detection", "keypad")
+    interval = system_data.get("zone_scan_interval", 0.02)
+    my_log = logger.getLocalLogger()
+
+    if backend == "keypad" and keypad is not None:
+        zones = zone.buildZones(mqtt, claim_pins=False)
+        pins = [z.pinID for z in zones]
+        zone_pins = pins
+        scan_interval = interval
+        keys = keypad.Keys(pins, value_when_pressed=False, pull=True, interval=interval)
+        detector = EventDetector(zones, keys, keypad.Event(), interval)
+        my_log.log_message("Zone detection using keypad event queue", "info")
+    else:
+        zone.buildZones(mqtt)
+        detector = zone.getBank()
+        my_log.log_message("Zone detection using polling", "info")
+
+
+# Get the detection singleton, building the zones on first call
+# Both backends share the same interface: update(), get_open_mask() and get_bounces()
+def getDetector(mqtt: bool = False):
+    if detector is None:
+        _addDetector(mqtt)
+    return detector
+
+
+# Return True if the zone pins can be handed over to wake the board from light sleep
+# Only keypad detection can give its pins up and take them back, polled zones keep theirs
+def can_release_pins():
+    return zone_pins is not None and isinstance(getDetector(), EventDetector)
+
+
+# Hand the zone pins over so they can wake the board from light sleep, see cadence.py
+# Returns (pin, level) for every zone, level is what the pin read at its last event (True = open)
+# Returns None if the pins can't be handed over, claim_pins() takes them back
+def release_pins():
+    if can_release_pins() is False:
+        return None
+    detector.keys.deinit()
+    return [(zone_pins[index], (detector.raw >> index) & 1 == 1) for index in range(len(zone_pins))]
+
+
+# Take the zone pins back after a light sleep
+# The zones are resynchronized, a zone that changed while the board slept is reported on the next update()
+def claim_pins():
+    detector.keys = keypad.Keys(zone_pins, value_when_pressed=False, pull=True, interval=scan_interval)
+    detector.resync()
+
+
+# Drains a keypad style event queue and feeds each transition to the zone it belongs to
+# Bit N of raw is the last state keypad reported for zones[N]: 1 = open, 0 = closed
+# Every event goes through the debouncer, the snapshot only holds settled states
+# Should never be called directly outside of host testing, use getDetector() instead
+class EventDetector:
+    __slots__ = ("zones", "keys", "event", "mask", "raw", "snapshot", "primed", "booted", "reset_at", "settle_ms",
+                 "debouncer", "my_log")
+
+    def __init__(self, zones, keys, event, interval=0.02):
+        self.zones = tuple(zones)
+        self.keys = keys
+        self.event = event  # Reused for every event so draining the queue does not allocate
+        self.mask = (1 << len(self.zones)) - 1
+        self.raw = 0
+        self.snapshot = 0
+        self.primed = False
+        self.booted = False
+        self.settle_ms = int(interval * 2000)  # Two scans, long enough for keypad to queue the current state
+        self.debouncer = debounce.Debouncer([z.debounce_ms for z in zones])
+        self.my_log = logger.getLocalLogger()
+        self.keys.reset()
+        self.reset_at = ticks_ms()
+
+    # Drain the event queue, settle the debounced zones and report the zones that changed
+    # The reported time is the timestamp of the event that started the change
+    # Returns the bitmask of changed zones
+    def update(self, log_level: str = "notset"):
+        if self.primed is False:
+            return self._prime(log_level)
+
+        event = self.event
+        while self.keys.events.get_into(event):
+            if event.released:
+                self.raw |= 1 << event.key_number
+            else:
+                self.raw &= ~(1 << event.key_number)
+            self.debouncer.sample(self.raw, event.timestamp)
+
+        if self.keys.events.overflowed:
+            self.my_log.log_message("Zone event queue overflowed, resynchronizing zones", "warning")
+            self.resync()
+            return 0
+
+        changed = self.debouncer.settle(ticks_ms())
+        self.snapshot = self.debouncer.stable
+
+        pending = changed
+        index = 0
+        while pending:
+            if pending & 1:
+                latency.start_edge(self.debouncer.get_since(index))
+                latency.mark(latency.STAGE_CHECK)
+                self.zones[index].apply_event((self.snapshot >> index) & 1, self.debouncer.get_since(index), log_level)
+            pending >>= 1
+            index += 1
+        return changed
+
+    # Return the bitmask of open zones
+    def get_open_mask(self):
+        return self.snapshot
+
+    # Return the number of suppressed bounces for a zone index, or for all zones
+    def get_bounces(self, index=None):
+        if index is None:
+            return self.debouncer.get_total_bounces()
+        return self.debouncer.get_bounces(index)
+
+    # Throw away queued events and rebuild the snapshot from scratch
+    # After a reset keypad assumes every key is released and queues a pressed event for every closed zone
+    def resync(self):
+        self.keys.events.clear()
+        self.keys.reset()
+        self.reset_at = ticks_ms()
+        self.primed = False
+
+    # Build the snapshot after a reset: every zone is open until keypad reports it as closed
+    # The rebuilt state is taken as settled
+    # On boot every zone is reported, after an overflow only the zones that differ
+    def _prime(self, log_level):
+        now = ticks_ms()
+        if ticks_diff(now, self.reset_at) < self.settle_ms:
+            return 0
+
+        raw = self.mask
+        event = self.event
+        while self.keys.events.get_into(event):
+            if event.released:
+                raw |= 1 << event.key_number
+            else:
+                raw &= ~(1 << event.key_number)
+
+        if self.booted is True:
+            changed = raw ^ self.snapshot
+        else:
+            changed = self.mask
+            self.booted = True
+
+        self.raw = raw
+        self.snapshot = raw
+        self.debouncer.reset(raw, now)
+        self.primed = True
+
+        pending = changed
+        index = 0
+        while pending:
+            if pending & 1:
+                self.zones[index].apply_event((raw >> index) & 1, now, log_level)
+            pending >>= 1
+            index += 1
+        return changed
+
+
+# --- Fake event source for testing on a host without keypad --- #
+
+# Mirrors keypad.Event
+class FakeEvent:
+    __slots__ = ("key_number", "pressed", "timestamp")
+
+    def __init__(self, key_number=0, pressed=True, timestamp=0):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.timestamp = timestamp
+
+    @property
+    def released(self):
+        return not self.pressed
+
+
+# Mirrors keypad.EventQueue
+class FakeEventQueue:
+    def __init__(self, max_events=64):
+        self.max_events = max_events
+        self.queue = []
+        self.overflowed = False
+
+    def get(self):
+        event = FakeEvent()
+        if self.get_into(event) is False:
+            return None
+        return event
+
+    def get_into(self, event):
+        if len(self.queue) == 0:
+            return False
+        key_number, pressed, timestamp = self.queue.pop(0)
+        event.key_number = key_number
+        event.pressed = pressed
+        event.timestamp = timestamp
+        return True
+
+    def clear(self):
+        self.queue.clear()
+        self.overflowed = False
+
+    def put(self, key_number, pressed, timestamp):
+        if len(self.queue) >= self.max_events:
+            self.overflowed = True
+            return
+        self.queue.append((key_number, pressed, timestamp))
+
+
+# Mirrors keypad.Keys, zone states are set with open_zone()/close_zone() instead of real pins
+# All zones start closed
+class FakeKeys:
+    def __init__(self, key_count, max_events=64):
+        self.key_count = key_count
+        self.events = FakeEventQueue(max_events)
+        self.closed = [True] * key_count
+
+    # Like keypad, assume every key is released and queue a pressed event for every closed zone
+    def reset(self):
+        for key_number in range(self.key_count):
+            if self.closed[key_number] is True:
+                self.events.put(key_number, True, ticks_ms())
+
+    def open_zone(self, key_number, timestamp=None):
+        self._set(key_number, False, timestamp)
+
+    def close_zone(self, key_number, timestamp=None):
+        self._set(key_number, True, timestamp)
+
+    def _set(self, key_number, closed, timestamp):
+        if self.closed[key_number] is not closed:
+            self.closed[key_number] = closed
+            if timestamp is None:
+                timestamp = ticks_ms()
+            self.events.put(key_number, closed, timestamp)